@@ -1,32 +1,127 @@
 #!/usr/bin/env python3
 
-import argparse, sys, itertools
-import pandas as pd
+import argparse, sys, itertools, os, time, importlib.util, gzip, heapq, queue, threading, io, contextlib
+import array, json, socketserver
 from collections import defaultdict
 from operator import itemgetter
 from pathlib import Path
 
 ################################################################################################
 
+# Python note: numpy and pandas (and pyarrow) are imported inside the functions that use them.
+# Importing pandas takes a few hundred milliseconds, which is most of the run time for small inputs
+# (and for --help). Small text files are parsed without them (see read_python)
+
 # Python note: "commandlist" is to enable unit testing of argparse code
 # https://jugmac00.github.io/blog/testing-argparse-applications-the-better-way/
 
 def main(commandlist=None):
+    if commandlist is None:
+        commandlist = sys.argv[1:]
+    if commandlist and commandlist[0] == "batch":
+        return batch_main(commandlist[1:])
+    if commandlist and commandlist[0] == "serve":
+        return serve_main(commandlist[1:])
+    if commandlist and commandlist[0] == "verify":
+        return verify_main(commandlist[1:])
+
     args = parse_commandline(commandlist)
-    graph = NeighborGraph(args)
+    run_selection(args)
+
+################################################################################################
+
+def run_selection(args):
+    """Reads INFILE, selects subset (or assigns folds), and writes results.
+    Returns graph (or StreamSelection), with original number of names and selected nodes"""
+
+    # Estimate mode: predicted size of reduced set for several cutoffs, from sample of names
+    if args.estimate:
+        return run_estimate(args)
+
+    # Streaming mode: single pass over grouped INFILE, without building graph
+    if args.stream:
+        selection = StreamSelection(args)
+        selection.run()
+        if args.refine:
+            selection.refine()
+        selection.write_results(args)
+        return selection
+
+    graph = make_graph(args)
+
+    # Fold mode: partition all items into folds, without reducing
+    if args.folds:
+        graph.write_folds(args)
+        return graph
+
+    reduce_graph(graph, args)
+    graph.write_results(args)
+    return graph
+
+################################################################################################
+
+def make_graph(args, parsed=None):
+    """Reads INFILE (unless already parsed) and returns graph. Representation (dict-of-sets, bit rows,
+    or edge arrays) is selected by args.graph, or by edge density of the parsed graph and algorithm (auto)"""
+
+    progress = Progress(args.progress_interval if args.progress else None)
+    if args.max_memory and parsed is None:
+        plan_memory(args)
+    checkpoint = Checkpoint(args, progress) if args.checkpoint else None
+    if parsed is None and checkpoint:
+        parsed = checkpoint.load_parsed()
+    if parsed is None:
+        parsed = PairReader(args, progress).read()
+        if checkpoint:
+            checkpoint.save_parsed(parsed)
+    graphtype = args.graph
+    if graphtype == "auto":
+        graphtype = auto_graphtype(len(parsed["names"]), len(parsed["edges"][0]), args.algorithm)
+    if graphtype == "bitset":
+        progress.write("using bitset graph (dense)")
+        graph = BitsetGraph(args, parsed, progress)
+    elif graphtype == "csr":
+        progress.write("using CSR graph (edge arrays)")
+        graph = CsrGraph(args, parsed, progress)
+    else:
+        graph = NeighborGraph(args, parsed, progress)
+    graph.checkpoint = checkpoint
+    return graph
+
+################################################################################################
 
-    # If input has no neighbors: do nothing, print results. Otherwise: proceed
+def auto_graphtype(nnames, npairs, algorithm):
+    """Returns graph representation selected by --graph auto for graph with nnames nodes and npairs
+    neighbor pairs: bit rows for small dense graphs, edge arrays for luby and max, dict-of-sets otherwise"""
+
+    average_degree = 2 * npairs / max(nnames, 1)
+    if algorithm == "luby":
+        return "csr"
+    if nnames <= dense_max_nodes and average_degree >= max(dense_min_degree, nnames / 64):
+        return "bitset"
+    if algorithm == "max":
+        return "csr"
+    return "sets"
+
+################################################################################################
+
+def reduce_graph(graph, args):
+    """Removes keepfile neighbors (if any), and reduces graph using selected algorithm"""
+
+    # If input has no neighbors: do nothing. Otherwise: proceed
     if graph.origdata["max_degree"] > 0:
         if args.keepfile:
             graph.remove_keepfile_neighbors()
+        if graph.checkpoint:
+            graph.checkpoint.restore_state(graph)
 
         if args.algorithm == "min":
             graph.reduce_from_bottom()
+        elif args.algorithm == "luby":
+            graph.reduce_luby()
         else:
             graph.reduce_from_top()
 
-    graph.write_results(args)
-
 ################################################################################################
 
 # Python note: "commandlist" is to enable unit testing of argparse code
@@ -37,8 +132,53 @@ def parse_commandline(commandlist):
     args = parser.parse_args(commandlist)
     if args.valuetype is None:
         parser.error("Must specify whether values in INFILE are distances (--val dist) or similarities (--val sim)")
-    if args.cutoff is None:
+    if args.cutoff is None and not args.estimate:
         parser.error("Must provide cutoff (option -c)")
+    if args.estimate and (args.stream or args.folds or args.clusterfile or args.keepfile or args.checkpoint
+                          or input_format(args) in ("vectors", "fasta")):
+        parser.error("--estimate can not be used with --stream, --folds, --clusters, -k, --checkpoint, "
+                     "or vector or FASTA input")
+    if args.estimate_size < 1:
+        parser.error("--estimate-size must be positive")
+    if args.chunk is None:
+        args.chunk = auto_chunksize(args.prefetch, args.max_memory)
+    elif args.chunk <= 0:
+        parser.error("Chunk size (--chunk) must be positive")
+    if args.folds is not None and args.folds < 2:
+        parser.error("Number of folds (--folds) must be at least 2")
+    if args.clusterfile and args.algorithm != "min":
+        parser.error("Cluster output (--clusters) requires greedy-min algorithm (--algo min)")
+    if args.algorithm == "luby" and args.graph not in ("auto", "csr"):
+        parser.error("--algo luby requires edge array graph (--graph csr or auto)")
+    if (input_format(args) == "text" and args.engine == "python"
+                    and Path(args.infile).suffix.lower() in compression_suffixes):
+        parser.error("Compressed INFILE can not be read with --engine python")
+    if args.checkpoint and args.stream:
+        parser.error("--checkpoint can not be used with --stream")
+    if args.refine and not args.stream:
+        parser.error("--refine can only be used with --stream")
+    if args.stream and (args.folds or args.clusterfile or input_format(args) in ("vectors", "fasta")):
+        parser.error("--stream can not be used with --folds, --clusters, or vector or FASTA input")
+    if args.pair_agg != "none" and (args.stream or args.allpairs or input_format(args) in ("vectors", "fasta")):
+        parser.error("--pair-agg can not be used with --stream, --allpairs, or vector or FASTA input")
+    if input_format(args) == "vectors":
+        args.metric = args.metric or "euclidean"
+        if args.metric not in vector_metrics:
+            parser.error(f"Metric for vector input must be one of: {', '.join(vector_metrics)}")
+        if args.metric != "cosine" and args.valuetype == "sim":
+            parser.error(f"Metric {args.metric} gives distances: use --val dist (or --metric cosine)")
+    if input_format(args) == "fasta":
+        args.metric = args.metric or "identity"
+        if args.metric not in fasta_metrics:
+            parser.error(f"Metric for FASTA input must be one of: {', '.join(fasta_metrics)}")
+        if args.kmer is not None and args.kmer < 1:
+            parser.error("k-mer size (--kmer) must be positive")
+        if args.sketchsize < 1 or (args.bands is not None and not 1 <= args.bands <= args.sketchsize):
+            parser.error("--sketch-size must be positive, and --bands between 1 and sketch size")
+        # Only pairs proposed by LSH are compared: average over all pairs is not known
+        args.nostats = True
+    if input_format(args) in ("parquet", "arrow") and importlib.util.find_spec("pyarrow") is None:
+        parser.error("Reading Parquet or Arrow input requires pyarrow (python3 -m pip install pyarrow)")
     return args
 
 ################################################################################################
@@ -60,8 +200,10 @@ def build_parser():
     #########################################################################################
 
     parser.add_argument("--algo", action='store', dest="algorithm", metavar="ALGORITHM",
-                      choices=["min", "max"], default="min",
-                      help="algorithm: %(choices)s [default: %(default)s]")
+                      choices=["min", "max", "luby"], default="min",
+                      help="algorithm: %(choices)s. luby: parallel rounds (selects many nodes at once, "
+                           "fastest for large graphs, but usually slightly smaller subset than min) "
+                           "[default: %(default)s]")
 
     parser.add_argument("--val", action='store', dest="valuetype", metavar="VALUETYPE",
                       choices=["dist", "sim"],
@@ -73,195 +215,3162 @@ def build_parser():
     parser.add_argument("-k", action="store", dest="keepfile", metavar="KEEPFILE", type=Path,
                           help="(optional) file with names of items that must be kept (one name per line)")
 
-    parser.add_argument("--chunk", action='store', type=float, default=1, help=argparse.SUPPRESS)
+    parser.add_argument("--informat", action="store", dest="informat", metavar="FORMAT",
+                      choices=["auto", "text", "parquet", "arrow", "vectors", "fasta"], default="auto",
+                      help="format of INFILE: %(choices)s. Parquet and Arrow IPC input requires pyarrow. "
+                           "vectors: one feature vector per item (text: name x1 x2 ..., or .npy matrix), "
+                           "pairs are computed using --metric. fasta: sequences, pairs are found and "
+                           "estimated using k-mer MinHash sketches. auto: based on suffix (.parquet, .pq, or "
+                           "directory: parquet; .arrow, .feather, .ipc: arrow; .npy: vectors; .fasta, .fa, "
+                           ".fna, .faa, .fas: fasta) [default: %(default)s]")
+
+    parser.add_argument("--metric", action="store", dest="metric", metavar="METRIC",
+                      choices=["euclidean", "manhattan", "cosine", "jaccard", "identity"],
+                      help="value computed for pairs of feature vectors (euclidean, manhattan, cosine) or "
+                           "FASTA sequences (jaccard, identity). cosine, jaccard, identity: similarity "
+                           "with --val sim, 1 - similarity with --val dist "
+                           "[default: euclidean for vectors, identity for FASTA]")
+
+    parser.add_argument("--kmer", action="store", type=int, dest="kmer", metavar="K",
+                          help="(optional) k-mer size for FASTA input [default: 16 for DNA, 5 for protein]")
+
+    parser.add_argument("--sketch-size", action="store", type=int, dest="sketchsize", metavar="S", default=128,
+                          help="(optional) number of MinHash values per sequence for FASTA input. Larger: "
+                               "more accurate estimates, but slower [default: %(default)s]")
+
+    parser.add_argument("--bands", action="store", type=int, dest="bands", metavar="B",
+                          help="(optional) number of LSH bands for FASTA input. More bands: more candidate "
+                               "pairs compared (fewer missed neighbors, but slower) [default: based on cutoff]")
+
+    parser.add_argument("--engine", action="store", dest="engine", metavar="ENGINE",
+                      choices=["auto", "pandas", "python"], default="auto",
+                      help="parser for text INFILE: %(choices)s. python: no pandas import (faster for small "
+                           "files). auto: python for uncompressed files below 4 MB [default: %(default)s]")
+
+    parser.add_argument("--allpairs", action="store_true",
+                          help="(optional) INFILE has exactly one line per pair of items: collect names from "
+                               "first column (plus pairs of first item), instead of from both columns")
+
+    parser.add_argument("--no-stats", action="store_true", dest="nostats",
+                          help="(optional) skip computing average similarity/distance of original set")
+
+    parser.add_argument("--pair-agg", action="store", dest="pair_agg", metavar="POLICY",
+                      choices=["none", "max", "min", "mean", "first"], default="none",
+                      help="how values are combined when INFILE has several lines for same pair (e.g. "
+                           "both a b and b a): %(choices)s. none: every line is used (pair is neighbor if any "
+                           "line passes cutoff). first: value on first line for pair. Lines where name1 is "
+                           "name2 are always skipped [default: %(default)s]")
+
+    parser.add_argument("--sort", action="store", dest="sort", metavar="ORDER",
+                      choices=["input", "name", "none"], default="input",
+                      help="order of names in OUTFILE: %(choices)s. input: order in which names were first "
+                           "seen in INFILE. none: same as input (kept for compatibility) [default: %(default)s]")
+
+    parser.add_argument("--outformat", action="store", dest="outformat", metavar="FORMAT",
+                      choices=["text", "npy"], default="text",
+                      help="format of OUTFILE: %(choices)s. npy: boolean numpy mask over all names in input "
+                           "order (names written to OUTFILE with suffix .names.txt). "
+                           "Text output is gzip compressed if OUTFILE ends in .gz [default: %(default)s]")
+
+    parser.add_argument("--clusters", action="store", dest="clusterfile", metavar="CLUSTERFILE", type=Path,
+                          help="(optional) also write file listing, for each item in original set, the "
+                               "retained item that caused its removal (name representative). "
+                               "Only for --algo min")
+
+    parser.add_argument("--folds", action="store", type=int, dest="folds", metavar="K",
+                          help="(optional) instead of reducing: split all items into K cross-validation folds "
+                               "such that no two neighbors are in different folds. OUTFILE then lists: "
+                               "name fold")
+
+    parser.add_argument("--stream", action="store_true",
+                          help="(optional) fast approximate selection in single pass, with little memory: "
+                               "INFILE lines must be grouped by first name. Items are accepted in order, "
+                               "unless they are neighbors of an accepted item (Hobohm algorithm 1)")
+
+    parser.add_argument("--refine", action="store_true",
+                          help="(optional) with --stream: second pass, improving selection using --algo on "
+                               "selected items and items with only one selected neighbor")
+
+    parser.add_argument("--progress", action="store_true",
+                          help="(optional) report progress of parsing and reduction on stderr")
+
+    parser.add_argument("--progress-interval", action="store", type=float, dest="progress_interval",
+                          metavar="SECONDS", default=5.0,
+                          help="(optional) minimum interval between progress reports [default: %(default)s]")
+
+    parser.add_argument("--chunk", action='store', type=float, dest="chunk", metavar="MLINES",
+                          help="(optional) number of lines (in millions) parsed at a time. Larger chunks are "
+                               "faster, but use more memory [default: based on available memory]")
+
+    parser.add_argument("--prefetch", action='store', type=int, dest="prefetch", metavar="N", default=0,
+                          help="(optional) number of chunks read ahead in background thread, while current "
+                               "chunk is being processed. Useful if reading INFILE is slow (e.g. network "
+                               "filesystem). 0: no background reading [default: %(default)s]")
+
+    parser.add_argument("--graph", action="store", dest="graph", metavar="TYPE",
+                      choices=["auto", "sets", "bitset", "csr"], default="auto",
+                      help="graph representation: %(choices)s. bitset: packed bit rows, much faster for dense "
+                           "graphs (memory: n*n/8 bytes). csr: sorted edge arrays, uses least memory "
+                           "(fast for --algo max, required for --algo luby). auto: bitset when average degree "
+                           "is at least 100 (and n/64), for up to 30,000 names, otherwise csr for --algo "
+                           "max or luby (always csr for luby) "
+                           "[default: %(default)s]")
+
+    parser.add_argument("--estimate", action="store", type=parse_cutoffs, dest="estimate", metavar="CUTOFFS",
+                          help="(optional) instead of reducing: estimate size of reduced set for each cutoff "
+                               "in comma separated list (e.g. 0.5,0.7,0.9), using greedy-min on random sample "
+                               "of names. OUTFILE then lists: cutoff, estimate, 95%% confidence interval")
+
+    parser.add_argument("--estimate-size", action="store", type=int, dest="estimate_size", metavar="N",
+                          default=5000,
+                          help="(optional) number of names sampled for --estimate [default: %(default)s]")
+
+    parser.add_argument("--max-memory", action="store", type=parse_memory, dest="max_memory", metavar="SIZE",
+                          help="(optional) memory available (e.g. 8G): chunk size (also below 1 million "
+                               "lines) and graph representation are chosen to fit, based on size of graph "
+                               "estimated from first lines of INFILE. The plan is written to stderr")
+
+    parser.add_argument("--checkpoint", action="store", dest="checkpoint", metavar="DIR", type=Path,
+                          help="(optional) save parsed graph, and snapshots of reduction state (every "
+                               f"{checkpoint_interval:.0f} s), in DIR. If run is interrupted: rerun with same "
+                               "options to continue from last snapshot")
     return parser
 
 ################################################################################################
+
+# Suffixes for which pandas would otherwise have inferred compression from the file name.
+# Needed because infile is opened here (to track bytes read), and pandas can not infer from a handle
+
+compression_suffixes = {".gz":"gzip", ".bz2":"bz2", ".zip":"zip", ".xz":"xz", ".zst":"zstd"}
+
+small_file_limit = 4_000_000      # bytes
+# pandas text parsing: no name is read as missing value (names such as NA, null, or NaN are kept), and
+# in value column only spellings of NaN accepted by float() are NaN (as in --engine python)
+text_na_options = {"keep_default_na": False, "na_values": {"val": ["nan", "NaN", "NAN", "-nan", "+nan"]}}
+nametable_small = 100_000         # NameTable: number of names above which numpy index is used
+nametable_block = 8_192           # NameTable: number of names whose bytes are compared at a time
+parquet_suffixes = {".parquet", ".pq"}
+arrow_suffixes = {".arrow", ".feather", ".ipc", ".arrows"}
+
+fasta_suffixes = {".fasta", ".fa", ".fna", ".faa", ".fas"}
+vector_metrics = ["euclidean", "manhattan", "cosine"]
+fasta_metrics = ["jaccard", "identity"]
+
+dense_max_nodes = 30_000          # --graph auto: largest graph stored as bit rows (approx 110 MB)
+dense_min_degree = 100            # --graph auto: smallest average degree for using bit rows
+luby_seed = 1                     # --algo luby: seed for random priorities (results are reproducible)
+
+plan_sample_lines = 100_000       # --max-memory: lines read from start of INFILE to estimate graph size
+plan_bytes = {"sets": (300, 120), "csr": (90, 40)}    # --max-memory: bytes per name, per neighbor pair
+estimate_groups = 10              # --estimate: number of groups of sampled names for jackknife intervals
+estimate_levels = [1/8, 1/4, 1/2, 1]   # --estimate: nested samples (fractions of sample) used for extrapolation
+estimate_columns = ["cutoff", "estimate", "ci_low", "ci_high", "sampled", "selected"]
+checkpoint_interval = 60.0        # --checkpoint: minimum seconds between snapshots of reduction state
+
+# Options that change the parsed graph. Saved (--checkpoint) or cached (serve) graph is only used if
+# INFILE and these options are unchanged
+parse_options = ["cutoff", "valuetype", "allpairs", "nostats", "pair_agg", "metric", "kmer", "sketchsize",
+                 "bands"]
+
 ################################################################################################
 
-class NeighborGraph:
-    """Stores information about nodes and their connections.
-    Methods for interrogating and changing graph"""
+def input_format(args):
+    """Returns format of INFILE ("text", "parquet", "arrow", "vectors", or "fasta"), based on
+    --informat or file suffix (FASTA files may be compressed)"""
+
+    if args.informat != "auto":
+        return args.informat
+    infile = Path(args.infile)
+    if infile.suffix.lower() in parquet_suffixes or infile.is_dir():
+        return "parquet"
+    if infile.suffix.lower() in arrow_suffixes:
+        return "arrow"
+    if infile.suffix.lower() == ".npy":
+        return "vectors"
+    if infile.suffix.lower() in compression_suffixes:
+        infile = infile.with_suffix("")
+    if infile.suffix.lower() in fasta_suffixes:
+        return "fasta"
+    return "text"
 
-    def __init__(self, args):
-        nodes,neighbors,valuesum = self.parsing(args)
+################################################################################################
 
-        # Convert to regular dict (not defaultdict) to avoid gotchas with key generation on access
-        # Python note: would it be faster to just use dict.setdefault() during creation?
-        self.neighbors = dict(neighbors)
-        self.nodes = nodes
-        self.neighbor_count = {}
-        degreelist = []
-        for name in self.neighbors:
-            degree = len(self.neighbors[name])
-            self.neighbor_count[name] = degree
-            degreelist.append(degree)
-        self.origdata = {}
-        self.origdata["orignum"] = len(self.nodes)
-        self.origdata["average_degree"] =  sum(degreelist) / self.origdata["orignum"]
-        self.origdata["max_degree"] =  max(degreelist, default=0)
-        self.origdata["min_degree"] =  min(degreelist, default=0)
-        n = self.origdata["orignum"]
-        self.origdata["average_dist"] = valuesum * 2 / (n * (n - 1))
+# Helper functions for Arrow arrays. Dictionary-encoded name columns are handled by working on
+# the (integer) indices, and only converting the dictionary entries that are actually used
 
-        self.keepset = set()
-        if args.keepfile:
-            with open(args.keepfile, "r") as keepfile:
-                for line in keepfile:
-                    node = line.strip()
-                    self.keepset.add(node)
+def arrow_factorized(arr):
+    """Returns tuple (codes, uniques) for Arrow array, like pd.factorize:
+    codes numbered in order of first appearance, and list of names for codes"""
+
+    import pandas as pd
+    if hasattr(arr, "dictionary"):
+        codes, used = pd.factorize(arr.indices.to_numpy(zero_copy_only=False))
+        return codes, arr.dictionary.take(used).to_pylist()
+    encoded = arr.dictionary_encode()
+    return encoded.indices.to_numpy(zero_copy_only=False), encoded.dictionary.to_pylist()
+
+def decoded(arr):
+    """Returns Arrow array with dictionary encoding (if any) removed"""
+
+    if hasattr(arr, "dictionary"):
+        return arr.dictionary_decode()
+    return arr
+
+def without_missing_names(batch):
+    """Returns Arrow record batch unchanged. Raises exception if name columns contain nulls"""
+
+    if batch.column(0).null_count or batch.column(1).null_count:
+        raise Exception("INFILE has missing (empty or null) names")
+    return batch
+
+def row_group_has_neighbors(rowgroup, args):
+    """Returns False if min/max statistics for value column of Parquet row group show that
+    no values pass cutoff. Returns True otherwise (also if there are no statistics)"""
+
+    stats = rowgroup.column(2).statistics
+    if stats is None or not stats.has_min_max:
+        return True
+    if args.valuetype == "sim":
+        return stats.max > args.cutoff
+    return stats.min < args.cutoff
+
+################################################################################################
+
+def first_seen(columns):
+    """Returns pandas array of unique names in order of first appearance in chunk, reading row by row
+    (and left to right within rows). This makes order independent of chunk size.
+    Input: list with tuple for each column: (codes, uniques, rows). codes: integer code for each entry,
+    numbered in order of first appearance (as from pd.factorize). uniques: names for codes.
+    rows: row number of each entry (None: entries are rows 0, 1, 2, ...)"""
+
+    import numpy as np
+    import pandas as pd
+    keys = []
+    for col, (codes, uniques, rows) in enumerate(columns):
+        # First occurrence of each code is where running maximum of codes increases
+        firstpos = np.flatnonzero(np.diff(np.maximum.accumulate(codes), prepend=-1) > 0)
+        if rows is not None:
+            firstpos = rows[firstpos]
+        keys.append(firstpos * len(columns) + col)
+    # Python note: names are kept in pandas (not Python list) until NameTable.add(), which uses less memory
+    names = pd.concat([pd.Series(uniques, dtype="str") for codes, uniques, rows in columns], ignore_index=True)
+    order = np.argsort(np.concatenate(keys), kind="stable")
+    return names.take(order).drop_duplicates().array
+
+################################################################################################
+
+def pair_values(x, y, metric):
+    """Returns array with value for each pair of rows in x and y (shape: len(x), len(y)).
+    metric: euclidean, manhattan, or cosine (similarity: rows must be normalized to length 1)"""
+
+    import numpy as np
+    if metric == "cosine":
+        return x @ y.T
+    if metric == "euclidean":
+        # |x - y|**2 = |x|**2 + |y|**2 - 2 x.y
+        sqdist = (x * x).sum(axis=1)[:, None] + (y * y).sum(axis=1)[None, :] - 2 * (x @ y.T)
+        return np.sqrt(np.maximum(sqdist, 0))
+    values = np.zeros((len(x), len(y)))
+    for dim in range(x.shape[1]):
+        values += np.abs(x[:, dim, None] - y[None, :, dim])
+    return values
+
+################################################################################################
+
+# Helper functions for FASTA input: k-mer MinHash sketches, and locality sensitive hashing (LSH)
+
+def read_fasta_file(filename):
+    """Returns (list of names, list of sequences as upper case bytes) from FASTA file (may be gzipped).
+    Name is first word of header line"""
+
+    names = []
+    seqs = []
+    parts = None
+    opener = gzip.open if Path(filename).suffix.lower() == ".gz" else open
+    with opener(filename, "rb") as fastafile:
+        for line in fastafile:
+            if line.startswith(b">"):
+                if parts is not None:
+                    seqs.append(b"".join(parts).upper())
+                fields = line[1:].decode().split()
+                names.append(fields[0] if fields else "")
+                parts = []
+            elif parts is not None:
+                parts.append(line.strip())
+            elif line.strip():
+                raise Exception(f"FASTA file must start with header line (>name): {filename}")
+    if parts is not None:
+        seqs.append(b"".join(parts).upper())
+    if len(set(names)) != len(names) or "" in names:
+        raise Exception("Names in FASTA INFILE must be unique and non-empty")
+    return names, seqs
+
+################################################################################################
+
+def mix64(x):
+    """Returns hashed version of uint64 array (splitmix64 finalizer)"""
+
+    import numpy as np
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xbf58476d1ce4e5b9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+################################################################################################
+
+def minhash_sketch(seq, k, sketchsize, blocksize=8192):
+    """Returns MinHash sketch of k-mers in seq (bytes): for each of sketchsize hash functions, the
+    minimum hash value over all k-mers. Sequences shorter than k: all values are max uint64"""
+
+    import numpy as np
+    sketch = np.full(sketchsize, np.iinfo(np.uint64).max, dtype=np.uint64)
+    nkmers = len(seq) - k + 1
+    if nkmers <= 0:
+        return sketch
+    residues = np.frombuffer(seq, dtype=np.uint8).astype(np.uint64)
+    kmerhash = np.zeros(nkmers, dtype=np.uint64)
+    for i in range(k):
+        kmerhash = kmerhash * np.uint64(257) + residues[i:i + nkmers]
+    kmerhash = np.unique(mix64(kmerhash))
+    seeds = mix64(np.arange(1, sketchsize + 1, dtype=np.uint64))
+    for start in range(0, len(kmerhash), blocksize):
+        block = mix64(kmerhash[start:start + blocksize, None] ^ seeds[None, :])
+        np.minimum(sketch, block.min(axis=0), out=sketch)
+    return sketch
+
+################################################################################################
+
+def lsh_bands(sketchsize, jaccard, recall=0.99):
+    """Returns number of LSH bands, such that pairs with given Jaccard similarity are proposed with
+    probability at least recall: 1 - (1 - J**rows)**bands. Uses fewest bands (largest rows per band)
+    possible, to avoid proposing dissimilar pairs"""
+
+    for rows in range(sketchsize, 0, -1):
+        bands = sketchsize // rows
+        if jaccard > 0 and 1 - (1 - jaccard**rows)**bands >= recall:
+            return bands
+    return sketchsize
+
+################################################################################################
+
+def lsh_candidates(sketches, bands):
+    """Returns sorted array of candidate pairs (as i * n + j, with i < j): sequences whose sketches
+    are identical in all rows of at least one band. Empty sketches (sequences shorter than k) are
+    never candidates"""
+
+    import numpy as np
+    n, sketchsize = sketches.shape
+    rows = sketchsize // bands
+    nonempty = np.flatnonzero((sketches != np.iinfo(np.uint64).max).any(axis=1))
+    candidates = []
+    for band in range(bands):
+        keys = np.zeros(len(nonempty), dtype=np.uint64)
+        for col in range(band * rows, (band + 1) * rows):
+            keys = mix64(keys ^ sketches[nonempty, col])
+        order = np.argsort(keys, kind="stable")
+        sortedkeys = keys[order]
+        starts = np.flatnonzero(np.diff(sortedkeys, prepend=sortedkeys[:1] ^ np.uint64(1)) != 0)
+        stops = np.append(starts[1:], len(sortedkeys))
+        for start, stop in zip(starts[stops - starts > 1].tolist(), stops[stops - starts > 1].tolist()):
+            members = nonempty[order[start:stop]]
+            ids1, ids2 = np.triu_indices(len(members), k=1)
+            pair1 = np.minimum(members[ids1], members[ids2]).astype(np.int64)
+            pair2 = np.maximum(members[ids1], members[ids2]).astype(np.int64)
+            candidates.append(pair1 * n + pair2)
+    if not candidates:
+        return np.zeros(0, dtype=np.int64)
+    return np.unique(np.concatenate(candidates))
+
+################################################################################################
+
+def text_engine(args):
+    """Returns engine used for parsing text INFILE ("pandas" or "python"). auto: plain Python for
+    small, uncompressed files, where importing pandas would take longer than parsing"""
+
+    if args.engine != "auto":
+        return args.engine
+    if Path(args.infile).suffix.lower() in compression_suffixes:
+        return "pandas"
+    try:
+        filesize = os.path.getsize(args.infile)
+    except OSError:
+        return "pandas"
+    if filesize < small_file_limit:
+        return "python"
+    return "pandas"
+
+################################################################################################
+
+def available_memory():
+    """Returns number of bytes of memory available for new processes: MemAvailable in /proc/meminfo
+    (which includes page cache that can be freed), or free memory if that can not be read"""
+
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return 4e9
+
+def auto_chunksize(prefetch, max_memory=None):
+    """Returns chunk size (in millions of lines), such that chunks in memory (current plus prefetched)
+    use at most around 5% of available memory (approx 200 bytes per parsed line). Chunks are between
+    1 and 10 million lines, since smaller chunks are much slower. If max_memory is given, chunks also
+    use at most around 5% of it, and may then be smaller (down to 0.1 million lines)"""
+
+    mlines = min(max(available_memory() * 0.05 / (200 * (prefetch + 1)) / 1e6, 1), 10)
+    if max_memory:
+        mlines = min(mlines, max(max_memory * 0.05 / (200 * (prefetch + 1)) / 1e6, 0.1))
+    return mlines
+################################################################################################
+
+def parse_memory(text):
+    """argparse type for memory sizes: number of bytes, with optional suffix K, M, G, or T (e.g. 8G).
+    Returns number of bytes"""
+
+    units = {"K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+    size = text.strip().upper()
+    if size.endswith("B"):
+        size = size[:-1]
+    try:
+        if size and size[-1] in units:
+            return int(float(size[:-1]) * units[size[-1]])
+        return int(float(size))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid memory size: '{text}' (examples: 500M, 8G)")
+
+################################################################################################
+
+def sample_head(args, nrows=plan_sample_lines):
+    """Reads first nrows lines (text) or rows (Parquet, Arrow) of INFILE.
+    Returns dict with keys: rows (number read), neighbors (number passing cutoff), names (set of
+    names), totalrows (estimated number of rows in INFILE).
+    Returns None if size of INFILE can not be estimated (zip or zstd compression, Arrow stream)"""
+
+    sample = {"rows": 0, "neighbors": 0, "names": set()}
+    def add_rows(name1s, name2s, values):
+        sample["rows"] += len(name1s)
+        sample["names"].update(name1s, name2s)
+        if args.valuetype == "sim":
+            sample["neighbors"] += sum(val > args.cutoff for val in values)
+        else:
+            sample["neighbors"] += sum(val < args.cutoff for val in values)
+
+    if input_format(args) == "text":
+        import bz2, lzma
+        openers = {"gzip": gzip.open, "bz2": bz2.open, "xz": lzma.open}
+        compression = compression_suffixes.get(Path(args.infile).suffix.lower())
+        if compression is not None and compression not in openers:
+            return None
+        with open(args.infile, "rb") as rawfile:
+            infile = openers[compression](rawfile) if compression else rawfile
+            lines = list(itertools.islice(infile, nrows))
+            complete = len(lines) < nrows or not infile.readline()
+            bytesread = rawfile.tell()
+        rows = [row for row in (line.decode().split() for line in lines) if len(row) == 3]
+        add_rows([row[0] for row in rows], [row[1] for row in rows], [float(row[2]) for row in rows])
+        if complete:
+            sample["totalrows"] = sample["rows"]
+        else:
+            sample["totalrows"] = sample["rows"] * os.path.getsize(args.infile) / max(bytesread, 1)
+    else:
+        done = total = 0
+        for batch, has_neighbors, done, total in PairReader(args, Progress(None)).arrow_batches():
+            name1s = batch.column(0).to_pylist()
+            values = batch.column(2).to_pylist() if has_neighbors else []
+            add_rows(name1s, batch.column(1).to_pylist(), values)
+            if sample["rows"] >= nrows:
+                break
+        if total == 0:
+            return None
+        sample["totalrows"] = sample["rows"] * total / done
+    return sample
+
+################################################################################################
+
+def estimate_names(nsample, nseen, ntotal):
+    """Returns estimated number of distinct names in INFILE, when nseen distinct names were seen among
+    the first nsample names (of ntotal). Names are assumed to be drawn at random from n names, so
+    nseen = n * (1 - exp(-nsample / n)), which is solved for n (by bisection). For sorted input where
+    all names are seen early, this gives nseen. Can not exceed linear extrapolation of nseen"""
+
+    import math
+    upper = nseen * ntotal / nsample
+    if nsample >= ntotal or nseen >= nsample * (1 - 1e-9):
+        return upper
+    lower = nseen
+    if upper * (1 - math.exp(-nsample / upper)) <= nseen:
+        return upper
+    for i in range(100):
+        n = (lower + upper) / 2
+        if n * (1 - math.exp(-nsample / n)) < nseen:
+            lower = n
+        else:
+            upper = n
+    return (lower + upper) / 2
+
+################################################################################################
+
+def plan_memory(args):
+    """Estimates size of graph from head of INFILE, and selects graph representation that fits in
+    args.max_memory (fastest first: the one --graph auto would use, then csr). Writes plan to stderr"""
+
+    if input_format(args) in ("vectors", "fasta"):
+        sys.stderr.write("# Memory plan: graph size not estimated for vector or FASTA input\n")
+        return
+    sample = sample_head(args)
+    if sample is None or sample["rows"] == 0:
+        sys.stderr.write("# Memory plan: size of INFILE can not be estimated from its first lines\n")
+        return
+
+    # Names: all-vs-all files have n*(n-1)/2 lines. Otherwise: estimated from number of distinct
+    # names in sample (two per line)
+    totalrows = sample["totalrows"]
+    if args.allpairs:
+        nnames = (1 + (1 + 8 * totalrows) ** 0.5) / 2
+    else:
+        nnames = estimate_names(2 * sample["rows"], len(sample["names"]), 2 * totalrows)
+    npairs = totalrows * sample["neighbors"] / sample["rows"]
+    namelength = sum(map(len, sample["names"])) / len(sample["names"])
+    parsedbytes = nnames * (namelength + 32) + npairs * 8
+    chunkbytes = 200 * args.chunk * 1e6 * (args.prefetch + 1)
+    graphbytes = {"sets": nnames * plan_bytes["sets"][0] + npairs * plan_bytes["sets"][1],
+                  "csr": nnames * plan_bytes["csr"][0] + npairs * plan_bytes["csr"][1],
+                  "bitset": nnames * nnames / 8 + nnames * 16}
+
+    graphtype = args.graph
+    if graphtype == "auto":
+        candidates = [auto_graphtype(nnames, npairs, args.algorithm)]
+        if candidates[0] != "csr":
+            candidates.append("csr")
+        fits = [name for name in candidates if parsedbytes + graphbytes[name] <= args.max_memory]
+        graphtype = fits[0] if fits else candidates[-1]
+        if graphtype != candidates[0]:
+            args.graph = graphtype
+    peak = max(parsedbytes + chunkbytes, parsedbytes + graphbytes[graphtype])
+
+    sys.stderr.write(f"# Memory plan: estimated from first {sample['rows']:,} lines: {totalrows:,.0f} lines, "
+                     f"{nnames:,.0f} names, {npairs:,.0f} neighbor pairs. Graph: {graphtype}, "
+                     f"chunk: {args.chunk:.2f} million lines. Estimated peak memory: {peak / 2**20:,.0f} MB "
+                     f"(--max-memory: {args.max_memory / 2**20:,.0f} MB)\n")
+    if peak > args.max_memory:
+        sys.stderr.write("# Memory warning: estimated memory use exceeds --max-memory. Consider stricter "
+                         "cutoff, or --stream (single pass, for INFILE grouped by first name)\n")
+
+
+################################################################################################
+################################################################################################
+
+class Prefetcher:
+    """Iterates over items from iterable, which is consumed in background thread up to maxdepth
+    items ahead. Overlaps I/O (and parsing in C code that releases the GIL) with processing.
+    Keeps track of queue depth seen by consumer, and time spent waiting for items"""
+
+    def __init__(self, iterable, maxdepth=2):
+        self.queue = queue.Queue(maxsize=maxdepth)
+        self.maxdepth = maxdepth
+        self.stopped = threading.Event()
+        self.depthsum = 0
+        self.nitems = 0
+        self.wait_time = 0.0
+        self.thread = threading.Thread(target=self.produce, args=(iterable,), daemon=True)
+        self.thread.start()
 
     ############################################################################################
 
-    def parsing(self, args):
-        nodes = set()
-        neighbors = defaultdict(set)
-        valuesum = 0
-        chunksize = args.chunk * 1_000_000
-        reader = pd.read_csv(args.infile, engine="c", sep=r"\s+", chunksize=chunksize,
-                             names=["name1", "name2", "val"], dtype={"name1":str, "name2":str, "val":float})
-        for df in reader:
-            nodes.update(df["name1"].values)
-            nodes.update(df["name2"].values)
-            valuesum += df["val"].values.sum()
+    def put(self, item):
+        """Put item on queue. Gives up if consumer has stopped. Returns False if so"""
 
-            if args.valuetype == "sim":
-                df = df.loc[df["val"].values > args.cutoff]
-            else:
-                df = df.loc[df["val"].values < args.cutoff]
-            for name1, name2 in zip(df["name1"].values, df["name2"].values):
-                neighbors[name1].add(name2)
-                neighbors[name2].add(name1)
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    ############################################################################################
+
+    def produce(self, iterable):
+        try:
+            for item in iterable:
+                if not self.put((False, item)):
+                    return
+            self.put((True, None))
+        except BaseException as err:
+            self.put((True, err))
+
+    ############################################################################################
 
-        return nodes,neighbors,valuesum
+    def __iter__(self):
+        try:
+            while True:
+                depth = self.queue.qsize()
+                start = time.monotonic()
+                finished, item = self.queue.get()
+                self.wait_time += time.monotonic() - start
+                if finished:
+                    if item is not None:
+                        raise item
+                    return
+                self.depthsum += depth
+                self.nitems += 1
+                yield item
+        finally:
+            self.stopped.set()
 
     ############################################################################################
 
-    def most_neighbors(self):
-        """Returns tuple: (node_with_most_nb, max_num_nb)"""
+    def stats(self):
+        mean_depth = self.depthsum / self.nitems if self.nitems else 0.0
+        return {"maxdepth": self.maxdepth, "mean_depth": mean_depth,
+                "wait_time": self.wait_time, "chunks": self.nitems}
 
-        node_with_most_nb, max_num_nb = max(self.neighbor_count.items(), key=itemgetter(1), default=(None,0))
-        return (node_with_most_nb, max_num_nb)
+################################################################################################
+################################################################################################
+
+class Progress:
+    """Rate-limited progress reports on stderr.
+    Disabled instance only does a single comparison per call to due()"""
+
+    def __init__(self, interval=None):
+        self.enabled = interval is not None
+        self.interval = interval
+        self.starttime = time.monotonic()
+        self.lasttime = self.starttime
 
     ############################################################################################
 
-    def fewest_neighbors(self):
-        """Returns tuple: (node_with_fewest_nb, min_num_nb)"""
+    def due(self):
+        """Returns True (and resets timer) if more than interval seconds since last report"""
 
-        node_with_fewest_nb, min_num_nb = min(self.neighbor_count.items(), key=itemgetter(1), default=(None,0))
-        return (node_with_fewest_nb, min_num_nb)
+        if not self.enabled:
+            return False
+        now = time.monotonic()
+        if now - self.lasttime < self.interval:
+            return False
+        self.lasttime = now
+        return True
 
     ############################################################################################
 
-    def remove_node(self, nodename):
-        """Removes node from graph"""
+    def elapsed(self):
+        return time.monotonic() - self.starttime
 
-        if nodename in self.neighbors:
-            del self.neighbor_count[nodename]
-            for nb in self.neighbors[nodename]:
-                self.neighbor_count[nb] -= 1
-                if self.neighbor_count[nb] == 0:
-                    del self.neighbor_count[nb]
-                    del self.neighbors[nb]
-                else:
-                    self.neighbors[nb].remove(nodename)
-            del self.neighbors[nodename]
-        self.nodes.remove(nodename)
+    ############################################################################################
+
+    def write(self, message):
+        if self.enabled:
+            sys.stderr.write(f"# Progress [{self.elapsed():8.1f} s]: {message}\n")
 
     ############################################################################################
 
-    #@profile
-    def remove_connection(self, node1, node2):
-        """Removes the edge from node1 to node2 in graph"""
+    def eta(self, done, total):
+        """Returns string with estimated remaining time, based on fraction done so far"""
 
-        try:
-            self.neighbors[node1].remove(node2)
-            self.neighbors[node2].remove(node1)
-            self.neighbor_count[node1] -= 1
-            if self.neighbor_count[node1] == 0:
-                del self.neighbor_count[node1]
-                del self.neighbors[node1]
-            self.neighbor_count[node2] -= 1
-            if self.neighbor_count[node2] == 0:
-                del self.neighbor_count[node2]
-                del self.neighbors[node2]
-        except Exception:
-            raise Exception(f"These nodes are not neighbors: {node1}, {node2}. Can't remove connection")
+        if done <= 0 or total <= 0:
+            return "ETA: unknown"
+        remaining = self.elapsed() * (total - done) / done
+        return f"ETA: {remaining:,.0f} s"
+
+################################################################################################
+################################################################################################
+
+def input_identity(args):
+    """Returns dict identifying parsed graph: INFILE (path, size, modification time), format, and
+    parse_options. Used to decide whether saved (--checkpoint) or cached (serve) graph can be reused"""
+
+    stat = os.stat(args.infile)
+    return {"infile": str(Path(args.infile).resolve()), "size": stat.st_size, "mtime": stat.st_mtime_ns,
+            "informat": input_format(args), **{key: getattr(args, key) for key in parse_options}}
+
+################################################################################################
+
+class Checkpoint:
+    """Saves parsed graph, and periodic snapshots of reduction state, in directory (--checkpoint).
+    A restarted run with same INFILE and options continues from last snapshot, and gives the same
+    result as an uninterrupted run. Files are written to temporary file and then renamed, so an
+    interrupted write leaves previous version intact"""
+
+    def __init__(self, args, progress):
+        self.directory = Path(args.checkpoint)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.progress = progress
+        self.interval = checkpoint_interval
+        self.lasttime = time.monotonic()
+
+        # Parsed graph depends on INFILE and options used for parsing. Reduction state also on
+        # keepfile and algorithm
+        self.parseinfo = input_identity(args)
+        keepinfo = None
+        if args.keepfile:
+            keepstat = os.stat(args.keepfile)
+            keepinfo = [str(Path(args.keepfile).resolve()), keepstat.st_size, keepstat.st_mtime_ns]
+        self.stateinfo = dict(self.parseinfo, keepfile=keepinfo, algorithm=args.algorithm,
+                              clusters=args.clusterfile is not None)
 
     ############################################################################################
 
-    #@profile
-    def remove_neighbors(self, nodename):
-        """Removes neighbors of nodename from graph, if there are any"""
+    def due(self):
+        """Returns True (and resets timer) if more than interval seconds since last snapshot"""
 
-        if nodename in self.neighbors:
-            for nb in self.neighbors[nodename].copy():
-                self.remove_node(nb)
+        now = time.monotonic()
+        if now - self.lasttime < self.interval:
+            return False
+        self.lasttime = now
+        return True
 
     ############################################################################################
 
-    def remove_keepfile_neighbors(self):
-        """Remove neighbors of nodes in keepfile.
-        If any nodes in keepfile are neighbors: disconnect, and print notification to stdout"""
+    def save(self, filename, info, arrays):
+        """Writes info (dict, stored as JSON) and numpy arrays to filename in checkpoint directory"""
 
-        # First, check if any pair of keepset members are neighbors.
-        # If so, print warning on stderr and hide this fact by removing connection in graph
-        for n1, n2 in itertools.combinations(self.keepset, 2):
-            if (n1 in self.neighbors) and (n2 in self.neighbors[n1]):
-                sys.stderr.write("# Keeplist warning: {} and {} are neighbors!\n".format(n1, n2))
-                self.remove_connection(n1, n2)
+        import numpy as np
+        path = self.directory / filename
+        tmppath = path.with_name(path.name + ".tmp")
+        with open(tmppath, "wb") as tmpfile:
+            np.savez(tmpfile, info=np.array(json.dumps(info)), **arrays)
+            tmpfile.flush()
+            os.fsync(tmpfile.fileno())
+        os.replace(tmppath, path)
 
-        # Then, remove all neighbors of keepset members
-        for keepname in self.keepset:
-            self.remove_neighbors(keepname)
+    ############################################################################################
+
+    def load(self, filename, info):
+        """Returns tuple (saved info, dict of arrays) from filename in checkpoint directory.
+        Returns (None, None) if file does not exist, or was written for other input or options
+        (saved info differs from info for any key in info)"""
+
+        import numpy as np
+        path = self.directory / filename
+        if not path.exists():
+            return (None, None)
+        with np.load(path) as saved:
+            savedinfo = json.loads(saved["info"].item())
+            if {key: savedinfo.get(key) for key in info} != info:
+                sys.stderr.write(f"# Checkpoint warning: {path} is from other input or options. Not used\n")
+                return (None, None)
+            return (savedinfo, {key: saved[key] for key in saved.files if key != "info"})
 
     ############################################################################################
 
-    def reduce_from_top(self):
-        """Iteratively remove most connected node, until no neighbors left in graph"""
+    def save_parsed(self, parsed):
+        import numpy as np
+        names = parsed["names"]
+        info = dict(self.parseinfo, valuesum=float(parsed["valuesum"]), nlines=parsed["nlines"])
+        self.save("parsed.npz", info, {"buffer": np.frombuffer(names.buffer, dtype=np.uint8),
+                                       "offsets": np.frombuffer(names.offsets, dtype=np.int64),
+                                       "edges1": np.frombuffer(parsed["edges"][0], dtype=np.int32),
+                                       "edges2": np.frombuffer(parsed["edges"][1], dtype=np.int32)})
+        self.progress.write(f"parsed graph saved to {self.directory / 'parsed.npz'}")
 
-        node_with_most_nb, max_num_nb = self.most_neighbors()
-        while max_num_nb > 0:
-            self.remove_node(node_with_most_nb)
-            node_with_most_nb, max_num_nb = self.most_neighbors()
+    ############################################################################################
+
+    def load_parsed(self):
+        """Returns parsed graph (same dict as PairReader.read()) from checkpoint, or None"""
+
+        info, arrays = self.load("parsed.npz", self.parseinfo)
+        if info is None:
+            return None
+        buffer = arrays["buffer"].tobytes()
+        offsets = arrays["offsets"].tolist()
+        names = NameTable()
+        names.add(buffer[offsets[i]:offsets[i + 1]].decode() for i in range(len(offsets) - 1))
+        edges = (array.array("i"), array.array("i"))
+        edges[0].frombytes(arrays["edges1"].tobytes())
+        edges[1].frombytes(arrays["edges2"].tobytes())
+        self.progress.write(f"parsed graph loaded from checkpoint: {len(names):,} names, "
+                            f"{len(edges[0]):,} neighbor pairs")
+        return {"names": names, "edges": edges, "valuesum": info["valuesum"], "nlines": info["nlines"],
+                "readerstats": None}
 
     ############################################################################################
 
-    def reduce_from_bottom(self):
-        """Iteratively remove neighbors of least connected node, until no neighbors left"""
+    def save_state(self, graph):
+        """Saves snapshot of reduction state of graph"""
 
-        node_with_fewest_nb, min_num_nb = self.fewest_neighbors()
-        while min_num_nb > 0:
-            self.remove_neighbors(node_with_fewest_nb)
-            node_with_fewest_nb, min_num_nb = self.fewest_neighbors()
+        self.save("state.npz", dict(self.stateinfo, graph=type(graph).__name__), graph.checkpoint_state())
+        self.progress.write(f"reduction state saved to {self.directory / 'state.npz'}")
 
     ############################################################################################
 
-    def write_results(self, args):
-        """Write results to outfile, and extra info to stdout"""
+    def restore_state(self, graph):
+        """Restores last snapshot of reduction state (if any) into graph, after keepfile step"""
 
-        print(f"\n\tNames in reduced set written to {args.outfile}\n")
+        info, state = self.load("state.npz", dict(self.stateinfo, graph=type(graph).__name__))
+        if info is not None:
+            graph.restore_state(state)
+            graph.report_reduction("resumed from checkpoint")
 
-        print(f"\tNumber in original set: {self.origdata['orignum']:>10,}")
-        print(f"\tNumber in reduced set: {len(self.nodes):>11,}\n")
+################################################################################################
+################################################################################################
 
-        print("\tNode degree original set:")
-        print(f"\t    min: {self.origdata['min_degree']:>7,}")
-        print(f"\t    max: {self.origdata['max_degree']:>7,}")
-        print(f"\t    ave: {self.origdata['average_degree']:>10,.2f}\n")
+class NameTable:
+    """Names stored as one contiguous UTF-8 buffer plus array of offsets, with hash index.
+    Names are given integer IDs (0, 1, 2, ...) in the order they are added. Names are decoded to str
+    only when requested. Small tables use dict index (hash: ID), so numpy is not imported. Larger
+    tables use sorted numpy arrays of hashes and IDs: names in a chunk are looked up together using
+    searchsorted, and matches are checked by comparing bytes, so only new names are handled in
+    Python code. Uses around (name length + 28) bytes per name"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offsets = array.array("q", [0])
+        self.hashes = array.array("q")              # hash of each name (by ID)
+        self.smallindex = {}                        # hash: ID of first name with hash (small tables)
+        self.sortedhashes = None                    # numpy index (large tables): sorted hashes,
+        self.sortedids = None                       # and IDs in same order
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def nbytes(self):
+        nbytes = (len(self.buffer) + self.offsets.itemsize * len(self.offsets)
+                  + self.hashes.itemsize * len(self.hashes))
+        if self.sortedhashes is None:
+            return nbytes + 100 * len(self.smallindex)
+        return nbytes + self.sortedhashes.nbytes + self.sortedids.nbytes
+
+    def __getitem__(self, nameid):
+        return self.buffer[self.offsets[nameid]:self.offsets[nameid + 1]].decode()
+
+    def __iter__(self):
+        buffer = self.buffer
+        offsets = self.offsets
+        for i in range(len(self)):
+            yield buffer[offsets[i]:offsets[i + 1]].decode()
+
+    def __contains__(self, name):
+        return self.get(name) is not None
 
-        if args.valuetype == "sim":
-            print("\tNode similarities original set:")
+    ############################################################################################
+
+    def get(self, name, default=None):
+        """Returns ID of name, or default if name is not in table"""
+
+        if self.sortedhashes is not None:
+            nameid = int(self.lookup([name])[0][0])
+            return default if nameid < 0 else nameid
+        h = hash(name)
+        nameid = self.smallindex.get(h)
+        if nameid is None:
+            return default
+        if self[nameid] == name:
+            return nameid
+        # Other name has same hash (rare): search all IDs with this hash
+        for nameid, namehash in enumerate(self.hashes):
+            if namehash == h and self[nameid] == name:
+                return nameid
+        return default
+
+    ############################################################################################
+
+    def index(self, name):
+        """Returns ID of name. Raises KeyError if name is not in table"""
+
+        nameid = self.get(name)
+        if nameid is None:
+            raise KeyError(name)
+        return nameid
+
+    ############################################################################################
+
+    def ids(self, names):
+        """Returns array (int32) with IDs of names (all must be in table). Each unique name is
+        looked up once. For dictionary-encoded Arrow arrays, only the dictionary entries that are
+        used are decoded and looked up, and their IDs are then indexed by the (integer) indices"""
+
+        if hasattr(names, "dictionary"):
+            import numpy as np
+            indices = names.indices.to_numpy(zero_copy_only=False)
+            used = np.flatnonzero(np.bincount(indices, minlength=len(names.dictionary)))
+            dictids = np.zeros(len(names.dictionary), dtype=np.int32)
+            dictids[used] = np.frombuffer(self.ids(names.dictionary.take(used)), dtype=np.int32)
+            return array.array("i", dictids[indices].tobytes())
+        # Python note: iterating over pandas string array creates one object per element in Python
+        # code. tolist() is done in C, and much faster
+        if hasattr(names, "tolist"):
+            names = names.tolist()
+        lookup = dict.fromkeys(names)
+        if self.sortedhashes is None:
+            for name in lookup:
+                lookup[name] = self.index(name)
         else:
-            print("\tNode distances original set:")
-        print(f"\t    ave: {self.origdata['average_dist']:>10,.2f}")
-        print(f"\t    cutoff: {args.cutoff:>7,.2f}\n")
+            uniques = list(lookup)
+            uniqueids = self.lookup(uniques)[0]
+            if len(uniqueids) and uniqueids.min() < 0:
+                raise KeyError(uniques[int((uniqueids < 0).argmax())])
+            if len(uniques) == len(names):
+                return array.array("i", uniqueids.astype("i").tobytes())
+            lookup = dict(zip(uniques, uniqueids.tolist()))
+        return array.array("i", map(lookup.__getitem__, names))
+
+    ############################################################################################
+
+    def add(self, names):
+        """Adds names that are not already in table (in order given)"""
+
+        if hasattr(names, "tolist"):
+            names = names.tolist()
+        uniques = list(dict.fromkeys(names))
+        if self.sortedhashes is None and len(self) + len(uniques) <= nametable_small:
+            for name in uniques:
+                if self.get(name) is None:
+                    self.smallindex.setdefault(hash(name), len(self))
+                    self.buffer += name.encode()
+                    self.offsets.append(len(self.buffer))
+                    self.hashes.append(hash(name))
+            return
+
+        import numpy as np
+        if self.sortedhashes is None:
+            # Switch to numpy index
+            hashes = np.array(self.hashes, dtype=np.int64)
+            order = np.argsort(hashes, kind="stable")
+            self.sortedhashes = hashes[order]
+            self.sortedids = order.astype(np.int32)
+            self.smallindex = None
+        uniqueids, joined, lengths, hashes = self.lookup(uniques)
+        new = np.flatnonzero(uniqueids < 0)
+        if len(new) == 0:
+            return
+        if len(new) < len(uniques):
+            joined = joined[np.repeat(uniqueids < 0, lengths)]
+        self.buffer += joined.tobytes()
+        self.offsets.frombytes((self.offsets[-1] + np.cumsum(lengths[new])).tobytes())
+        newhashes = hashes[new]
+        newids = np.arange(len(self), len(self) + len(new), dtype=np.int32)
+        self.hashes.frombytes(newhashes.tobytes())
+        order = np.argsort(newhashes, kind="stable")
+        positions = np.searchsorted(self.sortedhashes, newhashes[order], side="right")
+        self.sortedhashes = np.insert(self.sortedhashes, positions, newhashes[order])
+        self.sortedids = np.insert(self.sortedids, positions, newids[order])
+
+    ############################################################################################
+
+    def lookup(self, uniques):
+        """Looks up list of distinct names in numpy index.
+        Returns tuple: (array of IDs (-1: not in table), array with UTF-8 bytes of all names,
+        array of lengths (bytes) of names, array of hashes)"""
+
+        import numpy as np
+        n = len(uniques)
+        hashes = np.fromiter(map(hash, uniques), dtype=np.int64, count=n)
+        # Python note: encoding all names in one string avoids one bytes object per name.
+        # Lengths in bytes are lengths in characters, unless there are non-ASCII names
+        text = "".join(uniques)
+        joined = np.frombuffer(text.encode(), dtype=np.uint8)
+        if len(joined) == len(text):
+            lengths = np.fromiter(map(len, uniques), dtype=np.int64, count=n)
+        else:
+            lengths = np.fromiter((len(name.encode()) for name in uniques), dtype=np.int64, count=n)
+        del text
+        if len(self.sortedhashes) == 0:
+            return np.full(n, -1, dtype=np.int64), joined, lengths, hashes
+        # Python note: searchsorted is much faster with sorted queries (memory is accessed in order)
+        order = np.argsort(hashes)
+        positions = np.empty(n, dtype=np.int64)
+        positions[order] = np.searchsorted(self.sortedhashes, hashes[order])
+        np.minimum(positions, len(self.sortedhashes) - 1, out=positions)
+        found = self.sortedhashes[positions] == hashes
+        candidates = np.where(found, self.sortedids[positions], -1).astype(np.int64)
+        del order, positions
+
+        # Check that names with same hash also have same bytes
+        starts = np.cumsum(lengths) - lengths
+        # Python note: views of buffer and offsets must be released before they can be resized
+        buffer = np.frombuffer(self.buffer, dtype=np.uint8)
+        offsets = np.frombuffer(self.offsets, dtype=np.int64)
+        safe = np.maximum(candidates, 0)
+        same = found & (offsets[safe + 1] - offsets[safe] == lengths)
+        # Done in blocks of names, since index arrays have one entry per byte (empty names are equal)
+        matched = np.flatnonzero(same & (lengths > 0))
+        for block in range(0, len(matched), nametable_block):
+            rows = matched[block:block + nametable_block]
+            rowlengths = lengths[rows]
+            ends = np.cumsum(rowlengths)
+            within = np.arange(ends[-1]) - np.repeat(ends - rowlengths, rowlengths)
+            newbytes = joined[np.repeat(starts[rows], rowlengths) + within]
+            oldbytes = buffer[np.repeat(offsets[safe[rows]], rowlengths) + within]
+            differs = np.logical_or.reduceat(newbytes != oldbytes, ends - rowlengths)
+            same[rows[differs]] = False
+        del buffer, offsets
+        result = np.where(same, candidates, -1)
+
+        # Other name has same hash (rare): search all IDs with this hash
+        for row in np.flatnonzero(found & ~same).tolist():
+            first = np.searchsorted(self.sortedhashes, hashes[row], side="left")
+            last = np.searchsorted(self.sortedhashes, hashes[row], side="right")
+            for nameid in self.sortedids[first:last].tolist():
+                if self[nameid] == uniques[row]:
+                    result[row] = nameid
+        return result, joined, lengths, hashes
+
+################################################################################################
+################################################################################################
+
+def lenient_policy(valuetype):
+    """Returns --pair-agg policy where pair is neighbor if any of its lines passes cutoff"""
+
+    return "min" if valuetype == "dist" else "max"
+
+################################################################################################
+
+class PairAggregator:
+    """Combines values for pairs that occur on several lines (in either order) using policy (max, min,
+    mean, first). Pairs are stored as int64 keys (lower ID << 32 | higher ID) in sorted arrays.
+    Each chunk is reduced on its own, and merged with earlier pairs when pending chunks hold more
+    pairs than merged arrays (so each pair is re-sorted O(log(chunks)) times)"""
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.merged = None              # tuple of arrays: (keys, values, counts, firsts)
+        self.pending = []
+        self.npending = 0
+        self.nrows = 0
+
+    ############################################################################################
+
+    def add(self, ids1, ids2, values):
+        """Adds pairs (IDs, in input order) with values"""
+
+        import numpy as np
+        ids1 = np.asarray(ids1, dtype=np.int64)
+        ids2 = np.asarray(ids2, dtype=np.int64)
+        keys = (np.minimum(ids1, ids2) << 32) | np.maximum(ids1, ids2)
+
+        # firsts: line number (times 2, plus 1 if IDs were in reverse order) of first line for pair.
+        # Used for "first" policy, and for keeping pairs in order (and orientation) first seen
+        firsts = 2 * np.arange(self.nrows, self.nrows + len(keys), dtype=np.int64) + (ids1 > ids2)
+        self.nrows += len(keys)
+        counts = np.ones(len(keys), dtype=np.int64)
+        chunk = self.reduce(keys, np.asarray(values, dtype=np.float64), counts, firsts)
+        self.pending.append(chunk)
+        self.npending += len(chunk[0])
+        if self.merged is None or self.npending > len(self.merged[0]):
+            self.merge()
+
+    ############################################################################################
+
+    def reduce(self, keys, values, counts, firsts):
+        """Returns arrays with one entry per distinct key. Entries must be in input order
+        (stable sort keeps first line for each key first)"""
+
+        import numpy as np
+        if len(keys) == 0:
+            return keys, values, counts, firsts
+        order = np.argsort(keys, kind="stable")
+        keys, values, counts, firsts = keys[order], values[order], counts[order], firsts[order]
+        starts = np.flatnonzero(np.diff(keys, prepend=-1))
+        if self.policy == "max":
+            values = np.maximum.reduceat(values, starts)
+        elif self.policy == "min":
+            values = np.minimum.reduceat(values, starts)
+        elif self.policy == "mean":
+            values = np.add.reduceat(values, starts)        # Sums: divided by counts in pairs()
+        else:
+            values = values[starts]
+        return keys[starts], values, np.add.reduceat(counts, starts), firsts[starts]
+
+    ############################################################################################
+
+    def merge(self):
+        """Merges pending chunks into merged arrays"""
+
+        import numpy as np
+        parts = self.pending if self.merged is None else [self.merged, *self.pending]
+        self.merged = self.reduce(*(np.concatenate(arrays) for arrays in zip(*parts)))
+        self.pending = []
+        self.npending = 0
+
+    ############################################################################################
+
+    def pairs(self):
+        """Returns tuple of arrays: (ids1, ids2, values), with each pair once, in order first seen"""
+
+        import numpy as np
+        if self.pending:
+            self.merge()
+        if self.merged is None:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+        keys, values, counts, firsts = self.merged
+        if self.policy == "mean":
+            values = values / counts
+        order = np.argsort(firsts)
+        keys, values, flipped = keys[order], values[order], (firsts[order] & 1).astype(bool)
+        low, high = keys >> 32, keys & 0xFFFFFFFF
+        return np.where(flipped, high, low), np.where(flipped, low, high), values
+
+################################################################################################
+################################################################################################
+
+class PairReader:
+    """Reads INFILE (text, Parquet, or Arrow) in chunks, and collects names and neighbor pairs
+    (or computes pairs from feature vectors).
+    Names are given integer IDs in the order they are first seen. Neighbor pairs are stored as
+    arrays of IDs, so the graph representation can be chosen after parsing"""
+
+    def __init__(self, args, progress):
+        self.args = args
+        self.progress = progress
+
+        # With --pair-agg, readers pass on value of each pair. All pairs (not only neighbor pairs) are
+        # needed, unless any passing line makes pair a neighbor and no stats are computed
+        self.aggregate = args.pair_agg != "none"
+        self.allrows = self.aggregate and (args.pair_agg != lenient_policy(args.valuetype) or not args.nostats)
+
+    ############################################################################################
+
+    def read(self):
+        """Reads INFILE. Returns dict with keys: names (NameTable, where IDs are numbered in order
+        names were first seen), edges (tuple of two int32 arrays with IDs of neighbor pairs),
+        valuesum, nlines, readerstats (queue info from background reader, or None)"""
+
+        args = self.args
+        nametable = NameTable()
+        edges1 = array.array("i")
+        edges2 = array.array("i")
+        aggregator = PairAggregator(args.pair_agg) if self.aggregate else None
+        valuesum = 0
+        nlines = 0
+        readerstats = None
+
+        chunks = self.chunks()
+        for nrows, chunknodes, chunksum, name1s, name2s, pairvalues in chunks:
+            nlines += nrows
+            for names in chunknodes:
+                nametable.add(names)
+            if aggregator is None:
+                valuesum += chunksum
+                edges1.extend(nametable.ids(name1s))
+                edges2.extend(nametable.ids(name2s))
+            else:
+                aggregator.add(nametable.ids(name1s), nametable.ids(name2s), pairvalues)
+
+        if aggregator is not None:
+            ids1, ids2, values = aggregator.pairs()
+            if not args.nostats:
+                valuesum = float(values.sum())
+            if args.valuetype == "sim":
+                isneighbor = values > args.cutoff
+            else:
+                isneighbor = values < args.cutoff
+            edges1 = array.array("i", ids1[isneighbor].astype("i").tobytes())
+            edges2 = array.array("i", ids2[isneighbor].astype("i").tobytes())
+            self.progress.write(f"pair aggregation ({args.pair_agg}): {aggregator.nrows:,} lines for "
+                                f"{len(values):,} distinct pairs")
+
+        n = len(nametable)
+        if args.allpairs and nlines != n * (n - 1) // 2:
+            sys.stderr.write(f"# Warning: --allpairs used, but INFILE has {nlines:,} lines for {n:,} names "
+                             f"(expected {n * (n - 1) // 2:,}). Some names may be missing\n")
+
+        self.progress.write(f"parsing done: {nlines:,} lines, {n:,} names, {len(edges1):,} neighbor pairs")
+        if args.prefetch > 0:
+            readerstats = chunks.stats()
+            self.progress.write("reader queue: mean depth {mean_depth:.2f} of {maxdepth} "
+                                "(low: waiting for input, high: waiting for processing), "
+                                "{wait_time:.1f} s waiting for input".format(**readerstats))
+        return {"names":nametable, "edges":(edges1, edges2), "valuesum":valuesum,
+                "nlines":nlines, "readerstats":readerstats}
+
+    ############################################################################################
+
+    def chunks(self):
+        """Returns iterable over chunks of INFILE (read in background thread if args.prefetch > 0).
+        Each chunk is tuple: (number of lines, iterable of name arrays, sum of values,
+                              name1 array for neighbor pairs, name2 array for neighbor pairs
+                              (Arrow arrays for Parquet and Arrow INFILE),
+                              values for pairs (None unless --pair-agg is used))
+        Lines where name1 is name2 are skipped. With --pair-agg, pairs may include non-neighbors"""
+
+        args = self.args
+        if input_format(args) == "text" and text_engine(args) == "python":
+            chunks = self.read_python()
+        elif input_format(args) == "text":
+            chunks = self.read_text()
+        elif input_format(args) == "vectors":
+            chunks = self.read_vectors()
+        elif input_format(args) == "fasta":
+            chunks = self.read_fasta()
+        else:
+            chunks = self.read_arrow()
+        if args.prefetch > 0:
+            chunks = Prefetcher(chunks, args.prefetch)
+        return chunks
+
+    ############################################################################################
+
+    def report_parsing(self, nlines, done, total, unit):
+        """Write progress of parsing (lines read, and amount done of total) to stderr"""
+
+        self.progress.write(f"parsing: {nlines:,} lines, {done:,.1f} of {total:,.1f} {unit} "
+                            f"({nlines/self.progress.elapsed():,.0f} lines/s), "
+                            f"{self.progress.eta(done, total)}")
+
+    ############################################################################################
+
+    def read_text(self):
+        """Generator: reads whitespace separated text INFILE in chunks using pandas.
+        Yields tuple for each chunk as described in chunks()"""
+
+        import numpy as np
+        import pandas as pd
+
+        args = self.args
+        chunksize = int(max(args.chunk * 1_000_000, 1))
+        filesize = os.path.getsize(args.infile)
+        nlines = 0
+        firstname = None
+
+        # Python note: infile is opened here so position (bytes read so far) can be tracked cheaply
+        with open(args.infile, "rb") as infile:
+            compression = compression_suffixes.get(Path(args.infile).suffix.lower())
+            reader = pd.read_csv(infile, engine="c", sep=r"\s+", chunksize=chunksize, compression=compression,
+                                 names=["name1", "name2", "val"], dtype={"name1":str, "name2":str, "val":float},
+                                 **text_na_options)
+            for df in reader:
+                nlines += len(df)
+                if self.progress.due():
+                    self.report_parsing(nlines, infile.tell() / 1e6, filesize / 1e6, "MB")
+
+                # Python note: pd.factorize hashes into small per-chunk table. Merging only unique names
+                # into (large) node set is much faster than adding every row's names to it
+                name1 = df["name1"].values
+                name2 = df["name2"].values
+                values = df["val"].values
+                notself = np.asarray(name1 != name2, dtype=bool)
+                chunksum = 0 if args.nostats else values[notself].sum()
+                if args.valuetype == "sim":
+                    isneighbor = (values > args.cutoff) & notself
+                else:
+                    isneighbor = (values < args.cutoff) & notself
+                if args.allpairs:
+                    # Every item is paired with first item: it is either in first column somewhere,
+                    # or in second column on one of first item's lines. Second column of neighbor
+                    # pairs also included, so all names in edges are known when edges are added
+                    if firstname is None and len(name1) > 0:
+                        firstname = name1[0]
+                    rows2 = np.flatnonzero(np.asarray(name1 == firstname, dtype=bool) | isneighbor)
+                    column2 = (*pd.factorize(name2[rows2]), rows2)
+                else:
+                    column2 = (*pd.factorize(name2), None)
+                chunknodes = [first_seen([(*pd.factorize(name1), None), column2])]
+                rows = notself if self.allrows else isneighbor
+                pairvalues = values[rows] if self.aggregate else None
+                chunk = (len(df), chunknodes, chunksum, name1[rows], name2[rows], pairvalues)
+                # Release chunk before names are added to table and next chunk is parsed
+                del df, name1, name2, values, column2, chunknodes
+                yield chunk
+
+    ############################################################################################
+
+    def read_python(self):
+        """Generator: reads whitespace separated text INFILE in chunks using plain Python.
+        Avoids importing pandas and numpy, which is faster for small files.
+        Yields same tuples as read_text()"""
+
+        args = self.args
+        chunksize = int(max(args.chunk * 1_000_000, 1))
+        filesize = os.path.getsize(args.infile)
+        nlines = 0
+        firstname = None
+        with open(args.infile, "rb") as infile:
+            while True:
+                rows = [line.decode().split() for line in itertools.islice(infile, chunksize)]
+                if not rows:
+                    return
+                rows = [row for row in rows if row]
+                for row in rows:
+                    if len(row) != 3:
+                        raise Exception(f"INFILE lines must have 3 fields (name1 name2 value): {' '.join(row)}")
+                nlines += len(rows)
+                if self.progress.due():
+                    self.report_parsing(nlines, infile.tell() / 1e6, filesize / 1e6, "MB")
+
+                if args.allpairs and firstname is None and rows:
+                    firstname = rows[0][0]
+                values = [float(row[2]) for row in rows]
+                notself = [row[0] != row[1] for row in rows]
+                chunksum = 0 if args.nostats else sum(val for val, ok in zip(values, notself) if ok)
+                if args.valuetype == "sim":
+                    isneighbor = [val > args.cutoff and ok for val, ok in zip(values, notself)]
+                else:
+                    isneighbor = [val < args.cutoff and ok for val, ok in zip(values, notself)]
+                names = []
+                for (name1, name2, val), neighbor in zip(rows, isneighbor):
+                    names.append(name1)
+                    if not args.allpairs or neighbor or name1 == firstname:
+                        names.append(name2)
+                keep = notself if self.allrows else isneighbor
+                name1s = [row[0] for row, ok in zip(rows, keep) if ok]
+                name2s = [row[1] for row, ok in zip(rows, keep) if ok]
+                pairvalues = [val for val, ok in zip(values, keep) if ok] if self.aggregate else None
+                yield len(rows), [dict.fromkeys(names)], chunksum, name1s, name2s, pairvalues
+
+    ############################################################################################
+
+    def read_arrow(self):
+        """Generator: reads Parquet file/directory or Arrow IPC file in record batches.
+        Yields same tuples as read_text(). For Parquet, row groups where min/max statistics show that
+        no value passes cutoff, are not filtered (and value column is not read unless needed for stats).
+        Neighbor pairs are found using Arrow compute kernels before any names are converted to Python"""
+
+        import numpy as np
+        import pyarrow.compute as pc
+
+        args = self.args
+        firstname = None
+        nlines = 0
+        if args.valuetype == "sim":
+            passes = pc.greater
+        else:
+            passes = pc.less
+
+        for batch, has_neighbors, done, total in self.arrow_batches():
+            nlines += batch.num_rows
+            if self.progress.due():
+                self.report_parsing(nlines, done, total, "record batches")
+            name1, name2 = batch.column(0), batch.column(1)
+            notself = pc.not_equal(decoded(name1), decoded(name2))
+            if args.nostats:
+                chunksum = 0
+            else:
+                chunksum = pc.sum(batch.column(2).filter(notself)).as_py() or 0
+            has_neighbors = has_neighbors or self.allrows
+            if has_neighbors:
+                isneighbor = pc.and_(passes(batch.column(2), args.cutoff), notself)
+            if args.allpairs:
+                if firstname is None and len(name1) > 0:
+                    firstname = name1[0].as_py()
+                rows2 = pc.equal(decoded(name1), firstname)
+                if has_neighbors:
+                    rows2 = pc.or_(rows2, isneighbor)
+                rows2 = np.flatnonzero(rows2.to_numpy(zero_copy_only=False))
+                column2 = (*arrow_factorized(name2.take(rows2)), rows2)
+            else:
+                column2 = (*arrow_factorized(name2), None)
+            chunknodes = [first_seen([(*arrow_factorized(name1), None), column2])]
+
+            if not has_neighbors:
+                yield batch.num_rows, chunknodes, chunksum, [], [], [] if self.aggregate else None
+                continue
+            rows = notself if self.allrows else isneighbor
+            pairvalues = batch.column(2).filter(rows).to_numpy(zero_copy_only=False) if self.aggregate else None
+            yield batch.num_rows, chunknodes, chunksum, name1.filter(rows), name2.filter(rows), pairvalues
+
+    ############################################################################################
+
+    def arrow_batches(self):
+        """Generator: yields (record batch, has_neighbors, amount done, total amount) from Parquet or
+        Arrow IPC INFILE. Only first three columns are used (name1, name2, value). has_neighbors is
+        False for Parquet row groups where statistics show that no value passes cutoff.
+        Value column is then only read if needed for stats"""
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        args = self.args
+        if input_format(args) == "arrow":
+            with pa.memory_map(str(args.infile), "r") as source:
+                try:
+                    reader = pa.ipc.open_file(source)
+                    batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+                    total = reader.num_record_batches
+                except pa.ArrowInvalid:
+                    source.seek(0)
+                    batches = pa.ipc.open_stream(source)
+                    total = 0
+                for i, batch in enumerate(batches):
+                    yield without_missing_names(batch.select([0, 1, 2])), True, i + 1, total
+            return
+
+        infile = Path(args.infile)
+        if infile.is_dir():
+            filelist = sorted(p for p in infile.rglob("*") if p.suffix.lower() in parquet_suffixes)
+        else:
+            filelist = [infile]
+        # Python note: read_dictionary keeps dictionary encoded name columns as dictionary arrays
+        parquetfiles = []
+        for filename in filelist:
+            names = pq.ParquetFile(filename).schema_arrow.names[:2]
+            parquetfiles.append(pq.ParquetFile(filename, read_dictionary=names))
+        total = sum(pf.metadata.num_row_groups for pf in parquetfiles)
+        done = 0
+        for pf in parquetfiles:
+            colnames = pf.schema_arrow.names[:3]
+            for i in range(pf.metadata.num_row_groups):
+                has_neighbors = row_group_has_neighbors(pf.metadata.row_group(i), args)
+                if has_neighbors or not args.nostats or self.allrows:
+                    table = pf.read_row_group(i, columns=colnames)
+                else:
+                    table = pf.read_row_group(i, columns=colnames[:2])
+                done += 1
+                for batch in table.to_batches():
+                    yield without_missing_names(batch), has_neighbors, done, total
+
+    ############################################################################################
+
+    def read_vectors(self):
+        """Generator: computes pairwise values for feature vectors in INFILE, in blocks of rows
+        (each block against itself and all later rows), and keeps pairs that are neighbors.
+        The O(n**2) pairs are never stored. Yields same tuples as read_text()"""
+
+        import numpy as np
+        args = self.args
+        names, vectors = self.load_vectors()
+        n = len(names)
+        if args.metric == "cosine":
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.where(norms > 0, norms, 1)
+
+        # Block of rows: around --chunk million pair values at a time
+        rowsperblock = max(1, int(args.chunk * 1_000_000 // max(n, 1)))
+        npairs = 0
+        yield 0, [names], 0, [], [], None
+        for start in range(0, n, rowsperblock):
+            stop = min(start + rowsperblock, n)
+            values = pair_values(vectors[start:stop], vectors[start:], args.metric)
+            if args.metric == "cosine" and args.valuetype == "dist":
+                values = 1 - values
+            # Only pairs (i, j) with j > i
+            upper = np.arange(start, n)[None, :] > np.arange(start, stop)[:, None]
+            chunksum = 0 if args.nostats else float(values[upper].sum())
+            if args.valuetype == "sim":
+                isneighbor = (values > args.cutoff) & upper
+            else:
+                isneighbor = (values < args.cutoff) & upper
+            rows, cols = np.nonzero(isneighbor)
+            npairs += int(upper.sum())
+            if self.progress.due():
+                self.report_parsing(npairs, stop, n, "vectors")
+            yield (int(upper.sum()), [], chunksum,
+                   [names[i] for i in (rows + start).tolist()], [names[j] for j in (cols + start).tolist()], None)
+
+    ############################################################################################
+
+    def read_fasta(self):
+        """Generator: finds neighbor pairs among sequences in FASTA INFILE. Each sequence is summarized
+        by a MinHash sketch of its k-mers, LSH banding proposes candidate pairs (sequences with
+        identical sketch values in at least one band), and only candidates are compared.
+        Yields same tuples as read_text() (with estimated Jaccard similarity or identity as value)"""
+
+        import numpy as np
+        args = self.args
+        names, seqs = read_fasta_file(args.infile)
+        n = len(names)
+        k = args.kmer
+        if k is None:
+            residues = set(b"".join(seqs[:1000]))
+            k = 16 if residues <= set(b"ACGTUN") else 5
+        sketches = np.empty((n, args.sketchsize), dtype=np.uint64)
+        for i, seq in enumerate(seqs):
+            sketches[i] = minhash_sketch(seq, k, args.sketchsize)
+            if self.progress.due():
+                self.report_parsing(0, i + 1, n, "sequences sketched")
+        yield 0, [names], 0, [], [], None
+
+        # Pairs are proposed with high probability (99%) if Jaccard similarity is at cutoff
+        cutoff = args.cutoff if args.valuetype == "sim" else 1 - args.cutoff
+        if args.metric == "identity":
+            x = np.exp(-k * (1 - cutoff))
+            cutoff = x / (2 - x)
+        bands = args.bands or lsh_bands(args.sketchsize, cutoff)
+        candidates = lsh_candidates(sketches, bands)
+        self.progress.write(f"sketching done: k={k}, {bands} bands, {len(candidates):,} candidate pairs")
+
+        batchsize = int(max(args.chunk * 1_000_000, 1))
+        for start in range(0, len(candidates), batchsize):
+            ids1, ids2 = np.divmod(candidates[start:start + batchsize], n)
+            values = (sketches[ids1] == sketches[ids2]).mean(axis=1)
+            if args.metric == "identity":
+                # Mash distance: -1/k ln(2J / (1 + J)) estimates 1 - identity
+                with np.errstate(divide="ignore"):
+                    values = np.maximum(1 + np.log(2 * values / (1 + values)) / k, 0)
+            if args.valuetype == "dist":
+                values = 1 - values
+                isneighbor = values < args.cutoff
+            else:
+                isneighbor = values > args.cutoff
+            yield (len(values), [], 0,
+                   [names[i] for i in ids1[isneighbor].tolist()], [names[j] for j in ids2[isneighbor].tolist()],
+                   None)
+
+    ############################################################################################
+
+    def load_vectors(self):
+        """Returns (list of names, 2-D float array with one feature vector per row) from INFILE.
+        Text: name x1 x2 ... (one item per line). .npy: matrix, with names from INFILE with suffix
+        .names.txt if that exists (as written by --outformat npy), otherwise row numbers"""
+
+        import numpy as np
+        infile = Path(self.args.infile)
+        if infile.suffix.lower() == ".npy":
+            vectors = np.load(infile)
+            namefile = infile.with_suffix(".names.txt")
+            if namefile.exists():
+                names = namefile.read_text().split()
+            else:
+                names = [str(i) for i in range(len(vectors))]
+        else:
+            names = []
+            rows = []
+            opener = gzip.open if infile.suffix.lower() == ".gz" else open
+            with opener(infile, "rt") as vectorfile:
+                for line in vectorfile:
+                    fields = line.split()
+                    if fields:
+                        names.append(fields[0])
+                        rows.append(fields[1:])
+            try:
+                vectors = np.array(rows, dtype=np.float64)
+            except ValueError:
+                raise Exception("INFILE lines must have name followed by same number of values: name x1 x2 ...")
+        vectors = np.asarray(vectors, dtype=np.float64)
+        if vectors.ndim == 1:
+            vectors = vectors[:, None]
+        if vectors.ndim != 2 or len(names) != len(vectors):
+            raise Exception(f"Vector INFILE must have one vector per name ({len(names)} names, "
+                            f"array shape {vectors.shape})")
+        if len(set(names)) != len(names):
+            raise Exception("Names in vector INFILE must be unique")
+        return names, vectors
+
+################################################################################################
+################################################################################################
+
+class NeighborGraph:
+    """Stores information about nodes and their connections.
+    Methods for interrogating and changing graph"""
+
+    def __init__(self, args, parsed=None, progress=None):
+        if progress is None:
+            progress = Progress(args.progress_interval if args.progress else None)
+        self.progress = progress
+        if parsed is None:
+            parsed = PairReader(args, self.progress).read()
+        self.readerstats = parsed["readerstats"]
+        self.names = parsed["names"]               # All names (NameTable), in order first seen in INFILE
+        degreelist = self.build_graph(parsed)
+
+        self.origdata = {}
+        self.origdata["orignum"] = len(self.names)
+        self.origdata["average_degree"] =  sum(degreelist) / self.origdata["orignum"]
+        self.origdata["max_degree"] =  max(degreelist, default=0)
+        self.origdata["min_degree"] =  min(degreelist, default=0)
+        n = self.origdata["orignum"]
+        if args.nostats:
+            self.origdata["average_dist"] = None
+        else:
+            self.origdata["average_dist"] = parsed["valuesum"] * 2 / (n * (n - 1))
+
+        # Representative (retained node that caused removal) for each node ID (= index in self.names).
+        # Only tracked when cluster output is requested. -1: not removed
+        self.representative = None
+        if args.clusterfile:
+            import numpy as np
+            self.representative = np.full(len(self.names), -1, dtype=np.int32)
+
+        self.checkpoint = None          # Checkpoint (set by make_graph when --checkpoint is used)
+        self.keepset = set()
+        if args.keepfile:
+            with open(args.keepfile, "r") as keepfile:
+                for line in keepfile:
+                    node = line.strip()
+                    self.keepset.add(node)
+
+    ############################################################################################
+
+    def build_graph(self, parsed):
+        """Builds set of nodes and neighbor dict-of-sets (keyed by name) from parsed neighbor pairs.
+        Returns list of degrees for nodes that have neighbors"""
+
+        # Only names with neighbors are decoded (once, in order of first appearance in the edge list,
+        # so that dict keys and neighbor sets share str objects that lie close together in memory).
+        # Names without neighbors are never removed, so remaining names are tracked via self.removed
+        self.removed = set()
+        names = {}
+        neighbors = defaultdict(set)
+        for id1, id2 in zip(*parsed["edges"]):
+            name1 = names.get(id1)
+            if name1 is None:
+                name1 = names[id1] = self.names[id1]
+            name2 = names.get(id2)
+            if name2 is None:
+                name2 = names[id2] = self.names[id2]
+            neighbors[name1].add(name2)
+            neighbors[name2].add(name1)
+        del names
+
+        # Convert to regular dict (not defaultdict) to avoid gotchas with key generation on access
+        # Python note: would it be faster to just use dict.setdefault() during creation?
+        self.neighbors = dict(neighbors)
+        self.neighbor_count = {}
+        degreelist = []
+        for name in self.neighbors:
+            degree = len(self.neighbors[name])
+            self.neighbor_count[name] = degree
+            degreelist.append(degree)
+        return degreelist
+
+    ############################################################################################
+
+    @property
+    def nodes(self):
+        """Set of remaining names (decoded on request)"""
+
+        return {name for name in self.names if name not in self.removed}
+
+    ############################################################################################
+
+    def are_neighbors(self, node1, node2):
+        return (node1 in self.neighbors) and (node2 in self.neighbors[node1])
+
+    ############################################################################################
+
+    def adjacency_ids(self):
+        """Generator: yields (node ID, list of neighbor IDs) for all nodes that have neighbors"""
+
+        nameid = {name:i for i, name in enumerate(self.names)}
+        for name, nbset in self.neighbors.items():
+            yield nameid[name], [nameid[nb] for nb in nbset]
+
+    ############################################################################################
+
+    def most_neighbors(self):
+        """Returns tuple: (node_with_most_nb, max_num_nb)"""
+
+        node_with_most_nb, max_num_nb = max(self.neighbor_count.items(), key=itemgetter(1), default=(None,0))
+        return (node_with_most_nb, max_num_nb)
+
+    ############################################################################################
+
+    def fewest_neighbors(self):
+        """Returns tuple: (node_with_fewest_nb, min_num_nb)"""
+
+        node_with_fewest_nb, min_num_nb = min(self.neighbor_count.items(), key=itemgetter(1), default=(None,0))
+        return (node_with_fewest_nb, min_num_nb)
+
+    ############################################################################################
+
+    def remove_node(self, nodename):
+        """Removes node from graph"""
+
+        if nodename in self.neighbors:
+            del self.neighbor_count[nodename]
+            for nb in self.neighbors[nodename]:
+                self.neighbor_count[nb] -= 1
+                if self.neighbor_count[nb] == 0:
+                    del self.neighbor_count[nb]
+                    del self.neighbors[nb]
+                else:
+                    self.neighbors[nb].remove(nodename)
+            del self.neighbors[nodename]
+        self.removed.add(nodename)
+
+    ############################################################################################
+
+    #@profile
+    def remove_connection(self, node1, node2):
+        """Removes the edge from node1 to node2 in graph"""
+
+        try:
+            self.neighbors[node1].remove(node2)
+            self.neighbors[node2].remove(node1)
+            self.neighbor_count[node1] -= 1
+            if self.neighbor_count[node1] == 0:
+                del self.neighbor_count[node1]
+                del self.neighbors[node1]
+            self.neighbor_count[node2] -= 1
+            if self.neighbor_count[node2] == 0:
+                del self.neighbor_count[node2]
+                del self.neighbors[node2]
+        except Exception:
+            raise Exception(f"These nodes are not neighbors: {node1}, {node2}. Can't remove connection")
+
+    ############################################################################################
+
+    #@profile
+    def remove_neighbors(self, nodename):
+        """Removes neighbors of nodename from graph, if there are any"""
+
+        if nodename in self.neighbors:
+            if self.representative is not None:
+                import numpy as np
+                nbids = self.names.ids(list(self.neighbors[nodename]))
+                self.representative[np.frombuffer(nbids, dtype=np.int32)] = self.names.index(nodename)
+            for nb in self.neighbors[nodename].copy():
+                self.remove_node(nb)
+
+    ############################################################################################
+
+    def remove_keepfile_neighbors(self):
+        """Remove neighbors of nodes in keepfile.
+        If any nodes in keepfile are neighbors: disconnect, and print notification to stdout"""
+
+        # First, check if any pair of keepset members are neighbors.
+        # If so, print warning on stderr and hide this fact by removing connection in graph
+        for n1, n2 in itertools.combinations(self.keepset, 2):
+            if self.are_neighbors(n1, n2):
+                sys.stderr.write("# Keeplist warning: {} and {} are neighbors!\n".format(n1, n2))
+                self.remove_connection(n1, n2)
+
+        # Then, remove all neighbors of keepset members
+        for keepname in self.keepset:
+            self.remove_neighbors(keepname)
+
+    ############################################################################################
+
+    def report_reduction(self, step):
+        """Write progress of reduction (remaining connected nodes and edges) to stderr"""
+
+        if not self.progress.enabled:
+            return
+        n_edges = sum(self.neighbor_count.values()) // 2
+        self.progress.write(f"{step}: {len(self.neighbors):,} connected nodes, {n_edges:,} edges left, "
+                            f"{len(self.names) - len(self.removed):,} names remaining")
+
+    ############################################################################################
+
+    def reduce_from_top(self):
+        """Iteratively remove most connected node, until no neighbors left in graph"""
+
+        node_with_most_nb, max_num_nb = self.most_neighbors()
+        while max_num_nb > 0:
+            self.remove_node(node_with_most_nb)
+            if self.progress.due():
+                self.report_reduction("greedy-max")
+            if self.checkpoint and self.checkpoint.due():
+                self.checkpoint.save_state(self)
+            node_with_most_nb, max_num_nb = self.most_neighbors()
+        self.report_reduction("greedy-max done")
+
+    ############################################################################################
+
+    def reduce_from_bottom(self):
+        """Iteratively remove neighbors of least connected node, until no neighbors left"""
+
+        node_with_fewest_nb, min_num_nb = self.fewest_neighbors()
+        while min_num_nb > 0:
+            self.remove_neighbors(node_with_fewest_nb)
+            if self.progress.due():
+                self.report_reduction("greedy-min")
+            if self.checkpoint and self.checkpoint.due():
+                self.checkpoint.save_state(self)
+            node_with_fewest_nb, min_num_nb = self.fewest_neighbors()
+        self.report_reduction("greedy-min done")
+
+    ############################################################################################
+
+    def write_results(self, args):
+        """Write results to outfile, and extra info to stdout"""
+
+        print(f"\n\tNames in reduced set written to {args.outfile}\n")
+
+        print(f"\tNumber in original set: {self.origdata['orignum']:>10,}")
+        print(f"\tNumber in reduced set: {len(self.selected_ids()):>11,}\n")
+
+        print("\tNode degree original set:")
+        print(f"\t    min: {self.origdata['min_degree']:>7,}")
+        print(f"\t    max: {self.origdata['max_degree']:>7,}")
+        print(f"\t    ave: {self.origdata['average_degree']:>10,.2f}\n")
+
+        if args.valuetype == "sim":
+            print("\tNode similarities original set:")
+        else:
+            print("\tNode distances original set:")
+        if self.origdata["average_dist"] is None:
+            print(f"\t    ave: {'n/a':>10}")
+        else:
+            print(f"\t    ave: {self.origdata['average_dist']:>10,.2f}")
+        print(f"\t    cutoff: {args.cutoff:>7,.2f}\n")
+
+        write_outfile(self.names, self.selected_ids(), args)
+
+        if args.clusterfile:
+            self.write_clusters(args.clusterfile)
+            print(f"\tCluster memberships written to {args.clusterfile}\n")
+
+    ############################################################################################
+
+    def selected_ids(self):
+        """Returns list of IDs of remaining nodes (in input order)"""
+
+        removedids = set(self.names.ids(list(self.removed)))
+        return [i for i in range(len(self.names)) if i not in removedids]
+
+    ############################################################################################
+
+    def checkpoint_state(self):
+        """Returns dict of arrays with state of reduction (for Checkpoint)"""
+
+        import numpy as np
+        state = {"alive": np.zeros(len(self.names), dtype=bool)}
+        state["alive"][self.selected_ids()] = True
+        if self.representative is not None:
+            state["representative"] = self.representative
+        return state
+
+    ############################################################################################
+
+    def restore_state(self, state):
+        """Restores state from checkpoint_state() of same graph (after keepfile step), by removing
+        nodes that had been removed. Remaining nodes keep their order, so ties are broken as before"""
+
+        import numpy as np
+        for nodeid in np.flatnonzero(~state["alive"]).tolist():
+            name = self.names[nodeid]
+            if name not in self.removed:
+                self.remove_node(name)
+        if self.representative is not None:
+            self.representative[:] = state["representative"]
+
+    ############################################################################################
+
+    def write_clusters(self, filename):
+        """Write one line per name in original set (in input order): name representative.
+        Retained names are their own representative"""
+
+        lines = (f"{name}\t{name if repid < 0 else self.names[repid]}"
+                 for name, repid in zip(self.names, self.representative.tolist()))
+        write_names(lines, filename)
+
+    ############################################################################################
+
+    def connected_components(self):
+        """Returns list with component ID for each node ID (= index in self.names).
+        Uses union-find (with path halving and union by size): near-linear in number of edges"""
+
+        parent = list(range(len(self.names)))
+        size = [1] * len(self.names)
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for nodeid, nbids in self.adjacency_ids():
+            root1 = find(nodeid)
+            for nbid in nbids:
+                root2 = find(nbid)
+                if root1 != root2:
+                    if size[root1] < size[root2]:
+                        root1, root2 = root2, root1
+                    parent[root2] = root1
+                    size[root1] += size[root2]
+        return [find(i) for i in range(len(self.names))]
+
+    ############################################################################################
+
+    def write_folds(self, args):
+        """Assign connected components to args.folds folds (balanced by number of items), and write
+        fold for each name to outfile. Extra info to stdout"""
+
+        components = self.connected_components()
+        compsizes = defaultdict(int)
+        for comp in components:
+            compsizes[comp] += 1
+        compfold, foldsizes = assign_folds(compsizes, args.folds)
+        lines = (f"{name}\t{compfold[comp]}" for name, comp in zip(self.names, components))
+        write_names(lines, args.outfile)
+
+        largest = max(compsizes.values(), default=0)
+        print(f"\n\tFold assignments written to {args.outfile}\n")
+        print(f"\tNumber in original set: {self.origdata['orignum']:>10,}")
+        print(f"\tNumber of components: {len(compsizes):>12,}")
+        print(f"\tLargest component: {largest:>15,}\n")
+        print("\tNumber in each fold:")
+        for fold, foldsize in enumerate(foldsizes):
+            print(f"\t    {fold:>4}: {foldsize:>10,}")
+        print()
+        if largest > self.origdata["orignum"] / args.folds:
+            sys.stderr.write(f"# Fold warning: largest group of connected items ({largest:,}) is larger than "
+                             "average fold size. Consider using a stricter cutoff\n")
+
+################################################################################################
+################################################################################################
+
+class ArrayGraph(NeighborGraph):
+    """Base class for graphs stored in numpy arrays (degree and alive flag for each node ID).
+    Nodes are referred to by ID (index in self.names): most_neighbors() and fewest_neighbors()
+    return IDs, which are accepted by remove_node(), remove_neighbors(), etc.
+    Names are only decoded for output"""
+
+    @property
+    def nodes(self):
+        """Set of remaining names (decoded on request)"""
+
+        import numpy as np
+        return {self.names[i] for i in np.flatnonzero(self.alive).tolist()}
+
+    ############################################################################################
+
+    def selected_ids(self):
+        """Returns list of IDs of remaining nodes (in input order)"""
+
+        import numpy as np
+        return np.flatnonzero(self.alive).tolist()
+
+    ############################################################################################
+
+    def restore_state(self, state):
+        """Restores state from checkpoint_state() of same graph (after keepfile step), by removing
+        nodes that had been removed"""
+
+        import numpy as np
+        for nodeid in np.flatnonzero(self.alive & ~state["alive"]).tolist():
+            self.remove_node(nodeid)
+        if self.representative is not None:
+            self.representative[:] = state["representative"]
+
+    ############################################################################################
+
+    def fewest_neighbors(self):
+        """Returns tuple: (node_with_fewest_nb, min_num_nb)"""
+
+        # Python note: degree - 1 as unsigned is largest for degree 0, so argmin finds lowest positive
+        # degree (lowest ID on ties) in one pass, without making array of connected IDs
+        import numpy as np
+        if len(self.degree) == 0:
+            return (None, 0)
+        nodeid = int((self.degree - 1).view(np.uint64).argmin())
+        if self.degree[nodeid] == 0:
+            return (None, 0)
+        return (nodeid, int(self.degree[nodeid]))
+
+    ############################################################################################
+
+    def remove_keepfile_neighbors(self):
+        """Remove neighbors of nodes in keepfile (names not in INFILE are skipped).
+        If any nodes in keepfile are neighbors: disconnect, and print notification to stdout"""
+
+        keepids = [nodeid for nodeid in map(self.names.get, self.keepset) if nodeid is not None]
+        for id1, id2 in itertools.combinations(keepids, 2):
+            if self.are_neighbors(id1, id2):
+                sys.stderr.write("# Keeplist warning: {} and {} are neighbors!\n".format(self.names[id1],
+                                                                                         self.names[id2]))
+                self.remove_connection(id1, id2)
+        for keepid in keepids:
+            self.remove_neighbors(keepid)
+
+    ############################################################################################
+
+    def report_reduction(self, step):
+        """Write progress of reduction (remaining connected nodes and edges) to stderr"""
+
+        import numpy as np
+        if not self.progress.enabled:
+            return
+        n_edges = int(self.degree.sum()) // 2
+        self.progress.write(f"{step}: {np.count_nonzero(self.degree):,} connected nodes, {n_edges:,} edges left, "
+                            f"{np.count_nonzero(self.alive):,} names remaining")
+
+################################################################################################
+
+class BitsetGraph(ArrayGraph):
+    """Graph stored as packed bit rows (row i: bit j set if nodes i and j are neighbors), plus array of
+    degrees. Removing nodes is done with vectorized row operations and popcounts, instead of one set
+    operation per neighbor. Faster than NeighborGraph for dense graphs, but uses n*n/8 bytes"""
+
+    def build_graph(self, parsed):
+        """Builds bit rows and degree array from parsed neighbor pairs.
+        Returns list of degrees for nodes that have neighbors"""
+
+        import numpy as np
+        n = len(self.names)
+        self.alive = np.ones(n, dtype=bool)
+        self.bits = np.zeros((n, (n + 63) // 64), dtype="<u8")
+        ids1 = np.asarray(parsed["edges"][0], dtype=np.int64)
+        ids2 = np.asarray(parsed["edges"][1], dtype=np.int64)
+        rows = np.concatenate([ids1, ids2])
+        cols = np.concatenate([ids2, ids1])
+        np.bitwise_or.at(self.bits, (rows, cols >> 6), np.left_shift(np.uint64(1), (cols & 63).astype(np.uint64)))
+        self.degree = row_popcount(self.bits)
+        return self.degree[self.degree > 0].tolist()
+
+    ############################################################################################
+
+    def bitmask(self, ids):
+        """Returns bit row with bits set for node IDs in ids"""
+
+        import numpy as np
+        ids = np.asarray(ids)
+        mask = np.zeros(self.bits.shape[1], dtype="<u8")
+        np.bitwise_or.at(mask, ids >> 6, np.left_shift(np.uint64(1), (ids & 63).astype(np.uint64)))
+        return mask
+
+    ############################################################################################
+
+    def row_ids(self, bitrow):
+        """Returns array of node IDs for bits set in bitrow"""
+
+        import numpy as np
+        return np.flatnonzero(np.unpackbits(bitrow.view(np.uint8), bitorder="little"))
+
+    ############################################################################################
+
+    def are_neighbors(self, id1, id2):
+        return bool((int(self.bits[id1, id2 >> 6]) >> (id2 & 63)) & 1)
+
+    ############################################################################################
+
+    def adjacency_ids(self):
+        """Generator: yields (node ID, list of neighbor IDs) for all nodes that have neighbors"""
+
+        import numpy as np
+        for nodeid in np.flatnonzero(self.degree).tolist():
+            yield nodeid, self.row_ids(self.bits[nodeid]).tolist()
+
+    ############################################################################################
+
+    def most_neighbors(self):
+        """Returns tuple: (node_with_most_nb, max_num_nb)"""
+
+        nodeid = int(self.degree.argmax())
+        max_num_nb = int(self.degree[nodeid])
+        if max_num_nb == 0:
+            return (None, 0)
+        return (nodeid, max_num_nb)
+
+    ############################################################################################
+
+    def remove_node(self, nodeid):
+        """Removes node from graph"""
+
+        if self.degree[nodeid] > 0:
+            nbids = self.row_ids(self.bits[nodeid])
+            self.bits[nbids, nodeid >> 6] &= ~self.bitmask(nodeid)[nodeid >> 6]
+            self.degree[nbids] -= 1
+            self.bits[nodeid] = 0
+            self.degree[nodeid] = 0
+        self.alive[nodeid] = False
+
+    ############################################################################################
+
+    def remove_connection(self, id1, id2):
+        """Removes the edge from node id1 to node id2 in graph"""
+
+        if not self.are_neighbors(id1, id2):
+            raise Exception(f"These nodes are not neighbors: {self.names[id1]}, {self.names[id2]}. "
+                            "Can't remove connection")
+        self.bits[id1, id2 >> 6] &= ~self.bitmask(id2)[id2 >> 6]
+        self.bits[id2, id1 >> 6] &= ~self.bitmask(id1)[id1 >> 6]
+        self.degree[id1] -= 1
+        self.degree[id2] -= 1
+
+    ############################################################################################
+
+    def remove_neighbors(self, nodeid):
+        """Removes neighbors of node from graph, if there are any.
+        All neighbors are removed at once: nodes connected to any of them lose one degree per
+        removed neighbor (popcount of their row, restricted to words where removed nodes are)"""
+
+        import numpy as np
+        if self.degree[nodeid] == 0:
+            return
+        nbids = self.row_ids(self.bits[nodeid])
+        if self.representative is not None:
+            self.representative[nbids] = nodeid
+        mask = self.bitmask(nbids)
+        words = np.flatnonzero(mask)
+        affected = self.row_ids(np.bitwise_or.reduce(self.bits[nbids], axis=0))
+        block = self.bits[np.ix_(affected, words)]
+        self.degree[affected] -= row_popcount(block & mask[words])
+        self.bits[np.ix_(affected, words)] = block & ~mask[words]
+        self.bits[nbids] = 0
+        self.degree[nbids] = 0
+        self.alive[nbids] = False
+
+################################################################################################
+
+class CsrGraph(ArrayGraph):
+    """Graph stored as sorted edge arrays (CSR: neighbor IDs of node i are
+    indices[indptr[i]:indptr[i+1]]), plus degree array and alive flags. Uses around 8 bytes per
+    neighbor pair (no per-node Python sets). For greedy-max: node with most neighbors is found using
+    buckets of node IDs by degree"""
+
+    def build_graph(self, parsed):
+        """Builds CSR arrays and degree buckets from parsed neighbor pairs.
+        Returns list of degrees for nodes that have neighbors"""
+
+        import numpy as np
+        n = len(self.names)
+        ids1 = np.asarray(parsed["edges"][0], dtype=np.int64)
+        ids2 = np.asarray(parsed["edges"][1], dtype=np.int64)
+
+        # Each pair once (as min*n + max): removes duplicate pairs. Self-pairs are not neighbors
+        keys = np.unique(np.minimum(ids1, ids2) * n + np.maximum(ids1, ids2))
+        del ids1, ids2
+        lo, hi = np.divmod(keys, n)
+        keep = lo != hi
+        lo = lo[keep].astype(np.int32)
+        hi = hi[keep].astype(np.int32)
+        del keys, keep
+        rows = np.concatenate([lo, hi])
+        cols = np.concatenate([hi, lo])
+        del lo, hi
+        order = np.argsort(rows, kind="stable")
+        self.indices = cols[order]
+        self.degree = np.bincount(rows, minlength=n).astype(np.int64)
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(self.degree, out=self.indptr[1:])
+        del rows, cols, order
+        self.alive = np.ones(n, dtype=bool)
+        self.cut = defaultdict(set)       # Connections removed by remove_connection: {ID: set of IDs}
+
+        # buckets[d]: IDs of nodes with degree at most d. Degrees only decrease: an entry is
+        # corrected (moved to bucket for current degree) when it reaches top of highest bucket.
+        # Lowest IDs on top, so ties are broken by input order
+        degrees = self.degree.tolist()
+        self.buckets = [[] for i in range(max(degrees, default=0) + 1)]
+        for nodeid in range(n - 1, -1, -1):
+            self.buckets[degrees[nodeid]].append(nodeid)
+        self.maxbucket = len(self.buckets) - 1
+        return self.degree[self.degree > 0].tolist()
+
+    ############################################################################################
+
+    def checkpoint_state(self):
+        """Returns dict of arrays with state of reduction (for Checkpoint). Includes degree buckets,
+        since order within buckets decides ties"""
+
+        import numpy as np
+        state = super().checkpoint_state()
+        state["buckets"] = np.array(list(itertools.chain.from_iterable(self.buckets)), dtype=np.int32)
+        state["bucketsizes"] = np.array([len(bucket) for bucket in self.buckets], dtype=np.int64)
+        state["maxbucket"] = np.array(self.maxbucket)
+        return state
+
+    ############################################################################################
+
+    def restore_state(self, state):
+        import numpy as np
+        super().restore_state(state)
+        ends = np.cumsum(state["bucketsizes"]).tolist()
+        buckets = state["buckets"].tolist()
+        self.buckets = [buckets[end - size:end] for end, size in zip(ends, state["bucketsizes"].tolist())]
+        self.maxbucket = int(state["maxbucket"])
+
+    ############################################################################################
+
+    def neighbor_ids(self, nodeid):
+        """Returns array of IDs of remaining neighbors of nodeid"""
+
+        nbids = self.indices[self.indptr[nodeid]:self.indptr[nodeid + 1]]
+        nbids = nbids[self.alive[nbids]]
+        if nodeid in self.cut:
+            nbids = nbids[[nbid not in self.cut[nodeid] for nbid in nbids.tolist()]]
+        return nbids
+
+    ############################################################################################
+
+    def are_neighbors(self, id1, id2):
+        return id2 in self.neighbor_ids(id1)
+
+    ############################################################################################
+
+    def adjacency_ids(self):
+        """Generator: yields (node ID, list of neighbor IDs) for all nodes that have neighbors"""
+
+        import numpy as np
+        for nodeid in np.flatnonzero(self.degree).tolist():
+            yield nodeid, self.neighbor_ids(nodeid).tolist()
+
+    ############################################################################################
+
+    def most_neighbors(self):
+        """Returns tuple: (node_with_most_nb, max_num_nb)"""
+
+        buckets = self.buckets
+        while self.maxbucket > 0:
+            bucket = buckets[self.maxbucket]
+            if not bucket:
+                self.maxbucket -= 1
+                continue
+            nodeid = bucket[-1]
+            degree = self.degree[nodeid]
+            if degree == self.maxbucket:
+                return (nodeid, int(degree))
+            bucket.pop()
+            if degree > 0:
+                buckets[degree].append(nodeid)
+        return (None, 0)
+
+    ############################################################################################
+
+    def remove_node(self, nodeid):
+        """Removes node from graph"""
+
+        if self.degree[nodeid] > 0:
+            self.degree[self.neighbor_ids(nodeid)] -= 1
+            self.degree[nodeid] = 0
+        self.alive[nodeid] = False
+
+    ############################################################################################
+
+    def remove_connection(self, id1, id2):
+        """Removes the edge from node id1 to node id2 in graph"""
+
+        if not self.are_neighbors(id1, id2):
+            raise Exception(f"These nodes are not neighbors: {self.names[id1]}, {self.names[id2]}. "
+                            "Can't remove connection")
+        self.cut[id1].add(id2)
+        self.cut[id2].add(id1)
+        self.degree[id1] -= 1
+        self.degree[id2] -= 1
+
+    ############################################################################################
+
+    def remove_neighbors(self, nodeid):
+        """Removes neighbors of node from graph, if there are any"""
+
+        if self.degree[nodeid] == 0:
+            return
+        nbids = self.neighbor_ids(nodeid)
+        if self.representative is not None:
+            self.representative[nbids] = nodeid
+        for nbid in nbids.tolist():
+            self.remove_node(nbid)
+
+    ############################################################################################
+
+    def reduce_luby(self):
+        """Parallel reduction (Luby's algorithm, with priority biased towards few neighbors): in each
+        round, all nodes that have lower priority than all their remaining neighbors are selected at
+        once, and their neighbors are removed. Rounds are vectorized over edge arrays, and usually
+        O(log n) rounds are needed. Nodes that have no neighbors left (e.g. keepfile nodes, after
+        remove_keepfile_neighbors) are kept"""
+
+        import numpy as np
+        n = len(self.names)
+        rng = np.random.default_rng(luby_seed)
+        rows = np.repeat(np.arange(n, dtype=np.int32), np.diff(self.indptr))
+        cols = self.indices
+
+        # Remaining edges: between nodes that still have neighbors, and not removed by remove_connection
+        live = (self.degree[rows] > 0) & (self.degree[cols] > 0)
+        if self.cut:
+            cutkeys = [id1 * n + id2 for id1, nbids in self.cut.items() for id2 in nbids]
+            live &= ~np.isin(rows.astype(np.int64) * n + cols, cutkeys)
+        rows = rows[live]
+        cols = cols[live]
+
+        nrounds = 0
+        while len(rows) > 0:
+            nrounds += 1
+            # Priority: number of remaining neighbors, ties broken at random (rank is unique)
+            rank = np.empty(n, dtype=np.int64)
+            rank[np.lexsort((rng.random(n), self.degree))] = np.arange(n)
+            beaten = np.zeros(n, dtype=bool)
+            beaten[rows[rank[cols] < rank[rows]]] = True
+            winning = ~beaten[rows]
+            losers = cols[winning]
+            if self.representative is not None:
+                self.representative[losers] = rows[winning]
+            self.alive[losers] = False
+            decided = np.zeros(n, dtype=bool)
+            decided[rows[winning]] = True
+            decided[losers] = True
+            live = ~(decided[rows] | decided[cols])
+            rows = rows[live]
+            cols = cols[live]
+            self.degree = np.bincount(rows, minlength=n).astype(np.int64)
+            if self.progress.due():
+                self.report_reduction(f"luby round {nrounds}")
+        self.report_reduction(f"luby done ({nrounds} rounds)")
+
+################################################################################################
+
+def row_popcount(rows):
+    """Returns number of set bits in each row of 2-D uint64 array (as int64 array)"""
+
+    import numpy as np
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(rows).sum(axis=1, dtype=np.int64)
+    # numpy < 2.0: count bits per byte, using lookup table
+    table = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+    return table[np.ascontiguousarray(rows).view(np.uint8)].sum(axis=1, dtype=np.int64)
+
+################################################################################################
+################################################################################################
+
+class StreamSelection:
+    """Single pass selection (Hobohm algorithm 1) for INFILE where lines are grouped by first name
+    (all pairs of item1, then all pairs of item2, ...). Items are considered in order of their group:
+    an item is accepted unless it is a neighbor of an already accepted item. Only accepted and
+    blocked (neighbor of accepted) names are stored, not the graph. Approximate: result is
+    usually smaller than from greedy-min"""
+
+    def __init__(self, args):
+        self.args = args
+        self.progress = Progress(args.progress_interval if args.progress else None)
+        self.keepset = set()
+        if args.keepfile:
+            with open(args.keepfile, "r") as keepfile:
+                for line in keepfile:
+                    self.keepset.add(line.strip())
+
+    ############################################################################################
+
+    def run(self):
+        """Reads INFILE once. Sets self.names (all names in input order), self.nodes (selected),
+        and self.origdata"""
+
+        nodeid = {}
+        valuesum = 0
+        accepted = set(self.keepset)       # Keepfile items are accepted before all others
+        blocked = set()                     # Neighbors of accepted items
+        decided = set()                     # Items whose group of neighbor pairs has been read
+        current = None
+        currentnb = []
+        for nrows, chunknodes, chunksum, name1s, name2s, pairvalues in PairReader(self.args, self.progress).chunks():
+            for names in chunknodes:
+                nodeid.update(dict.fromkeys(names))
+            valuesum += chunksum
+            if hasattr(name1s, "tolist"):
+                name1s, name2s = name1s.tolist(), name2s.tolist()
+            for name1, name2 in zip(name1s, name2s):
+                if name1 != current:
+                    if current is not None:
+                        self.decide(current, currentnb, accepted, blocked)
+                        decided.add(current)
+                    if name1 in decided:
+                        raise Exception(f"INFILE must be grouped by first name for --stream: lines for {name1} "
+                                        "are not consecutive")
+                    current = name1
+                    currentnb = []
+                currentnb.append(name2)
+            if self.progress.due():
+                self.progress.write(f"stream: {len(nodeid):,} names read, {len(accepted):,} accepted")
+        if current is not None:
+            self.decide(current, currentnb, accepted, blocked)
+            decided.add(current)
+
+        # Remaining names have no neighbor pairs in their own group: all their neighbors have been
+        # decided, so they are accepted unless blocked
+        self.names = list(nodeid)
+        allnames = set(self.names)
+        self.nodes = (accepted & allnames) | (allnames - blocked - decided)
+        n = len(self.names)
+        self.origdata = {"orignum":n, "streamnum":len(self.nodes)}
+        if self.args.nostats or n < 2:
+            self.origdata["average_dist"] = None
+        else:
+            self.origdata["average_dist"] = valuesum * 2 / (n * (n - 1))
+        self.progress.write(f"stream done: {n:,} names, {len(self.nodes):,} selected")
+
+    ############################################################################################
+
+    def decide(self, name, neighbors, accepted, blocked):
+        """Accepts name if it is not neighbor of accepted item. If accepted: neighbors are blocked"""
+
+        if name in self.keepset:
+            # Neighbors accepted earlier (not listed in their own group) lose their place
+            accepted.difference_update(set(neighbors) - self.keepset)
+        elif name in blocked or not accepted.isdisjoint(neighbors):
+            return
+        accepted.add(name)
+        blocked.update(neighbors)
+
+    ############################################################################################
+
+    def refine(self):
+        """Second pass: improve selection using args.algorithm on the graph of selected items and
+        items with exactly one selected neighbor (the only items that could replace a selected item
+        one for one), then add items left without selected neighbors. Result replaces selection if
+        it is larger"""
+
+        import numpy as np
+        parsed = PairReader(self.args, self.progress).read()
+        names = parsed["names"]
+        n = len(names)
+        ids1 = np.asarray(parsed["edges"][0], dtype=np.int64)
+        ids2 = np.asarray(parsed["edges"][1], dtype=np.int64)
+        # Each pair once (pairs may be listed in both directions)
+        ids1, ids2 = np.divmod(np.unique(np.minimum(ids1, ids2) * n + np.maximum(ids1, ids2)), n)
+        selected = np.zeros(n, dtype=bool)
+        selected[names.ids(list(self.nodes))] = True
+        nselected = (np.bincount(ids1[selected[ids2]], minlength=n)
+                     + np.bincount(ids2[selected[ids1]], minlength=n))
+        candidate = selected | (nselected == 1)
+        both = candidate[ids1] & candidate[ids2]
+        parsed["edges"] = (array.array("i", ids1[both].tolist()), array.array("i", ids2[both].tolist()))
+
+        if self.args.algorithm == "luby":
+            graph = CsrGraph(self.args, parsed, self.progress)
+        else:
+            graph = NeighborGraph(self.args, parsed, self.progress)
+        reduce_graph(graph, self.args)
+        insubset = np.zeros(n, dtype=bool)
+        insubset[graph.selected_ids()] = True
+        insubset &= candidate
+
+        # Items with two or more selected neighbors may have lost all of them: add those that are
+        # now free (in input order, skipping neighbors of items added before them)
+        covered = insubset.copy()
+        covered[ids2[insubset[ids1]]] = True
+        covered[ids1[insubset[ids2]]] = True
+        freepairs = ~covered[ids1] & ~covered[ids2]
+        freeneighbors = defaultdict(list)
+        for id1, id2 in zip(ids1[freepairs].tolist(), ids2[freepairs].tolist()):
+            freeneighbors[id1].append(id2)
+            freeneighbors[id2].append(id1)
+        for i in np.flatnonzero(~covered).tolist():
+            if not covered[i]:
+                insubset[i] = covered[i] = True
+                covered[freeneighbors[i]] = True
+        refined = {names[i] for i in np.flatnonzero(insubset).tolist()}
+        self.origdata["refinednum"] = len(refined)
+        self.progress.write(f"refine done: {len(refined):,} selected (stream: {len(self.nodes):,})")
+        if len(refined) > len(self.nodes):
+            self.nodes = refined
+
+    ############################################################################################
+
+    def write_results(self, args):
+        """Write results to outfile, and extra info to stdout"""
+
+        print(f"\n\tNames in reduced set written to {args.outfile}\n")
+        print(f"\tNumber in original set: {self.origdata['orignum']:>10,}")
+        print(f"\tNumber in reduced set: {len(self.selected_ids()):>11,}\n")
+        print(f"\tSelected in single pass: {self.origdata['streamnum']:>9,}")
+        if "refinednum" in self.origdata:
+            print(f"\tSelected after refining: {self.origdata['refinednum']:>9,}")
+        print()
+        if args.valuetype == "sim":
+            print("\tNode similarities original set:")
+        else:
+            print("\tNode distances original set:")
+        if self.origdata["average_dist"] is None:
+            print(f"\t    ave: {'n/a':>10}")
+        else:
+            print(f"\t    ave: {self.origdata['average_dist']:>10,.2f}")
+        print(f"\t    cutoff: {args.cutoff:>7,.2f}\n")
+        write_outfile(self.names, self.selected_ids(), args)
+
+    ############################################################################################
+
+    def selected_ids(self):
+        """Returns list of IDs (index in self.names) of selected names"""
+
+        return [i for i, name in enumerate(self.names) if name in self.nodes]
+
+################################################################################################
+################################################################################################
+
+# Batch mode: run many jobs (listed in manifest file) in one process pool
+
+batch_columns = ["infile", "outfile", "cutoff", "valuetype", "algorithm"]
+summary_columns = ["job", "infile", "outfile", "cutoff", "valuetype", "algorithm",
+                   "orignum", "reducednum", "seconds", "status"]
+
+def build_batch_parser():
+
+    parser = argparse.ArgumentParser(prog="greedysub batch",
+                                     description="Runs greedysub on each job listed in MANIFEST, using a " +
+                                     "pool of worker processes. Any other options (e.g. --no-stats) are " +
+                                     "used for all jobs")
+
+    parser.add_argument("manifest", metavar="MANIFEST", type=Path,
+                        help="tab separated file with one job per line: " +
+                             "INFILE OUTFILE CUTOFF VALUETYPE [ALGORITHM]. " +
+                             "Empty lines and lines starting with # are ignored")
+
+    parser.add_argument("-o", action="store", dest="summaryfile", metavar="SUMMARYFILE", type=Path,
+                        help="(optional) write summary table to this file instead of stdout")
+
+    parser.add_argument("--workers", action="store", type=int, dest="workers", metavar="N",
+                        default=os.cpu_count(),
+                        help="number of worker processes. 0: run jobs in this process [default: %(default)s]")
+    return parser
+
+################################################################################################
+
+def read_manifest(manifest):
+    """Returns list of job dicts (keys: batch_columns) from manifest file"""
+
+    joblist = []
+    with open(manifest, "r") as infile:
+        for linenum, line in enumerate(infile, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = line.split("\t") if "\t" in line else line.split()
+            if fields[0] == "infile":
+                continue    # Header
+            if len(fields) == 4:
+                fields.append("min")
+            if len(fields) != 5:
+                raise Exception(f"Manifest line {linenum} should have 4 or 5 fields: {line}")
+            joblist.append(dict(zip(batch_columns, fields)))
+    return joblist
+
+################################################################################################
+
+def run_batch_job(job, extra_options):
+    """Runs one job (dict from read_manifest) in current process. Returns dict with summary info.
+    Output normally written to stdout is discarded"""
+
+    summary = dict(job, orignum="", reducednum="", seconds="", status="ok")
+    starttime = time.monotonic()
+    try:
+        commandlist = ["--val", job["valuetype"], "-c", job["cutoff"], "--algo", job["algorithm"],
+                       *extra_options, job["infile"], job["outfile"]]
+        # Python note: argparse errors call sys.exit (SystemExit is not an Exception)
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()) as err:
+            try:
+                args = parse_commandline(commandlist)
+            except SystemExit:
+                raise Exception(err.getvalue().strip().split("\n")[-1])
+            graph = run_selection(args)
+        summary["orignum"] = graph.origdata["orignum"]
+        summary["reducednum"] = len(graph.selected_ids())
+    except Exception as err:
+        summary["status"] = f"error: {err}".replace("\t", " ").replace("\n", " ")
+    summary["seconds"] = f"{time.monotonic() - starttime:.2f}"
+    return summary
+
+################################################################################################
+
+def batch_main(commandlist):
+    """Runs all jobs in manifest, and writes summary table. Returns exit status (1 if any job failed)"""
+
+    parser = build_batch_parser()
+    args, extra_options = parser.parse_known_args(commandlist)
+    joblist = read_manifest(args.manifest)
+    for jobnum, job in enumerate(joblist, start=1):
+        job["job"] = jobnum
+
+    if args.workers == 0:
+        summaries = [run_batch_job(job, extra_options) for job in joblist]
+    else:
+        # Python note: each worker process imports pandas (and this module) once, and is reused for many jobs
+        import concurrent.futures
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as executor:
+            summaries = list(executor.map(run_batch_job, joblist, itertools.repeat(extra_options)))
+
+    lines = ["\t".join(summary_columns)]
+    for summary in summaries:
+        lines.append("\t".join(str(summary[col]) for col in summary_columns))
+    if args.summaryfile:
+        write_names(lines, args.summaryfile)
+    else:
+        print("\n".join(lines))
+
+    nfailed = sum(summary["status"] != "ok" for summary in summaries)
+    if nfailed:
+        sys.stderr.write(f"# Batch warning: {nfailed} of {len(summaries)} jobs failed\n")
+        return 1
+    return 0
+
+################################################################################################
+
+# Server mode: parsed graphs are kept in memory, and selection requests are answered without
+# re-reading INFILE. Requests and responses are JSON objects, one per line
+
+def build_serve_parser():
+
+    parser = argparse.ArgumentParser(prog="greedysub serve",
+                                     description="Answers selection requests (JSON, one per line) on a Unix " +
+                                     "socket or localhost port. Parsed graphs are kept in memory, so repeated " +
+                                     "requests for the same INFILE, cutoff and value type do not re-read INFILE")
+
+    parser.add_argument("--socket", action="store", dest="socket", metavar="PATH", type=Path,
+                        help="listen on Unix socket PATH")
+
+    parser.add_argument("--port", action="store", type=int, dest="port", metavar="N",
+                        help="listen on localhost (127.0.0.1) port N")
+
+    parser.add_argument("--cache-mb", action="store", type=float, dest="cache_mb", metavar="MB", default=2000,
+                        help="memory for parsed graphs: least recently used graphs are removed when "
+                             "this is exceeded [default: %(default)s]")
+    return parser
+
+################################################################################################
+
+class GraphCache:
+    """Parsed graphs (dicts from PairReader.read(): names and neighbor pairs), keyed by input_identity.
+    When total size exceeds maxbytes, least recently used graphs are removed (the newest is kept)"""
+
+    def __init__(self, maxbytes):
+        from collections import OrderedDict
+        self.maxbytes = maxbytes
+        self.entries = OrderedDict()        # key: (parsed, nbytes)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    ############################################################################################
+
+    def get(self, key):
+        """Returns parsed graph for key (and marks it as most recently used), or None"""
+
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key][0]
+
+    ############################################################################################
+
+    def put(self, key, parsed):
+        nbytes = parsed["names"].nbytes() + sum(edges.itemsize * len(edges) for edges in parsed["edges"])
+        self.entries[key] = (parsed, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.maxbytes and len(self.entries) > 1:
+            self.nbytes -= self.entries.popitem(last=False)[1][1]
+
+    ############################################################################################
+
+    def stats(self):
+        return {"graphs": len(self.entries), "cache_mb": round(self.nbytes / 1e6, 3),
+                "hits": self.hits, "misses": self.misses}
+
+################################################################################################
+
+def serve_request(request, cache):
+    """Runs one request (dict) using cache. Returns response dict (status "ok", or error message).
+    Request keys: infile, cutoff, valuetype, and optionally algorithm, keepfile, options (list of
+    other command line options), outfile (if not given: selected names are returned in response).
+    Request {"command": "stats"} returns cache info"""
+
+    response = {"status": "ok"}
+    starttime = time.monotonic()
+    try:
+        command = request.get("command", "select")
+        if command == "stats":
+            response.update(cache.stats())
+        elif command != "select":
+            raise Exception(f"Unknown command: {command}")
+        else:
+            for field in ["infile", "cutoff", "valuetype"]:
+                if field not in request:
+                    raise Exception(f"Request is missing field: {field}")
+            commandlist = ["--val", str(request["valuetype"]), "-c", str(request["cutoff"]),
+                           "--algo", str(request.get("algorithm", "min"))]
+            if request.get("keepfile"):
+                commandlist += ["-k", str(request["keepfile"])]
+            commandlist += [*map(str, request.get("options", [])), str(request["infile"]),
+                            str(request.get("outfile", os.devnull))]
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()) as err:
+                try:
+                    args = parse_commandline(commandlist)
+                except SystemExit:
+                    raise Exception(err.getvalue().strip().split("\n")[-1])
+                if args.stream or args.folds or args.checkpoint:
+                    raise Exception("--stream, --folds, and --checkpoint can not be used in server mode")
+                key = json.dumps(input_identity(args), sort_keys=True)
+                parsed = cache.get(key)
+                response["cached"] = parsed is not None
+                if parsed is None:
+                    parsed = PairReader(args, Progress(None)).read()
+                    cache.put(key, parsed)
+                graph = make_graph(args, parsed)
+                reduce_graph(graph, args)
+                if "outfile" in request:
+                    graph.write_results(args)
+            response["orignum"] = graph.origdata["orignum"]
+            response["reducednum"] = len(graph.selected_ids())
+            if "outfile" not in request:
+                response["names"] = list(sorted_nodes(graph.names, graph.selected_ids(), args.sort))
+    except Exception as err:
+        response["status"] = f"error: {err}"
+    response["seconds"] = round(time.monotonic() - starttime, 4)
+    return response
+
+################################################################################################
+
+class ServeHandler(socketserver.StreamRequestHandler):
+    """Reads requests (JSON, one per line) from connection, and writes one response line for each.
+    Requests are run one at a time (lock shared by all connections)"""
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError
+            except ValueError:
+                request = None
+                response = {"status": "error: request must be JSON object"}
+            else:
+                with self.server.lock:
+                    if request.get("command") == "shutdown":
+                        response = {"status": "ok"}
+                    else:
+                        response = serve_request(request, self.server.cache)
+            self.wfile.write((json.dumps(response) + "\n").encode())
+            self.wfile.flush()
+            if request and request.get("command") == "shutdown":
+                # Python note: shutdown() waits for serve_forever() to return, so must be called from other thread
+                threading.Thread(target=self.server.shutdown).start()
+                return
+
+################################################################################################
+
+def serve_main(commandlist):
+    """Listens for requests until interrupted (or shutdown request). Returns exit status"""
+
+    parser = build_serve_parser()
+    args = parser.parse_args(commandlist)
+    if (args.socket is None) == (args.port is None):
+        parser.error("Specify either --socket PATH or --port N")
+
+    if args.socket:
+        if args.socket.is_socket():
+            args.socket.unlink()        # Left by previous server
+        server = socketserver.ThreadingUnixStreamServer(str(args.socket), ServeHandler)
+        address = args.socket
+    else:
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        server = socketserver.ThreadingTCPServer(("127.0.0.1", args.port), ServeHandler)
+        address = f"127.0.0.1:{args.port}"
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.cache = GraphCache(args.cache_mb * 1e6)
+
+    sys.stderr.write(f"# Serving on {address}\n")
+    try:
+        with server:
+            server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.socket and args.socket.is_socket():
+            args.socket.unlink()
+    return 0
+
+################################################################################################
+
+# Verify mode: checks that OUTFILE is an independent set in graph from INFILE (and whether it is maximal)
+# in one pass over INFILE, with memory for names only
+
+def build_verify_parser():
+
+    parser = argparse.ArgumentParser(prog="greedysub verify",
+                                     usage="greedysub verify [-h] [--show N] --val VALUETYPE -c CUTOFF " +
+                                           "[options] INFILE OUTFILE",
+                                     description="Checks that no two names in OUTFILE are neighbors in INFILE, " +
+                                     "and reports removed names that have no neighbor in OUTFILE (selection is " +
+                                     "then not maximal). INFILE (text, Parquet, or Arrow) is read in chunks. " +
+                                     "OUTFILE: text file (one name per line), or numpy mask (as written by " +
+                                     "--outformat npy). Other options (e.g. --informat, --chunk) are as for " +
+                                     "greedysub. Exit status is 1 if OUTFILE contains neighbors")
+
+    parser.add_argument("--show", action="store", type=int, dest="show", metavar="N", default=10,
+                        help="number of neighbor pairs in OUTFILE, and of non-maximal names, listed "
+                             "[default: %(default)s]")
+    return parser
+
+################################################################################################
+
+def read_selection(outfile):
+    """Returns list of selected names from OUTFILE: text (one name per line, gzip compressed if name
+    ends in .gz), or numpy mask over names in OUTFILE with suffix .names.txt (as written by
+    --outformat npy: recognized from file contents)"""
+
+    outfile = Path(outfile)
+    with open(outfile, "rb") as infile:
+        magic = infile.read(6)
+    if magic == b"\x93NUMPY":
+        import numpy as np
+        mask = np.load(outfile)
+        with open(outfile.with_suffix(".names.txt")) as namefile:
+            names = namefile.read().split()
+        if len(names) != len(mask):
+            raise Exception(f"Mask in {outfile} does not match names in {outfile.with_suffix('.names.txt')}")
+        return [name for name, selected in zip(names, mask) if selected]
+    if outfile.suffix.lower() == ".gz":
+        infile = gzip.open(outfile, "rt")
+    else:
+        infile = open(outfile, "r")
+    with infile:
+        return [line.strip() for line in infile if line.strip()]
+
+################################################################################################
+
+def verify_selection(args, selection, show=10):
+    """Reads INFILE in chunks, and checks selection (list of names) against neighbor pairs.
+    Returns dict with keys: nselected, nnames (in INFILE), violations (number of neighbor pairs where
+    both names are selected), violationlist (first show pairs: name1, name2, value), nonmaximal (number
+    of names that are not selected and have no selected neighbor), nonmaximallist (first show names),
+    unknown (selected names not in INFILE)"""
+
+    import numpy as np
+    import pandas as pd
+
+    # Python note: object dtype index hashes names in C (isin on arrow string arrays loops in Python)
+    selected = pd.Index(selection, dtype=object).unique()
+    seen = {}                               # name: ID, in order first seen
+    covered = np.zeros(0, dtype=bool)       # For each name in seen: selected, or has selected neighbor
+    violations = 0
+    violationlist = []
+    for codes1, uniques1, codes2, uniques2, values in factorized_batches(args):
+        chunkids = []
+        chunksel = []
+        for codes, uniques in [(codes1, uniques1), (codes2, uniques2)]:
+            uniqueids = np.fromiter((seen.setdefault(name, len(seen)) for name in uniques),
+                                    dtype=np.int64, count=len(uniques))
+            chunkids.append(uniqueids[codes])
+            chunksel.append(pd.Index(uniques, dtype=object).isin(selected)[codes])
+        if len(covered) < len(seen):
+            covered = np.concatenate([covered, np.zeros(len(seen) - len(covered), dtype=bool)])
+        ids1, ids2 = chunkids
+        sel1, sel2 = chunksel
+        if args.valuetype == "sim":
+            neighbors = values > args.cutoff
+        else:
+            neighbors = values < args.cutoff
+        neighbors &= ids1 != ids2
+        covered[ids1[sel1]] = True
+        covered[ids2[sel2]] = True
+        covered[ids1[neighbors & sel2]] = True
+        covered[ids2[neighbors & sel1]] = True
+
+        bad = np.flatnonzero(neighbors & sel1 & sel2)
+        violations += len(bad)
+        for row in bad[:max(show - len(violationlist), 0)]:
+            violationlist.append((uniques1[codes1[row]], uniques2[codes2[row]], float(values[row])))
+
+    nonmaximal_ids = np.flatnonzero(~covered)
+    shown = set(nonmaximal_ids[:show].tolist())
+    return {"nselected": len(selected), "nnames": len(seen), "violations": violations,
+            "violationlist": violationlist, "nonmaximal": len(nonmaximal_ids),
+            "nonmaximallist": [name for name, nameid in seen.items() if nameid in shown],
+            "unknown": sum(name not in seen for name in selected)}
+
+################################################################################################
+
+def verify_main(commandlist):
+    """Verifies OUTFILE against INFILE, and prints report. Returns exit status (1 if OUTFILE contains
+    neighbors)"""
+
+    parser = build_verify_parser()
+    verifyargs, extra_options = parser.parse_known_args(commandlist)
+    if verifyargs.show < 0:
+        parser.error("--show must be zero or positive")
+    args = parse_commandline(extra_options)
+    if args.cutoff is None or input_format(args) in ("vectors", "fasta"):
+        parser.error("verify requires cutoff (option -c), and pair INFILE (text, Parquet, or Arrow)")
+    if args.pair_agg not in ("none", lenient_policy(args.valuetype)):
+        parser.error(f"verify checks each line of INFILE: --pair-agg must be none or "
+                     f"{lenient_policy(args.valuetype)} (pair is neighbor if any line passes cutoff)")
+
+    result = verify_selection(args, read_selection(args.outfile), verifyargs.show)
+    print(f"\n\tVerified {args.outfile} against {args.infile}")
+    print(f"\tNeighbors: {'similarity >' if args.valuetype == 'sim' else 'distance <'} {args.cutoff:,}\n")
+    print(f"\t{'Names in INFILE:':<42}{result['nnames']:>12,}")
+    print(f"\t{'Selected names:':<42}{result['nselected']:>12,}")
+    print(f"\t{'Neighbor pairs in selection:':<42}{result['violations']:>12,}")
+    for name1, name2, value in result["violationlist"]:
+        print(f"\t    {name1} {name2} {value:.6g}")
+    print(f"\t{'Removed names without selected neighbor:':<42}{result['nonmaximal']:>12,}")
+    for name in result["nonmaximallist"]:
+        print(f"\t    {name}")
+    if result["unknown"]:
+        sys.stderr.write(f"# Verify warning: {result['unknown']:,} selected names are not in INFILE\n")
+    if result["violations"]:
+        print("\n\tFAILED: selection contains neighbors\n")
+        return 1
+    if result["nonmaximal"]:
+        print("\n\tOK: no neighbors in selection (but selection is not maximal)\n")
+    else:
+        print("\n\tOK: no neighbors in selection, and selection is maximal\n")
+    return 0
+
+################################################################################################
+
+# Estimate mode: size of reduced set for several cutoffs, from greedy-min on graph of random sample
+# of names (all pairs among them). One pass over INFILE, without building full graph
+
+def parse_cutoffs(text):
+    """argparse type for comma separated list of cutoffs. Returns sorted list of floats"""
+
+    try:
+        return sorted(float(cutoff) for cutoff in text.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid list of cutoffs: '{text}' (example: 0.5,0.7,0.9)")
+
+################################################################################################
+
+def factorized_batches(args):
+    """Generator: reads text, Parquet, or Arrow INFILE. Yields tuple for each chunk:
+    (codes1, uniques1, codes2, uniques2, values), where codes and uniques are as from pd.factorize
+    (uniques as list), and values is numpy array (NaN where value column was not read)"""
+
+    if input_format(args) == "text":
+        batches = factorized_text_batches(args)
+    else:
+        batches = factorized_arrow_batches(args)
+
+    # Code -1 (missing name) would otherwise be used as index of last name in uniques
+    for codes1, uniques1, codes2, uniques2, values in batches:
+        if len(codes1) and min(codes1.min(), codes2.min()) < 0:
+            raise Exception("INFILE has missing (empty or null) names")
+        yield codes1, uniques1, codes2, uniques2, values
+
+def factorized_text_batches(args):
+    """Generator: yields tuples as factorized_batches() for text INFILE"""
+
+    import pandas as pd
+    chunksize = int(max(args.chunk * 1_000_000, 1))
+    compression = compression_suffixes.get(Path(args.infile).suffix.lower())
+    reader = pd.read_csv(args.infile, engine="c", sep=r"\s+", chunksize=chunksize, compression=compression,
+                         names=["name1", "name2", "val"], dtype={"name1":str, "name2":str, "val":float},
+                         **text_na_options)
+    for df in reader:
+        codes1, uniques1 = pd.factorize(df["name1"].values)
+        codes2, uniques2 = pd.factorize(df["name2"].values)
+        yield codes1, uniques1.tolist(), codes2, uniques2.tolist(), df["val"].values
+
+def factorized_arrow_batches(args):
+    """Generator: yields tuples as factorized_batches() for Parquet or Arrow INFILE"""
+
+    import numpy as np
+    for batch, has_neighbors, done, total in PairReader(args, Progress(None)).arrow_batches():
+        if batch.num_columns > 2:
+            values = batch.column(2).to_numpy(zero_copy_only=False).astype(float)
+        else:
+            values = np.full(batch.num_rows, np.nan)
+        yield (*arrow_factorized(batch.column(0)), *arrow_factorized(batch.column(1)), values)
+
+################################################################################################
+
+def scan_sample(args, fraction, cutoff):
+    """Reads INFILE once, and collects names in sample (names with hash below fraction of range), and
+    pairs among them where value passes cutoff (all pairs if cutoff is None). Hash (CRC32 of name)
+    does not depend on input order.
+    Returns dict with keys: names (NameTable of sampled names), ids1, ids2 (int32 arrays of IDs for
+    pairs), values (array), nlines"""
+
+    import numpy as np
+    import zlib
+    limit = fraction * 2**32
+    names = NameTable()
+    ids1, ids2, values = [], [], []
+    nlines = 0
+    for codes1, uniques1, codes2, uniques2, vals in factorized_batches(args):
+        nlines += len(vals)
+        uniqueids = []
+        for uniques in [uniques1, uniques2]:
+            sampled = [name for name in uniques if zlib.crc32(name.encode()) < limit]
+            names.add(sampled)
+            lookup = dict(zip(sampled, names.ids(sampled)))
+            uniqueids.append(np.array([lookup.get(name, -1) for name in uniques], dtype=np.int64))
+        chunkids1 = uniqueids[0][codes1]
+        chunkids2 = uniqueids[1][codes2]
+        if cutoff is None:
+            keep = np.ones(len(vals), dtype=bool)
+        elif args.valuetype == "sim":
+            keep = vals > cutoff
+        else:
+            keep = vals < cutoff
+        keep &= (chunkids1 >= 0) & (chunkids2 >= 0) & (chunkids1 != chunkids2)
+        ids1.append(chunkids1[keep])
+        ids2.append(chunkids2[keep])
+        values.append(vals[keep])
+    return {"names": names, "ids1": np.concatenate(ids1 or [[]]).astype(np.int32),
+            "ids2": np.concatenate(ids2 or [[]]).astype(np.int32),
+            "values": np.concatenate(values or [[]]), "nlines": nlines}
+
+################################################################################################
+
+def extrapolate_subset(fractions, nselected):
+    """Returns estimated size of reduced set for all names, from sizes of reduced sets (nselected) for
+    nested random samples (fractions of all names, increasing). log(size) is fitted as quadratic
+    function of log(fraction), and evaluated at fraction 1. Result is kept between size for largest
+    sample, and its linear extrapolation"""
+
+    import numpy as np
+    largest = nselected[-1]
+    if fractions[-1] >= 1:
+        return float(largest)
+    linear = largest / fractions[-1]
+    if min(nselected) == 0:
+        return float(linear)
+    coefs = np.polyfit(np.log(fractions), np.log(nselected), 2)
+    return float(min(max(np.exp(np.polyval(coefs, 0.0)), largest), linear))
+
+################################################################################################
+
+def run_estimate(args):
+    """Estimates size of reduced set for each cutoff in args.estimate. Greedy-min is run on graphs of
+    nested samples of names (estimate_levels: fractions of sample), and sizes are extrapolated to all
+    names. Confidence intervals from delete-a-group jackknife (sampled names split in groups by hash).
+    Writes table to OUTFILE and stdout. Returns list of dicts (one per cutoff)"""
+
+    import numpy as np
+    import zlib
+    import math
+
+    # Size of sample: from number of names estimated from start of INFILE (as for --max-memory)
+    loosest = args.estimate[0] if args.valuetype == "sim" else args.estimate[-1]
+    headargs = argparse.Namespace(**dict(vars(args), cutoff=loosest))
+    sample = sample_head(headargs)
+    fraction = 1.0
+    if sample is not None and sample["rows"] > 0:
+        nnames_head = estimate_names(2 * sample["rows"], len(sample["names"]), 2 * sample["totalrows"])
+        fraction = min(1.0, args.estimate_size / nnames_head)
+
+    # With --pair-agg, values of all lines for pair are needed unless any passing line makes it a neighbor
+    if args.pair_agg in ("none", lenient_policy(args.valuetype)):
+        scanned = scan_sample(args, fraction, loosest)
+    else:
+        scanned = scan_sample(args, fraction, None)
+    if args.pair_agg != "none":
+        aggregator = PairAggregator(args.pair_agg)
+        aggregator.add(scanned["ids1"], scanned["ids2"], scanned["values"])
+        ids1, ids2, values = aggregator.pairs()
+        scanned.update(ids1=ids1.astype(np.int32), ids2=ids2.astype(np.int32), values=values)
+    names = scanned["names"]
+    nsampled = len(names)
+    hashes = np.array([zlib.crc32(name.encode()) for name in names], dtype=np.int64)
+    groups = hashes % estimate_groups
+    fractions = [fraction * level for level in estimate_levels]
+    insample = [hashes < frac * 2**32 for frac in fractions]
+
+    results = []
+    for cutoff in args.estimate:
+        if args.valuetype == "sim":
+            passes = scanned["values"] > cutoff
+        else:
+            passes = scanned["values"] < cutoff
+        ids1 = scanned["ids1"][passes]
+        ids2 = scanned["ids2"][passes]
+        cutoffargs = argparse.Namespace(**dict(vars(args), cutoff=cutoff, nostats=True, keepfile=None,
+                                               clusterfile=None, progress=False))
+
+        # All names sampled: result is exact (graph representation chosen as for normal run)
+        if fraction >= 1:
+            parsed = {"names": names, "valuesum": 0, "nlines": scanned["nlines"], "readerstats": None,
+                      "edges": (array.array("i", ids1.tobytes()), array.array("i", ids2.tobytes()))}
+            graph = make_graph(cutoffargs, parsed)
+            reduce_graph(graph, cutoffargs)
+            sampleselected = len(graph.selected_ids())
+            results.append({"cutoff": cutoff, "estimate": float(sampleselected), "ci_low": float(sampleselected),
+                            "ci_high": float(sampleselected), "sampled": nsampled, "selected": sampleselected})
+            continue
+
+        # Greedy-min on each nested sample, for all sampled names and without each group.
+        # Names outside sample have no edges, and are not counted. Edge arrays (CSR) are used, since
+        # there are many small graphs, and they are reduced much faster than dict-of-sets
+        estimates = []
+        for group in [None, *range(estimate_groups)]:
+            nselected = []
+            for nodes in insample:
+                if group is not None:
+                    nodes = nodes & (groups != group)
+                keep = nodes[ids1] & nodes[ids2]
+                parsed = {"names": names, "valuesum": 0, "nlines": scanned["nlines"], "readerstats": None,
+                          "edges": (ids1[keep], ids2[keep])}
+                graph = CsrGraph(cutoffargs, parsed)
+                reduce_graph(graph, cutoffargs)
+                nselected.append(int(np.count_nonzero(nodes & graph.alive)))
+            if group is None:
+                estimates.append(extrapolate_subset(fractions, nselected))
+                sampleselected = nselected[-1]
+            else:
+                groupfraction = (estimate_groups - 1) / estimate_groups
+                estimates.append(extrapolate_subset([frac * groupfraction for frac in fractions], nselected))
+
+        estimate = estimates[0]
+        partial = estimates[1:]
+        mean = sum(partial) / len(partial)
+        stderr = math.sqrt((len(partial) - 1) / len(partial) * sum((x - mean) ** 2 for x in partial))
+        results.append({"cutoff": cutoff, "estimate": estimate, "ci_low": max(estimate - 1.96 * stderr, 0),
+                        "ci_high": estimate + 1.96 * stderr, "sampled": nsampled, "selected": sampleselected})
+
+    print(f"\n\tEstimated size of reduced set written to {args.outfile}\n")
+    print(f"\tNames sampled: {nsampled:,} ({fraction:.2%} of names in INFILE)")
+    print("\tEstimates from greedy-min on all pairs among sampled names (95% confidence intervals)\n")
+    print(f"\t{'cutoff':>10} {'sampled':>9} {'selected':>9} {'estimate':>12} {'95% CI':>25}")
+    for result in results:
+        ci = f"{result['ci_low']:,.0f} - {result['ci_high']:,.0f}"
+        print(f"\t{result['cutoff']:>10,.4g} {result['sampled']:>9,} {result['selected']:>9,} "
+              f"{result['estimate']:>12,.0f} {ci:>25}")
+    print()
+    lines = ["\t".join(estimate_columns)]
+    for result in results:
+        lines.append("\t".join(f"{result[col]:.6g}" if isinstance(result[col], float) else str(result[col])
+                               for col in estimate_columns))
+    write_names(lines, args.outfile)
+    return results
+
+################################################################################################
+
+def assign_folds(compsizes, k):
+    """Balanced bin-packing: assigns each component (largest first) to currently smallest fold.
+    Input: dict {component: size}, and number of folds.
+    Returns tuple: (dict {component: fold}, list of fold sizes)"""
+
+    foldheap = [(0, fold) for fold in range(k)]
+    compfold = {}
+    for comp, compsize in sorted(compsizes.items(), key=lambda item: (-item[1], item[0])):
+        foldsize, fold = heapq.heappop(foldheap)
+        compfold[comp] = fold
+        heapq.heappush(foldheap, (foldsize + compsize, fold))
+    foldsizes = [0] * k
+    for foldsize, fold in foldheap:
+        foldsizes[fold] = foldsize
+    return compfold, foldsizes
+
+################################################################################################
+
+def write_outfile(names, ids, args):
+    """Writes selected names (given by list of IDs, in input order) to args.outfile: as text (in order
+    args.sort), or as numpy mask over names (all names, in input order).
+    Names are decoded here (names may be NameTable)"""
+
+    if args.outformat == "npy":
+        import numpy as np
+        mask = np.zeros(len(names), dtype=bool)
+        mask[ids] = True
+        with open(args.outfile, "wb") as outfile:
+            np.save(outfile, mask)
+        write_names(names, Path(args.outfile).with_suffix(".names.txt"))
+    else:
+        write_names(sorted_nodes(names, ids, args.sort), args.outfile)
+
+################################################################################################
+
+def sorted_nodes(names, ids, order):
+    """Returns names for IDs as iterable in requested order ("input", "name", or "none").
+    IDs are in input order, so order "none" is same as "input" (kept for compatibility)"""
+
+    if order == "name":
+        return sorted(names[i] for i in ids)
+    else:
+        return (names[i] for i in ids)
+
+################################################################################################
 
-        with open(args.outfile, "w") as outfile:
-            for name in self.nodes:
-                outfile.write("{}\n".format(name))
+def write_names(names, filename, blocksize=100_000):
+    """Writes names to file, one per line, joining blocks of names into single write calls.
+    File is gzip compressed if filename ends in .gz"""
+
+    if Path(filename).suffix.lower() == ".gz":
+        outfile = gzip.open(filename, "wt", compresslevel=6)
+    else:
+        outfile = open(filename, "w")
+    with outfile:
+        names = iter(names)
+        block = list(itertools.islice(names, blocksize))
+        while block:
+            outfile.write("\n".join(block))
+            outfile.write("\n")
+            block = list(itertools.islice(names, blocksize))
 
 ################################################################################################
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -1,6 +1,7 @@
 import pytest
 import greedysub as grsub
 import itertools
+import random
 import collections
 import copy
 from pathlib import Path
@@ -710,3 +711,1397 @@ class Test_main:
 
 
 
+###################################################################################################
+###################################################################################################
+
+class Test_progress:
+
+    def test_option_default_off(self):
+        commandlist = "--val dist -c 10 infile.txt outfile.txt".split()
+        args = grsub.parse_commandline(commandlist)
+        assert not args.progress
+        assert not grsub.Progress(None).due()
+
+    def test_option_interval(self):
+        args = grsub.parse_commandline("--val dist -c 10 --progress infile.txt outfile.txt".split())
+        assert args.progress
+        assert args.progress_interval == 5.0
+        commandlist = "--val dist -c 10 --progress --progress-interval 0.5 infile.txt outfile.txt".split()
+        args = grsub.parse_commandline(commandlist)
+        assert args.progress_interval == 0.5
+
+    def test_rate_limited(self):
+        progress = grsub.Progress(3600)
+        assert not progress.due()
+        progress = grsub.Progress(0)
+        assert progress.due()
+
+    def test_reports_on_stderr(self, tmp_path, graph_example_02, capsys):
+        resultfile = tmp_path / "outfile.txt"
+        distfile, nodes, pairs, cutoff = graph_example_02
+        commandlist = f"--val dist -c {cutoff} --progress --progress-interval 0 --chunk 0.000005 {distfile} {resultfile}".split()
+        grsub.main(commandlist)
+        err = capsys.readouterr().err
+        assert "parsing: " in err
+        assert "ETA" in err
+        assert "parsing done: 21 lines" in err
+        assert "greedy-min done: 0 connected nodes, 0 edges left, 2 names remaining" in err
+
+###################################################################################################
+###################################################################################################
+
+class Test_node_collection:
+
+    def test_allpairs_same_nodes(self, random_pairfile_50nodes):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        for chunk in ["1", "0.00001"]:
+            commandlist = f"--val dist -c {cutoff} --allpairs --chunk {chunk} {distfile} outfile.txt".split()
+            args = grsub.parse_commandline(commandlist)
+            gr = grsub.NeighborGraph(args)
+            assert gr.nodes == set(nodes)
+
+    def test_allpairs_incomplete_warning(self, tmp_path, capsys):
+        distfile = tmp_path / "distfile.txt"
+        distfile.write_text("n1 n2 1\nn1 n3 1\n")
+        commandlist = f"--val dist -c 5 --allpairs {distfile} outfile.txt".split()
+        args = grsub.parse_commandline(commandlist)
+        gr = grsub.NeighborGraph(args)
+        assert gr.nodes == {"n1", "n2", "n3"}
+        assert "--allpairs used, but INFILE has 2 lines for 3 names" in capsys.readouterr().err
+
+    def test_no_stats(self, tmp_path, graph_example_02, capsys):
+        resultfile = tmp_path / "outfile.txt"
+        distfile, nodes, pairs, cutoff = graph_example_02
+        commandlist = f"--val dist -c {cutoff} --no-stats {distfile} {resultfile}".split()
+        grsub.main(commandlist)
+        outlines = capsys.readouterr().out.split("\n")
+        assert int(outlines[3].split()[-1]) == 7
+        assert outlines[12].split()[-1] == "n/a"
+
+###################################################################################################
+###################################################################################################
+
+class Test_arrow_input:
+
+    def pairtable(self, distfile):
+        pa = pytest.importorskip("pyarrow")
+        rows = [line.split() for line in distfile.read_text().splitlines()]
+        return pa.table({"query": [r[0] for r in rows],
+                         "target": [r[1] for r in rows],
+                         "dist": [float(r[2]) for r in rows]})
+
+    def textgraph(self, distfile, cutoff):
+        args = grsub.parse_commandline(f"--val dist -c {cutoff} {distfile} outfile.txt".split())
+        return grsub.NeighborGraph(args)
+
+    def test_informat_auto(self):
+        for filename, expected in [("in.txt", "text"), ("in.parquet", "parquet"),
+                                   ("in.PQ", "parquet"), ("in.arrow", "arrow"), ("in.feather", "arrow")]:
+            args = grsub.build_parser().parse_args(f"--val dist -c 1 {filename} out.txt".split())
+            assert grsub.input_format(args) == expected
+        args = grsub.build_parser().parse_args("--val dist -c 1 --informat text in.parquet out".split())
+        assert grsub.input_format(args) == "text"
+
+    @pytest.mark.parametrize("allpairs", ["", "--allpairs"])
+    def test_parquet_same_as_text(self, tmp_path, random_pairfile_50nodes, allpairs):
+        pq = pytest.importorskip("pyarrow.parquet")
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        parquetfile = tmp_path / "pairs.parquet"
+        pq.write_table(self.pairtable(distfile), parquetfile, row_group_size=100)
+        commandlist = f"--val dist -c {cutoff} {allpairs} {parquetfile} outfile.txt".split()
+        gr = grsub.NeighborGraph(grsub.parse_commandline(commandlist))
+        textgr = self.textgraph(distfile, cutoff)
+        assert gr.nodes == textgr.nodes
+        assert gr.neighbors == textgr.neighbors
+        assert gr.origdata["average_dist"] == pytest.approx(textgr.origdata["average_dist"])
+
+    def test_parquet_rowgroup_skipping(self, tmp_path, graph_example_02, monkeypatch):
+        pq = pytest.importorskip("pyarrow.parquet")
+        distfile, nodes, pairs, cutoff = graph_example_02
+        table = self.pairtable(distfile)
+        table = table.sort_by("dist")
+        parquetfile = tmp_path / "pairs.parquet"
+        pq.write_table(table, parquetfile, row_group_size=5)
+        skipped = []
+        orig = grsub.row_group_has_neighbors
+        def spy(rowgroup, args):
+            result = orig(rowgroup, args)
+            skipped.append(not result)
+            return result
+        monkeypatch.setattr(grsub, "row_group_has_neighbors", spy)
+        commandlist = f"--val dist -c {cutoff} --no-stats {parquetfile} outfile.txt".split()
+        gr = grsub.NeighborGraph(grsub.parse_commandline(commandlist))
+        textgr = self.textgraph(distfile, cutoff)
+        assert any(skipped)
+        assert gr.nodes == textgr.nodes
+        assert gr.neighbors == textgr.neighbors
+
+    def test_arrow_ipc(self, tmp_path, random_pairfile_50nodes):
+        pa = pytest.importorskip("pyarrow")
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        table = self.pairtable(distfile)
+        table = table.set_column(0, "query", table.column(0).dictionary_encode())
+        arrowfile = tmp_path / "pairs.arrow"
+        with pa.ipc.new_file(arrowfile, table.schema) as writer:
+            writer.write_table(table, max_chunksize=200)
+        commandlist = f"--val dist -c {cutoff} {arrowfile} outfile.txt".split()
+        gr = grsub.NeighborGraph(grsub.parse_commandline(commandlist))
+        textgr = self.textgraph(distfile, cutoff)
+        assert gr.nodes == textgr.nodes
+        assert gr.neighbors == textgr.neighbors
+
+###################################################################################################
+###################################################################################################
+
+class Test_output_formats:
+
+    def test_sort_name(self, tmp_path, random_pairfile_50nodes):
+        resultfile = tmp_path / "outfile.txt"
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        grsub.main(f"--val dist -c {cutoff} --sort name {distfile} {resultfile}".split())
+        names = resultfile.read_text().splitlines()
+        assert names == sorted(names)
+
+    def test_sort_input(self, tmp_path, graph_example_01):
+        resultfile = tmp_path / "outfile.txt"
+        distfile, nodes, pairs, cutoff = graph_example_01
+        grsub.main(f"--val dist -c {cutoff} --sort input {distfile} {resultfile}".split())
+        order = {}
+        for line in distfile.read_text().splitlines():
+            n1, n2, val = line.split()
+            order.setdefault(n1, len(order))
+        names = resultfile.read_text().splitlines()
+        assert names == sorted(names, key=lambda name: order.get(name, len(order)))
+
+    def test_sort_deterministic(self, tmp_path, random_pairfile_50nodes):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        resultfile1 = tmp_path / "outfile1.txt"
+        resultfile2 = tmp_path / "outfile2.txt"
+        grsub.main(f"--val dist -c {cutoff} {distfile} {resultfile1}".split())
+        grsub.main(f"--val dist -c {cutoff} --chunk 0.00001 {distfile} {resultfile2}".split())
+        assert resultfile1.read_text() == resultfile2.read_text()
+
+    def test_gzip(self, tmp_path, random_pairfile_50nodes):
+        import gzip
+        resultfile = tmp_path / "outfile.txt.gz"
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        args = grsub.parse_commandline(f"--val dist -c {cutoff} {distfile} {resultfile}".split())
+        gr = grsub.NeighborGraph(args)
+        gr.reduce_from_bottom()
+        gr.write_results(args)
+        with gzip.open(resultfile, "rt") as f:
+            assert set(f.read().splitlines()) == gr.nodes
+
+    def test_npy_mask(self, tmp_path, random_pairfile_50nodes):
+        import numpy as np
+        resultfile = tmp_path / "outfile.npy"
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        args = grsub.parse_commandline(f"--val dist -c {cutoff} --outformat npy {distfile} {resultfile}".split())
+        gr = grsub.NeighborGraph(args)
+        gr.reduce_from_bottom()
+        gr.write_results(args)
+        mask = np.load(resultfile)
+        names = (tmp_path / "outfile.names.txt").read_text().splitlines()
+        assert len(mask) == len(names) == 50
+        assert {name for name, keep in zip(names, mask) if keep} == gr.nodes
+
+    def test_write_names_blocks(self, tmp_path):
+        outfile = tmp_path / "names.txt"
+        grsub.write_names((f"n{i}" for i in range(25)), outfile, blocksize=10)
+        assert outfile.read_text().splitlines() == [f"n{i}" for i in range(25)]
+        grsub.write_names([], outfile)
+        assert outfile.read_text() == ""
+
+###################################################################################################
+###################################################################################################
+
+class Test_clusters:
+
+    def read_clusters(self, clusterfile):
+        clusters = {}
+        for line in clusterfile.read_text().splitlines():
+            name, rep = line.split("\t")
+            clusters[name] = rep
+        return clusters
+
+    def test_known_graph_1(self, tmp_path, graph_example_01, capsys):
+        resultfile = tmp_path / "outfile.txt"
+        clusterfile = tmp_path / "clusters.txt"
+        distfile, nodes, pairs, cutoff = graph_example_01
+        grsub.main(f"--val dist -c {cutoff} --clusters {clusterfile} {distfile} {resultfile}".split())
+        clusters = self.read_clusters(clusterfile)
+        for name in ["n1", "n5", "n6", "n7"]:
+            assert clusters[name] == name
+        # Which retained neighbor removes a node depends on order of ties
+        assert clusters["n2"] in {"n1", "n5"}
+        assert clusters["n3"] in {"n1", "n6"}
+        assert clusters["n4"] in {"n1", "n7"}
+        assert f"Cluster memberships written to {clusterfile}" in capsys.readouterr().out
+
+    def test_random_graph(self, tmp_path, random_pairfile_50nodes):
+        resultfile = tmp_path / "outfile.txt"
+        clusterfile = tmp_path / "clusters.txt"
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        grsub.main(f"--val dist -c {cutoff} --clusters {clusterfile} {distfile} {resultfile}".split())
+        clusters = self.read_clusters(clusterfile)
+        retained = set(resultfile.read_text().splitlines())
+        assert set(clusters) == nodes
+        for name, rep in clusters.items():
+            assert rep in retained
+            if name != rep:
+                assert (name, rep) in pairs or (rep, name) in pairs
+
+    def test_keepfile(self, tmp_path, graph_example_01, keepfile_n3_and_n5):
+        resultfile = tmp_path / "outfile.txt"
+        clusterfile = tmp_path / "clusters.txt"
+        distfile, nodes, pairs, cutoff = graph_example_01
+        keepfile, keepset = keepfile_n3_and_n5
+        commandlist = f"--val dist -c {cutoff} -k {keepfile} --clusters {clusterfile} {distfile} {resultfile}"
+        grsub.main(commandlist.split())
+        clusters = self.read_clusters(clusterfile)
+        assert clusters["n1"] in {"n3", "n5"}
+        assert clusters["n2"] == "n5"
+        assert clusters["n6"] == "n3"
+
+    def test_requires_min(self, capsys):
+        commandlist = "--algo max --val dist -c 10 --clusters c.txt infile.txt outfile.txt".split()
+        with pytest.raises(SystemExit, match="2"):
+            grsub.parse_commandline(commandlist)
+        assert "requires greedy-min" in capsys.readouterr().err
+
+###################################################################################################
+###################################################################################################
+
+class Test_folds:
+
+    def read_folds(self, foldfile):
+        folds = {}
+        for line in foldfile.read_text().splitlines():
+            name, fold = line.split("\t")
+            folds[name] = int(fold)
+        return folds
+
+    def test_assign_folds_balanced(self):
+        compfold, foldsizes = grsub.assign_folds({"a":5, "b":4, "c":3, "d":3, "e":1}, 2)
+        assert sorted(foldsizes) == [8, 8]
+        assert sum(foldsizes) == 16
+        assert compfold["a"] != compfold["b"]
+
+    def test_connected_components_known_graph_3(self, graph_example_03):
+        distfile, nodes, pairs, cutoff = graph_example_03
+        args = grsub.parse_commandline(f"--val dist -c {cutoff} {distfile} outfile.txt".split())
+        gr = grsub.NeighborGraph(args)
+        comp = dict(zip(gr.names, gr.connected_components()))
+        assert len(set(comp.values())) == 1
+
+    def test_connected_components_no_neighbors(self, graph_example_01):
+        distfile, nodes, pairs, cutoff = graph_example_01
+        args = grsub.parse_commandline(f"--val dist -c 1 {distfile} outfile.txt".split())
+        gr = grsub.NeighborGraph(args)
+        assert len(set(gr.connected_components())) == 7
+
+    def test_no_neighbor_across_folds(self, tmp_path, random_pairfile_50nodes, capsys):
+        resultfile = tmp_path / "folds.txt"
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        grsub.main(f"--val dist -c {cutoff} --folds 5 {distfile} {resultfile}".split())
+        folds = self.read_folds(resultfile)
+        assert set(folds) == nodes
+        assert set(folds.values()) <= set(range(5))
+        for n1, n2 in pairs:
+            assert folds[n1] == folds[n2]
+        assert "Fold assignments written to" in capsys.readouterr().out
+
+    def test_known_graph_1_single_component(self, tmp_path, graph_example_01, capsys):
+        resultfile = tmp_path / "folds.txt"
+        distfile, nodes, pairs, cutoff = graph_example_01
+        grsub.main(f"--val dist -c {cutoff} --folds 3 {distfile} {resultfile}".split())
+        folds = self.read_folds(resultfile)
+        assert len(set(folds.values())) == 1
+        assert "largest group of connected items (7)" in capsys.readouterr().err
+
+    def test_too_few_folds(self, capsys):
+        with pytest.raises(SystemExit, match="2"):
+            grsub.parse_commandline("--val dist -c 10 --folds 1 infile.txt outfile.txt".split())
+        assert "must be at least 2" in capsys.readouterr().err
+
+###################################################################################################
+###################################################################################################
+
+class Test_prefetch:
+
+    def test_order_preserved(self):
+        prefetcher = grsub.Prefetcher(iter(range(100)), 3)
+        assert list(prefetcher) == list(range(100))
+        stats = prefetcher.stats()
+        assert stats["chunks"] == 100
+        assert 0 <= stats["mean_depth"] <= 3
+
+    def test_exception_propagated(self):
+        def failing():
+            yield 1
+            raise ValueError("bad chunk")
+        with pytest.raises(ValueError, match="bad chunk"):
+            list(grsub.Prefetcher(failing()))
+
+    def test_consumer_stops_early(self):
+        prefetcher = grsub.Prefetcher(iter(range(1000)), 2)
+        for item in prefetcher:
+            break
+        prefetcher.thread.join(timeout=5)
+        assert not prefetcher.thread.is_alive()
+
+    def test_auto_chunksize(self):
+        args = grsub.parse_commandline("--val dist -c 1 infile.txt outfile.txt".split())
+        assert 1 <= args.chunk <= 10
+        assert args.prefetch == 0
+
+    def test_auto_chunksize_limits(self, monkeypatch):
+        monkeypatch.setattr(grsub, "available_memory", lambda: 2**40)
+        assert grsub.auto_chunksize(0) == 10
+        monkeypatch.setattr(grsub, "available_memory", lambda: 2**30)
+        assert grsub.auto_chunksize(2) == 1
+        assert grsub.auto_chunksize(0, max_memory=2**20) == 0.1
+        assert grsub.auto_chunksize(0, max_memory=800 * 2**20) == pytest.approx(0.2097152)
+        assert grsub.auto_chunksize(0, max_memory=2**40) == 1
+
+    def test_same_graph_without_prefetch(self, random_pairfile_50nodes):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        graphs = []
+        for prefetch in [0, 1, 4]:
+            commandlist = f"--val dist -c {cutoff} --chunk 0.0001 --prefetch {prefetch} {distfile} out.txt"
+            gr = grsub.NeighborGraph(grsub.parse_commandline(commandlist.split()))
+            graphs.append(gr)
+        assert graphs[0].readerstats is None
+        assert graphs[1].readerstats["chunks"] == 13
+        for gr in graphs[1:]:
+            assert list(gr.names) == list(graphs[0].names)
+            assert gr.neighbors == graphs[0].neighbors
+
+###################################################################################################
+###################################################################################################
+
+class Test_batch:
+
+    def write_manifest(self, tmp_path, distfile, cutoff):
+        manifest = tmp_path / "jobs.tsv"
+        manifest.write_text("infile\toutfile\tcutoff\tvaluetype\talgorithm\n"
+                            f"{distfile}\t{tmp_path / 'out_max.txt'}\t{cutoff}\tdist\tmax\n"
+                            "# Comment line\n"
+                            f"{distfile}\t{tmp_path / 'out_min.txt'}\t{cutoff}\tdist\n"
+                            f"{tmp_path / 'missing.txt'}\t{tmp_path / 'out_missing.txt'}\t{cutoff}\tdist\tmin\n"
+                            f"{distfile}\t{tmp_path / 'out_wrong.txt'}\t{cutoff}\tsimilarity\tmin\n")
+        return manifest
+
+    def read_summary(self, text):
+        lines = [line.split("\t") for line in text.strip().split("\n")]
+        return [dict(zip(lines[0], line)) for line in lines[1:]]
+
+    @pytest.mark.parametrize("workers", ["0", "2"])
+    def test_known_graph_2(self, tmp_path, graph_example_02, capsys, workers):
+        distfile, nodes, pairs, cutoff = graph_example_02
+        manifest = self.write_manifest(tmp_path, distfile, cutoff)
+        status = grsub.main(["batch", str(manifest), "--workers", workers, "--no-stats"])
+        assert status == 1
+        captured = capsys.readouterr()
+        assert "2 of 4 jobs failed" in captured.err
+        summary = self.read_summary(captured.out)
+        assert [s["job"] for s in summary] == ["1", "2", "3", "4"]
+        assert summary[0]["status"] == "ok"
+        assert summary[0]["reducednum"] == "3"
+        assert summary[1]["algorithm"] == "min"
+        assert summary[1]["reducednum"] == "2"
+        assert summary[2]["status"].startswith("error")
+        assert "invalid choice: 'similarity'" in summary[3]["status"]
+        assert set((tmp_path / "out_max.txt").read_text().split()) == {"n2", "n3", "n4"}
+
+    def test_summaryfile(self, tmp_path, graph_example_02):
+        distfile, nodes, pairs, cutoff = graph_example_02
+        manifest = tmp_path / "jobs.tsv"
+        manifest.write_text(f"{distfile} {tmp_path / 'out.txt'} {cutoff} dist max\n")
+        summaryfile = tmp_path / "summary.tsv"
+        status = grsub.main(["batch", str(manifest), "--workers", "0", "-o", str(summaryfile)])
+        assert status == 0
+        summary = self.read_summary(summaryfile.read_text())
+        assert summary[0]["orignum"] == "7"
+
+    def test_manifest_wrong_fields(self, tmp_path):
+        manifest = tmp_path / "jobs.tsv"
+        manifest.write_text("a.txt b.txt\n")
+        with pytest.raises(Exception, match="Manifest line 1 should have 4 or 5 fields"):
+            grsub.read_manifest(manifest)
+
+###################################################################################################
+###################################################################################################
+
+class Test_engines:
+
+    def graph(self, filename, cutoff, options, valuetype="dist"):
+        commandlist = f"--val {valuetype} -c {cutoff} {options} {filename} outfile.txt".split()
+        return grsub.NeighborGraph(grsub.parse_commandline(commandlist))
+
+    def test_auto_engine(self, tmp_path, graph_example_01):
+        distfile, nodes, pairs, cutoff = graph_example_01
+        args = grsub.parse_commandline(f"--val dist -c {cutoff} {distfile} outfile.txt".split())
+        assert grsub.text_engine(args) == "python"
+        args = grsub.parse_commandline(f"--val dist -c {cutoff} {distfile}.gz outfile.txt".split())
+        assert grsub.text_engine(args) == "pandas"
+        args = grsub.parse_commandline(f"--val dist -c {cutoff} --engine pandas {distfile} outfile.txt".split())
+        assert grsub.text_engine(args) == "pandas"
+
+    def test_python_engine_compressed(self, capsys):
+        with pytest.raises(SystemExit, match="2"):
+            grsub.parse_commandline("--val dist -c 1 --engine python infile.txt.gz outfile.txt".split())
+        assert "can not be read with --engine python" in capsys.readouterr().err
+
+    @pytest.mark.parametrize("options", ["", "--allpairs", "--no-stats"])
+    def test_same_graph(self, random_pairfile_50nodes_sim, options):
+        simfile, nodes, pairs, cutoff = random_pairfile_50nodes_sim
+        graphs = []
+        for engine in ["python", "pandas"]:
+            for chunk in ["1", "0.00003"]:
+                opts = f"--engine {engine} --chunk {chunk} {options}"
+                graphs.append(self.graph(simfile, cutoff, opts, valuetype="sim"))
+        for gr in graphs[1:]:
+            assert list(gr.names) == list(graphs[0].names)    # Input order independent of engine and chunk size
+            assert gr.neighbors == graphs[0].neighbors
+            assert gr.origdata == pytest.approx(graphs[0].origdata)
+
+    def test_input_order(self, tmp_path):
+        distfile = tmp_path / "distfile.txt"
+        distfile.write_text("b d 1\nc b 1\n\na e 9\nd a 9\n")
+        for engine in ["python", "pandas"]:
+            for chunk in ["1", "0.000001", "0.000002"]:
+                gr = self.graph(distfile, 5, f"--engine {engine} --chunk {chunk}")
+                assert list(gr.names) == ["b", "d", "c", "a", "e"]
+                assert gr.neighbors == {"b":{"c", "d"}, "c":{"b"}, "d":{"b"}}
+
+    def test_na_like_names(self, tmp_path):
+        distfile = tmp_path / "distfile.txt"
+        distfile.write_text("NA b 1\nnull c 9\nb NaN 1\nn/a NA 2\nNone #N/A 9\nx y nan\n")
+        results = []
+        for engine in ["python", "pandas"]:
+            gr = self.graph(distfile, 5, f"--engine {engine}")
+            assert list(gr.names) == ["NA", "b", "null", "c", "NaN", "n/a", "None", "#N/A", "x", "y"]
+            assert gr.neighbors == {"NA": {"b", "n/a"}, "b": {"NA", "NaN"}, "NaN": {"b"}, "n/a": {"NA"}}
+            resultfile = tmp_path / f"{engine}.txt"
+            grsub.main(f"--val dist -c 5 --engine {engine} {distfile} {resultfile}".split())
+            results.append(resultfile.read_text())
+        assert results[0] == results[1]
+
+    def test_python_engine_wrong_fields(self, tmp_path):
+        distfile = tmp_path / "distfile.txt"
+        distfile.write_text("a b 1\na c\n")
+        with pytest.raises(Exception, match="must have 3 fields"):
+            self.graph(distfile, 5, "--engine python")
+
+    def test_import_does_not_load_pandas(self):
+        import subprocess, sys
+        code = ("import sys, time; start = time.perf_counter(); import greedysub; "
+                "print(time.perf_counter() - start); "
+                "print(sorted({'pandas', 'numpy', 'pyarrow'} & set(sys.modules)))")
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                                cwd=Path(grsub.__file__).parent)
+        seconds, loaded = result.stdout.split("\n")[:2]
+        assert loaded == "[]"
+        assert float(seconds) < 0.25
+
+###################################################################################################
+###################################################################################################
+
+class Test_nametable:
+
+    def test_ids_in_order_added(self):
+        names = grsub.NameTable()
+        names.add(["b", "a", "b", "c"])
+        names.add(["a", "d"])
+        assert len(names) == 4
+        assert list(names) == ["b", "a", "c", "d"]
+        assert names[2] == "c"
+        assert names.index("d") == 3
+        assert list(names.ids(["a", "a", "d", "b"])) == [1, 1, 3, 0]
+
+    def test_missing_names(self):
+        names = grsub.NameTable()
+        names.add(["n1", "n2"])
+        assert "n1" in names
+        assert "n3" not in names
+        assert names.get("n3") is None
+        with pytest.raises(KeyError):
+            names.index("n3")
+
+    def test_many_names_and_unicode(self):
+        allnames = [f"seq{i}" for i in range(5000)] + ["\u00e6\u00f8\u00e5", "\u03b1\u03b2"]
+        names = grsub.NameTable()
+        names.add(allnames)
+        names.add(reversed(allnames))
+        assert list(names) == allnames
+        assert [names.index(name) for name in allnames] == list(range(len(allnames)))
+        assert names[5000] == "\u00e6\u00f8\u00e5"
+
+    def test_ids_dictionary_encoded(self):
+        pa = pytest.importorskip("pyarrow")
+        names = grsub.NameTable()
+        names.add(["c", "a", "b"])
+        column = pa.array(["a", "x", "b", "a", "c", "x"]).dictionary_encode()
+        column = column.filter(pa.array([True, False, True, True, True, False]))
+        assert list(names.ids(column)) == [1, 2, 1, 0]
+        assert list(names.ids(column.dictionary_decode())) == [1, 2, 1, 0]
+
+    def test_numpy_index(self, monkeypatch):
+        monkeypatch.setattr(grsub, "nametable_small", 3)
+        monkeypatch.setattr(grsub, "nametable_block", 2)
+        names = grsub.NameTable()
+        names.add(["b", "a"])
+        names.add(["a", "", "c", "b", "seq10", "seq1"])
+        names.add(["seq1", "d", "æøå", "", "seq01"])
+        names.add(["seq01", "æøå", "αβ"])
+        assert names.sortedhashes is not None
+        assert list(names) == ["b", "a", "", "c", "seq10", "seq1", "d", "æøå", "seq01", "αβ"]
+        assert list(names.ids(["seq01", "", "αβ", "a", "seq10"])) == [8, 2, 9, 1, 4]
+        assert names.get("seq2") is None
+        with pytest.raises(KeyError):
+            names.ids(["a", "seq2"])
+
+    def test_hash_collisions(self, monkeypatch):
+        class Collide(str):
+            def __hash__(self):
+                return 1
+        for small in [100, 0]:
+            monkeypatch.setattr(grsub, "nametable_small", small)
+            names = grsub.NameTable()
+            names.add([Collide("xy"), Collide("x")])
+            names.add([Collide("yx"), Collide("x"), Collide("xy")])
+            assert list(names) == ["xy", "x", "yx"]
+            assert names.index(Collide("yx")) == 2
+            assert list(names.ids([Collide("x"), Collide("yx"), Collide("xy")])) == [1, 2, 0]
+            assert names.get(Collide("y")) is None
+
+###################################################################################################
+###################################################################################################
+
+class Test_bitset:
+
+    def graphs(self, filename, cutoff, options=""):
+        """Returns same input as (NeighborGraph, BitsetGraph)"""
+        commandlist = f"--val dist -c {cutoff} {options} {filename} outfile.txt".split()
+        args = grsub.parse_commandline(commandlist)
+        return grsub.NeighborGraph(args), grsub.BitsetGraph(args)
+
+    def adjacency(self, gr):
+        return {gr.names[nodeid]:{gr.names[nb] for nb in nbids} for nodeid, nbids in gr.adjacency_ids()}
+
+    def test_same_graph(self, random_pairfile_50nodes):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        grsets, grbits = self.graphs(distfile, cutoff)
+        assert self.adjacency(grbits) == grsets.neighbors
+        assert grbits.degree.sum() == 2 * len(pairs)
+        assert grbits.origdata == pytest.approx(grsets.origdata)
+
+    def test_known_graph_1_min(self, tmp_path, graph_example_01):
+        resultfile = tmp_path / "outfile.txt"
+        distfile, nodes, pairs, cutoff = graph_example_01
+        grsub.main(f"--graph bitset --algo min --val dist -c {cutoff} {distfile} {resultfile}".split())
+        assert set(resultfile.read_text().splitlines()) == {"n1", "n5", "n6", "n7"}
+
+    def test_known_graph_2_max(self, tmp_path, graph_example_02):
+        resultfile = tmp_path / "outfile.txt"
+        distfile, nodes, pairs, cutoff = graph_example_02
+        grsub.main(f"--graph bitset --algo max --val dist -c {cutoff} {distfile} {resultfile}".split())
+        assert set(resultfile.read_text().splitlines()) == {"n2", "n3", "n4"}
+
+    @pytest.mark.parametrize("algo", ["min", "max"])
+    def test_no_neighbors_left(self, tmp_path, random_pairfile_50nodes, keepfile_n0_to_n9, algo):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        keepfile, keepset = keepfile_n0_to_n9
+        grsets, gr = self.graphs(distfile, cutoff, f"--algo {algo} -k {keepfile}")
+        gr.remove_keepfile_neighbors()
+        if algo == "min":
+            gr.reduce_from_bottom()
+        else:
+            gr.reduce_from_top()
+        assert gr.degree.sum() == 0
+        assert keepset <= gr.nodes
+        for n1, n2 in pairs:
+            assert not (n1 in gr.nodes and n2 in gr.nodes) or (n1 in keepset and n2 in keepset)
+        # Greedy-min result is maximal: each removed node has a retained neighbor
+        if algo == "min":
+            for name in nodes - gr.nodes:
+                assert any(nb in gr.nodes for nb in grsets.neighbors[name])
+
+    def test_remove_connection(self, graph_example_01):
+        distfile, nodes, pairs, cutoff = graph_example_01
+        grsets, gr = self.graphs(distfile, cutoff)
+        n1, n2 = gr.names.index("n1"), gr.names.index("n2")
+        gr.remove_connection(n2, n1)
+        assert not gr.are_neighbors(n1, n2)
+        assert gr.degree[n1] == 2
+        with pytest.raises(Exception, match="not neighbors"):
+            gr.remove_connection(n1, n2)
+
+    def test_auto(self, tmp_path, random_pairfile_50nodes):
+        distfile = tmp_path / "dense.txt"
+        names = [f"s{i}" for i in range(120)]
+        distfile.write_text("".join(f"{n1} {n2} 1\n" for n1, n2 in itertools.combinations(names, 2)))
+        args = grsub.parse_commandline(f"--val dist -c 5 {distfile} outfile.txt".split())
+        assert isinstance(grsub.make_graph(args), grsub.BitsetGraph)
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        args = grsub.parse_commandline(f"--val dist -c {cutoff} {distfile} outfile.txt".split())
+        assert type(grsub.make_graph(args)) is grsub.NeighborGraph
+
+    def test_row_popcount(self):
+        import numpy as np
+        rows = np.array([[0, 1], [2**64 - 1, 5]], dtype=np.uint64)
+        assert grsub.row_popcount(rows).tolist() == [1, 66]
+
+###################################################################################################
+###################################################################################################
+
+class Test_csr:
+
+    def graphs(self, filename, cutoff, options=""):
+        """Returns same input as (NeighborGraph, CsrGraph)"""
+        commandlist = f"--val dist -c {cutoff} {options} {filename} outfile.txt".split()
+        args = grsub.parse_commandline(commandlist)
+        return grsub.NeighborGraph(args), grsub.CsrGraph(args)
+
+    def test_same_graph(self, random_pairfile_50nodes):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        grsets, grcsr = self.graphs(distfile, cutoff)
+        adjacency = {grcsr.names[nodeid]:{grcsr.names[nb] for nb in nbids}
+                     for nodeid, nbids in grcsr.adjacency_ids()}
+        assert adjacency == grsets.neighbors
+        assert grcsr.origdata == pytest.approx(grsets.origdata)
+
+    def test_duplicate_pairs(self, tmp_path):
+        distfile = tmp_path / "distfile.txt"
+        distfile.write_text("a b 1\nb a 1\na c 1\na b 1\n")
+        grsets, grcsr = self.graphs(distfile, 5)
+        assert grcsr.degree.tolist() == [2, 1, 1]
+        assert grcsr.origdata == grsets.origdata
+
+    def test_known_graph_2_max(self, tmp_path, graph_example_02):
+        resultfile = tmp_path / "outfile.txt"
+        distfile, nodes, pairs, cutoff = graph_example_02
+        grsub.main(f"--graph csr --algo max --val dist -c {cutoff} {distfile} {resultfile}".split())
+        assert set(resultfile.read_text().splitlines()) == {"n2", "n3", "n4"}
+
+    def test_bucket_order(self, graph_example_03):
+        distfile, nodes, pairs, cutoff = graph_example_03
+        grsets, gr = self.graphs(distfile, cutoff, "--algo max")
+        removed = []
+        node, degree = gr.most_neighbors()
+        while degree > 0:
+            assert degree == max(gr.degree)
+            removed.append(node)
+            gr.remove_node(node)
+            node, degree = gr.most_neighbors()
+        assert gr.names[removed[0]] == "n1"
+        assert gr.degree.sum() == 0
+
+    @pytest.mark.parametrize("algo", ["min", "max"])
+    def test_no_neighbors_left(self, random_pairfile_50nodes, keepfile_n0_to_n9, algo):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        keepfile, keepset = keepfile_n0_to_n9
+        grsets, gr = self.graphs(distfile, cutoff, f"--algo {algo} -k {keepfile}")
+        gr.remove_keepfile_neighbors()
+        if algo == "min":
+            gr.reduce_from_bottom()
+        else:
+            gr.reduce_from_top()
+        assert gr.degree.sum() == 0
+        assert keepset <= gr.nodes
+        for n1, n2 in pairs:
+            assert not (n1 in gr.nodes and n2 in gr.nodes) or (n1 in keepset and n2 in keepset)
+        if algo == "min":
+            for name in nodes - gr.nodes:
+                assert any(nb in gr.nodes for nb in grsets.neighbors[name])
+
+    def test_auto(self, random_pairfile_50nodes):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        args = grsub.parse_commandline(f"--algo max --val dist -c {cutoff} {distfile} outfile.txt".split())
+        assert isinstance(grsub.make_graph(args), grsub.CsrGraph)
+
+###################################################################################################
+###################################################################################################
+
+class Test_luby:
+
+    def graph(self, filename, cutoff, options=""):
+        commandlist = f"--algo luby --val dist -c {cutoff} {options} {filename} outfile.txt".split()
+        args = grsub.parse_commandline(commandlist)
+        gr = grsub.make_graph(args)
+        grsub.reduce_graph(gr, args)
+        return gr
+
+    def test_maximal_independent_set(self, random_pairfile_50nodes):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        gr = self.graph(distfile, cutoff)
+        grsets = grsub.NeighborGraph(grsub.parse_commandline(f"--val dist -c {cutoff} {distfile} x".split()))
+        assert isinstance(gr, grsub.CsrGraph)
+        assert gr.degree.sum() == 0
+        for n1, n2 in pairs:
+            assert not (n1 in gr.nodes and n2 in gr.nodes)
+        for name in nodes - gr.nodes:
+            assert any(nb in gr.nodes for nb in grsets.neighbors[name])
+
+    def test_keepfile(self, random_pairfile_50nodes, keepfile_n0_to_n9):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        keepfile, keepset = keepfile_n0_to_n9
+        gr = self.graph(distfile, cutoff, f"-k {keepfile}")
+        assert keepset <= gr.nodes
+        for n1, n2 in pairs:
+            assert not (n1 in gr.nodes and n2 in gr.nodes) or (n1 in keepset and n2 in keepset)
+
+    def test_reproducible(self, tmp_path, random_pairfile_50nodes):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        results = []
+        for i in range(2):
+            resultfile = tmp_path / f"outfile{i}.txt"
+            grsub.main(f"--algo luby --val dist -c {cutoff} {distfile} {resultfile}".split())
+            results.append(resultfile.read_text())
+        assert results[0] == results[1]
+
+    def test_known_graph_2(self, tmp_path, graph_example_02):
+        resultfile = tmp_path / "outfile.txt"
+        distfile, nodes, pairs, cutoff = graph_example_02
+        grsub.main(f"--algo luby --val dist -c {cutoff} {distfile} {resultfile}".split())
+        # n1 has fewest neighbors (selected in first round), then one of the triangle n5, n6, n7
+        result = set(resultfile.read_text().splitlines())
+        assert len(result) == 2
+        assert "n1" in result and result & {"n5", "n6", "n7"}
+
+    def test_requires_csr(self, random_pairfile_50nodes):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        with pytest.raises(SystemExit):
+            grsub.parse_commandline(f"--algo luby --graph sets --val dist -c {cutoff} {distfile} x".split())
+
+###################################################################################################
+###################################################################################################
+
+class Test_vectors:
+
+    def vectorfiles(self, tmp_path):
+        """Returns (vector file, pair file with euclidean distances for all pairs)"""
+        import random
+        names = [f"v{i}" for i in range(40)]
+        vectors = {name:[random.gauss(0, 1) for dim in range(3)] for name in names}
+        vectorfile = tmp_path / "vectors.txt"
+        vectorfile.write_text("".join(f"{name} {' '.join(map(str, vec))}\n" for name, vec in vectors.items()))
+        pairfile = tmp_path / "pairs.txt"
+        lines = []
+        for n1, n2 in itertools.combinations(names, 2):
+            dist = sum((x1 - x2)**2 for x1, x2 in zip(vectors[n1], vectors[n2]))**0.5
+            lines.append(f"{n1} {n2} {dist}\n")
+        pairfile.write_text("".join(lines))
+        return vectorfile, pairfile
+
+    @pytest.mark.parametrize("chunk", ["1", "0.0001"])
+    def test_same_graph_as_pairfile(self, tmp_path, chunk):
+        vectorfile, pairfile = self.vectorfiles(tmp_path)
+        args = grsub.parse_commandline(f"--val dist -c 1.5 --informat vectors --chunk {chunk} {vectorfile} o.txt".split())
+        grvec = grsub.NeighborGraph(args)
+        grpair = grsub.NeighborGraph(grsub.parse_commandline(f"--val dist -c 1.5 {pairfile} o.txt".split()))
+        assert list(grvec.names) == list(grpair.names)
+        assert grvec.neighbors == grpair.neighbors
+        assert grvec.origdata == pytest.approx(grpair.origdata)
+
+    def test_pair_values(self):
+        import numpy as np
+        x = np.array([[0.0, 0.0], [3.0, 4.0]])
+        assert grsub.pair_values(x, x, "euclidean") == pytest.approx(np.array([[0, 5], [5, 0]]))
+        assert grsub.pair_values(x, x, "manhattan") == pytest.approx(np.array([[0, 7], [7, 0]]))
+        unit = np.array([[1.0, 0.0], [0.6, 0.8]])
+        assert grsub.pair_values(unit, unit, "cosine") == pytest.approx(np.array([[1, 0.6], [0.6, 1]]))
+
+    def test_npy_with_names(self, tmp_path):
+        import numpy as np
+        vectorfile = tmp_path / "vectors.npy"
+        np.save(vectorfile, np.array([[1.0, 0.0], [0.9, 0.1], [0.0, 1.0]]))
+        (tmp_path / "vectors.names.txt").write_text("a\nb\nc\n")
+        resultfile = tmp_path / "outfile.txt"
+        grsub.main(f"--val sim -c 0.9 --metric cosine {vectorfile} {resultfile}".split())
+        assert set(resultfile.read_text().splitlines()) in ({"a", "c"}, {"b", "c"})
+
+    def test_npy_row_numbers(self, tmp_path):
+        import numpy as np
+        vectorfile = tmp_path / "vectors.npy"
+        np.save(vectorfile, np.array([[0.0], [0.5], [3.0]]))
+        args = grsub.parse_commandline(f"--val dist -c 1 {vectorfile} o.txt".split())
+        gr = grsub.NeighborGraph(args)
+        assert list(gr.names) == ["0", "1", "2"]
+        assert gr.neighbors == {"0":{"1"}, "1":{"0"}}
+
+    def test_metric_needs_dist(self, capsys):
+        with pytest.raises(SystemExit, match="2"):
+            grsub.parse_commandline("--val sim -c 1 --informat vectors infile.txt outfile.txt".split())
+        assert "gives distances" in capsys.readouterr().err
+
+###################################################################################################
+###################################################################################################
+
+class Test_fasta:
+
+    def fastafile(self, tmp_path, suffix=".fasta"):
+        """Returns FASTA file with 5 families: base sequence (a), copy with 1 mismatch (b), and
+        unrelated sequence (c), plus one sequence shorter than k-mer size"""
+        import random
+        rng = random.Random(1)
+        lines = []
+        for fam in range(5):
+            base = [rng.choice("ACGT") for i in range(400)]
+            copy = base.copy()
+            copy[200] = {"A":"C", "C":"G", "G":"T", "T":"A"}[copy[200]]
+            other = [rng.choice("acgt") for i in range(400)]
+            for label, seq in [("a", base), ("b", copy), ("c", other)]:
+                seq = "".join(seq)
+                lines.append(f">fam{fam}{label} description\n{seq[:250]}\n{seq[250:]}\n")
+        lines.append(">short\nACGT\n")
+        fastafile = tmp_path / f"seqs{suffix}"
+        if suffix.endswith(".gz"):
+            import gzip
+            fastafile.write_bytes(gzip.compress("".join(lines).encode()))
+        else:
+            fastafile.write_text("".join(lines))
+        return fastafile
+
+    @pytest.mark.parametrize("suffix", [".fasta", ".fa.gz"])
+    def test_read_fasta_file(self, tmp_path, suffix):
+        names, seqs = grsub.read_fasta_file(self.fastafile(tmp_path, suffix))
+        assert len(names) == 16
+        assert names[:3] == ["fam0a", "fam0b", "fam0c"]
+        assert len(seqs[0]) == 400
+        assert seqs[2] == seqs[2].upper()
+
+    @pytest.mark.parametrize("options", ["--val sim -c 0.95", "--val dist -c 0.05 --metric identity",
+                                         "--val sim -c 0.5 --metric jaccard"])
+    def test_neighbors(self, tmp_path, options):
+        fastafile = self.fastafile(tmp_path)
+        args = grsub.parse_commandline(f"{options} {fastafile} outfile.txt".split())
+        gr = grsub.NeighborGraph(args)
+        assert list(gr.names)[:3] == ["fam0a", "fam0b", "fam0c"]
+        assert gr.neighbors == {f"fam{fam}{x}":{f"fam{fam}{y}"} for fam in range(5) for x, y in ["ab", "ba"]}
+        assert gr.origdata["average_dist"] is None
+
+    def test_reduce(self, tmp_path):
+        fastafile = self.fastafile(tmp_path)
+        resultfile = tmp_path / "outfile.txt"
+        grsub.main(f"--val sim -c 0.95 {fastafile} {resultfile}".split())
+        assert len(resultfile.read_text().splitlines()) == 11
+
+    def test_minhash_sketch(self):
+        seq = b"ACGTTGCAAGGCTTACCGATAGGCTTAACG"
+        sketch = grsub.minhash_sketch(seq, 5, 64)
+        assert (sketch == grsub.minhash_sketch(seq + seq[:5], 5, 64, blocksize=3)).mean() > 0.8
+        assert (grsub.minhash_sketch(b"ACG", 5, 64) == 2**64 - 1).all()
+
+    def test_lsh_bands(self):
+        assert grsub.lsh_bands(128, 0.9) < grsub.lsh_bands(128, 0.5)
+        assert grsub.lsh_bands(128, 0) == 128
+        bands = grsub.lsh_bands(128, 0.8)
+        rows = 128 // bands
+        assert 1 - (1 - 0.8**rows)**bands >= 0.99
+
+    def test_wrong_metric(self, capsys):
+        with pytest.raises(SystemExit, match="2"):
+            grsub.parse_commandline("--val sim -c 1 --metric cosine seqs.fa outfile.txt".split())
+        assert "Metric for FASTA input" in capsys.readouterr().err
+
+###################################################################################################
+###################################################################################################
+
+class Test_stream:
+
+    def run(self, tmp_path, text, options=""):
+        distfile = tmp_path / "distfile.txt"
+        distfile.write_text(text)
+        resultfile = tmp_path / "outfile.txt"
+        grsub.main(f"--stream --val dist -c 5 {options} {distfile} {resultfile}".split())
+        return set(resultfile.read_text().splitlines())
+
+    def test_known_order(self, tmp_path):
+        assert self.run(tmp_path, "a b 1\na c 1\nb c 9\nc d 1\n") == {"a", "d"}
+
+    def test_keepfile(self, tmp_path):
+        keepfile = tmp_path / "keepfile.txt"
+        keepfile.write_text("c\nx\n")
+        assert self.run(tmp_path, "a b 1\na c 1\nb c 9\nc d 1\n", f"-k {keepfile}") == {"b", "c"}
+
+    def test_refine(self, tmp_path, capsys):
+        text = "a b 1\na c 1\na d 1\nb c 9\n"
+        assert self.run(tmp_path, text) == {"a"}
+        assert self.run(tmp_path, text, "--refine") == {"b", "c", "d"}
+        assert "Selected in single pass:         1" in capsys.readouterr().out
+
+    @pytest.mark.parametrize("options", ["--chunk 0.00002", "--refine", "--engine pandas --chunk 0.00002"])
+    def test_random_graph(self, tmp_path, random_pairfile_50nodes, options):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        resultfile = tmp_path / "outfile.txt"
+        grsub.main(f"--stream {options} --val dist -c {cutoff} {distfile} {resultfile}".split())
+        retained = set(resultfile.read_text().splitlines())
+        for n1, n2 in pairs:
+            assert not (n1 in retained and n2 in retained)
+        for name in nodes - retained:
+            assert any((name, other) in pairs or (other, name) in pairs for other in retained)
+
+    def test_parquet_input(self, tmp_path):
+        pq = pytest.importorskip("pyarrow.parquet")
+        import pyarrow as pa
+        table = pa.table({"name1": ["a", "a", "b", "c"], "name2": ["b", "c", "c", "d"],
+                          "dist": [1.0, 1.0, 9.0, 1.0]})
+        distfile = tmp_path / "distfile.parquet"
+        pq.write_table(table, distfile)
+        resultfile = tmp_path / "outfile.txt"
+        grsub.main(f"--stream --val dist -c 5 {distfile} {resultfile}".split())
+        assert set(resultfile.read_text().splitlines()) == {"a", "d"}
+
+    def test_not_grouped(self, tmp_path):
+        with pytest.raises(Exception, match="must be grouped by first name"):
+            self.run(tmp_path, "a b 1\nc d 1\na e 1\n")
+
+    def test_refine_needs_stream(self, capsys):
+        with pytest.raises(SystemExit, match="2"):
+            grsub.parse_commandline("--refine --val dist -c 1 infile.txt outfile.txt".split())
+        assert "only be used with --stream" in capsys.readouterr().err
+
+###################################################################################################
+###################################################################################################
+
+class Test_checkpoint:
+
+    @pytest.fixture()
+    def chain_pairfile(self, tmp_path):
+        """20 triangles (n0-n1-n2, n3-n4-n5, ...) joined in a chain: every algorithm and graph type
+        needs many reduction steps (at least one per triangle not decided by keepfile n0-n9)"""
+        lines = []
+        for k in range(20):
+            a, b, c = 3 * k, 3 * k + 1, 3 * k + 2
+            lines += [f"n{a} n{b} 1.0", f"n{b} n{c} 1.0", f"n{a} n{c} 1.0", f"n{a} n{(a + 7) % 60} 5.0"]
+            if k < 19:
+                lines.append(f"n{c} n{c + 1} 1.0")
+        distfile = tmp_path / "chain.txt"
+        distfile.write_text("\n".join(lines) + "\n")
+        return distfile, 2.0
+
+    def run_interrupted(self, monkeypatch, commandlist, nsaves):
+        """Runs main, raising KeyboardInterrupt after nsaves snapshots of reduction state"""
+        save_state = grsub.Checkpoint.save_state
+        calls = []
+        def interrupted(checkpoint, graph):
+            save_state(checkpoint, graph)
+            calls.append(1)
+            if len(calls) == nsaves:
+                raise KeyboardInterrupt
+        with monkeypatch.context() as m:
+            m.setattr(grsub.Checkpoint, "save_state", interrupted)
+            with pytest.raises(KeyboardInterrupt):
+                grsub.main(commandlist)
+
+    @pytest.mark.parametrize("options", ["--algo min", "--algo max", "--algo max --graph csr",
+                                         "--algo min --graph bitset"])
+    def test_resume_same_result(self, tmp_path, monkeypatch, chain_pairfile, keepfile_n0_to_n9, options, capsys):
+        distfile, cutoff = chain_pairfile
+        keepfile, keepset = keepfile_n0_to_n9
+        base = f"--val dist -c {cutoff} -k {keepfile} {options} {distfile}".split()
+        grsub.main(base + [str(tmp_path / "expected.txt")])
+        monkeypatch.setattr(grsub, "checkpoint_interval", 0)
+        checkpointdir = tmp_path / "checkpoint"
+        commandlist = base + [str(tmp_path / "outfile.txt"), "--checkpoint", str(checkpointdir), "--progress"]
+        self.run_interrupted(monkeypatch, commandlist, 3)
+        assert (checkpointdir / "parsed.npz").exists()
+        assert (checkpointdir / "state.npz").exists()
+        assert not (tmp_path / "outfile.txt").exists()         # Interrupted before reduction was done
+        capsys.readouterr()
+        grsub.main(commandlist)
+        err = capsys.readouterr().err
+        assert "parsed graph loaded from checkpoint" in err
+        assert "resumed from checkpoint" in err
+        assert (tmp_path / "outfile.txt").read_text() == (tmp_path / "expected.txt").read_text()
+
+    def test_resume_clusters(self, tmp_path, monkeypatch, chain_pairfile):
+        distfile, cutoff = chain_pairfile
+        base = f"--val dist -c {cutoff} {distfile}".split()
+        grsub.main(base + [str(tmp_path / "expected.txt"), "--clusters", str(tmp_path / "expected_clusters.txt")])
+        monkeypatch.setattr(grsub, "checkpoint_interval", 0)
+        commandlist = base + [str(tmp_path / "outfile.txt"), "--clusters", str(tmp_path / "clusters.txt"),
+                              "--checkpoint", str(tmp_path / "checkpoint")]
+        self.run_interrupted(monkeypatch, commandlist, 2)
+        assert not (tmp_path / "outfile.txt").exists()
+        grsub.main(commandlist)
+        assert (tmp_path / "clusters.txt").read_text() == (tmp_path / "expected_clusters.txt").read_text()
+
+    def test_other_cutoff_not_used(self, tmp_path, random_pairfile_50nodes, capsys):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        checkpointdir = tmp_path / "checkpoint"
+        for c in [cutoff, cutoff / 2]:
+            grsub.main(f"--val dist -c {c} {distfile} {tmp_path / 'out.txt'} --checkpoint {checkpointdir}".split())
+        assert "is from other input or options. Not used" in capsys.readouterr().err
+        grsub.main(f"--val dist -c {cutoff / 2} {distfile} {tmp_path / 'expected.txt'}".split())
+        assert (tmp_path / "out.txt").read_text() == (tmp_path / "expected.txt").read_text()
+
+    def test_not_with_stream(self, random_pairfile_50nodes):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        with pytest.raises(SystemExit):
+            grsub.parse_commandline(f"--stream --checkpoint dir --val dist -c 1 {distfile} x".split())
+
+###################################################################################################
+###################################################################################################
+
+class Test_serve:
+
+    def test_request_cached(self, tmp_path, random_pairfile_50nodes):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        grsub.main(f"--val dist -c {cutoff} {distfile} {tmp_path / 'expected.txt'}".split())
+        cache = grsub.GraphCache(1e9)
+        request = {"infile": str(distfile), "cutoff": cutoff, "valuetype": "dist"}
+        responses = [grsub.serve_request(request, cache) for i in range(2)]
+        assert [response["cached"] for response in responses] == [False, True]
+        for response in responses:
+            assert response["status"] == "ok"
+            assert response["orignum"] == len(nodes)
+            assert response["names"] == (tmp_path / "expected.txt").read_text().splitlines()
+        response = grsub.serve_request(dict(request, algorithm="max", outfile=str(tmp_path / "out.txt")), cache)
+        assert response["cached"] and "names" not in response
+        assert len((tmp_path / "out.txt").read_text().splitlines()) == response["reducednum"]
+        assert grsub.serve_request({"command": "stats"}, cache)["graphs"] == 1
+
+    def test_errors(self, random_pairfile_50nodes):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        cache = grsub.GraphCache(1e9)
+        response = grsub.serve_request({"infile": str(distfile), "cutoff": cutoff}, cache)
+        assert response["status"] == "error: Request is missing field: valuetype"
+        request = {"infile": str(distfile), "cutoff": cutoff, "valuetype": "dist", "algorithm": "best"}
+        assert "invalid choice: 'best'" in grsub.serve_request(request, cache)["status"]
+        request = {"infile": str(distfile), "cutoff": cutoff, "valuetype": "dist", "options": ["--folds", "3"]}
+        assert "can not be used in server mode" in grsub.serve_request(request, cache)["status"]
+
+    def test_lru_eviction(self, tmp_path, random_pairfile_50nodes):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        cache = grsub.GraphCache(1)
+        for c in [cutoff, cutoff / 2, cutoff]:
+            response = grsub.serve_request({"infile": str(distfile), "cutoff": c, "valuetype": "dist"}, cache)
+            assert not response["cached"]
+        assert len(cache.entries) == 1
+
+    def test_socket(self, tmp_path, random_pairfile_50nodes):
+        import socket, json, threading, time
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        socketpath = tmp_path / "greedysub.sock"
+        server = threading.Thread(target=grsub.serve_main, args=(["--socket", str(socketpath)],))
+        server.start()
+        for i in range(100):
+            if socketpath.exists():
+                break
+            time.sleep(0.05)
+        with socket.socket(socket.AF_UNIX) as client:
+            client.connect(str(socketpath))
+            stream = client.makefile("rw")
+            requests = [{"infile": str(distfile), "cutoff": cutoff, "valuetype": "dist"}, {"command": "shutdown"}]
+            for request in requests:
+                stream.write(json.dumps(request) + "\n")
+                stream.flush()
+                assert json.loads(stream.readline())["status"] == "ok"
+        server.join(timeout=10)
+        assert not server.is_alive()
+        assert not socketpath.exists()
+
+###################################################################################################
+###################################################################################################
+
+class Test_max_memory:
+
+    @pytest.mark.parametrize("text, size", [("8G", 8 * 2**30), ("500M", 500 * 2**20), ("1.5gb", 1.5 * 2**30),
+                                            ("2048", 2048)])
+    def test_parse_memory(self, text, size):
+        assert grsub.parse_memory(text) == int(size)
+
+    def test_invalid_size(self, random_pairfile_50nodes):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        with pytest.raises(SystemExit):
+            grsub.parse_commandline(f"--max-memory 8X --val dist -c 1 {distfile} x".split())
+
+    def test_estimate_names(self):
+        import random
+        rng = random.Random(1)
+        names = [rng.randrange(100_000) for i in range(50_000)]
+        estimate = grsub.estimate_names(len(names), len(set(names)), 1_000_000)
+        assert 90_000 < estimate < 110_000
+        assert grsub.estimate_names(50_000, 1_000, 1_000_000) == pytest.approx(1_000)
+        assert grsub.estimate_names(1_000, 1_000, 10_000) == 10_000
+
+    @pytest.mark.parametrize("nnames, npairs, algorithm, graphtype",
+                             [(1_000, 100_000, "greedy", "bitset"), (1_000, 100_000, "max", "bitset"),
+                              (1_000, 100_000, "luby", "csr"), (1_000, 1_000, "greedy", "sets"),
+                              (1_000, 1_000, "max", "csr"), (100_000, 10**8, "greedy", "sets"),
+                              (0, 0, "greedy", "sets")])
+    def test_auto_graphtype(self, nnames, npairs, algorithm, graphtype):
+        assert grsub.auto_graphtype(nnames, npairs, algorithm) == graphtype
+
+    def test_plan_sets(self, tmp_path, random_pairfile_50nodes, capsys):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        args = grsub.parse_commandline(f"--max-memory 1G --val dist -c {cutoff} {distfile} out.txt".split())
+        grsub.plan_memory(args)
+        assert args.graph == "auto"
+        err = capsys.readouterr().err
+        # Whole file is read, so estimate is exact
+        assert f"1,225 lines, 50 names, {len(pairs)} neighbor pairs. Graph: sets" in err
+        assert "Memory warning" not in err
+
+    def test_plan_csr_when_sets_too_large(self, tmp_path, monkeypatch, random_pairfile_50nodes, capsys):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        monkeypatch.setitem(grsub.plan_bytes, "sets", (1e9, 0))
+        resultfile = tmp_path / "outfile.txt"
+        grsub.main(f"--max-memory 1G --val dist -c {cutoff} {distfile} {resultfile}".split())
+        assert "Graph: csr" in capsys.readouterr().err
+        selected = set(resultfile.read_text().splitlines())
+        for n1, n2 in pairs:
+            assert not (n1 in selected and n2 in selected)
+
+    def test_warning(self, random_pairfile_50nodes, capsys):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        args = grsub.parse_commandline(f"--max-memory 1K --val dist -c {cutoff} {distfile} out.txt".split())
+        grsub.plan_memory(args)
+        assert "Memory warning: estimated memory use exceeds --max-memory" in capsys.readouterr().err
+
+###################################################################################################
+###################################################################################################
+
+class Test_verify:
+
+    def select(self, tmp_path, distfile, cutoff, options=""):
+        resultfile = tmp_path / "selected.txt"
+        grsub.main(f"--val dist -c {cutoff} {options} {distfile} {resultfile}".split())
+        return resultfile
+
+    def test_valid_selection(self, tmp_path, random_pairfile_50nodes, capsys):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        resultfile = self.select(tmp_path, distfile, cutoff)
+        capsys.readouterr()
+        assert grsub.main(f"verify --val dist -c {cutoff} {distfile} {resultfile}".split()) == 0
+        assert "OK: no neighbors in selection, and selection is maximal" in capsys.readouterr().out
+
+    def test_neighbors_in_selection(self, tmp_path, random_pairfile_50nodes, capsys):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        resultfile = self.select(tmp_path, distfile, cutoff)
+        selection = resultfile.read_text().splitlines()
+        n1, n2 = next((n1, n2) for n1, n2 in pairs if n1 in selection or n2 in selection)
+        selection = sorted(set(selection) | {n1, n2})
+        resultfile.write_text("\n".join(selection) + "\n")
+        capsys.readouterr()
+        assert grsub.main(f"verify --val dist -c {cutoff} {distfile} {resultfile}".split()) == 1
+        assert "FAILED: selection contains neighbors" in capsys.readouterr().out
+        args = grsub.parse_commandline(f"--val dist -c {cutoff} {distfile} {resultfile}".split())
+        result = grsub.verify_selection(args, selection)
+        expected = [pair for pair in pairs if pair[0] in selection and pair[1] in selection]
+        assert result["violations"] == len(expected)
+        assert {frozenset(pair[:2]) for pair in result["violationlist"]} <= {frozenset(pair) for pair in expected}
+
+    def test_not_maximal(self, tmp_path, random_pairfile_50nodes):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        resultfile = self.select(tmp_path, distfile, cutoff)
+        selection = resultfile.read_text().splitlines()
+        args = grsub.parse_commandline(f"--val dist -c {cutoff} {distfile} {resultfile}".split())
+        result = grsub.verify_selection(args, selection[1:])
+        assert result["violations"] == 0
+        assert selection[0] in result["nonmaximallist"]
+        assert result["nnames"] == len(nodes)
+
+    def test_chunks_and_npy(self, tmp_path, random_pairfile_50nodes, capsys):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        resultfile = self.select(tmp_path, distfile, cutoff, "--outformat npy")
+        assert set(grsub.read_selection(resultfile)) <= nodes
+        capsys.readouterr()
+        commandlist = f"verify --val dist -c {cutoff} --chunk 0.0001 {distfile} {resultfile}".split()
+        assert grsub.main(commandlist) == 0
+        assert "selection is maximal" in capsys.readouterr().out
+
+    def test_parquet(self, tmp_path, random_pairfile_50nodes):
+        pa = pytest.importorskip("pyarrow")
+        pq = pytest.importorskip("pyarrow.parquet")
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        rows = [line.split() for line in distfile.read_text().splitlines()]
+        parquetfile = tmp_path / "pairs.parquet"
+        pq.write_table(pa.table({"query": [r[0] for r in rows], "target": [r[1] for r in rows],
+                                 "dist": [float(r[2]) for r in rows]}), parquetfile, row_group_size=100)
+        resultfile = self.select(tmp_path, distfile, cutoff)
+        assert grsub.main(f"verify --val dist -c {cutoff} {parquetfile} {resultfile}".split()) == 0
+        assert grsub.main(f"verify --val dist -c {cutoff * 3} {parquetfile} {resultfile}".split()) == 1
+
+    def test_na_like_names(self, tmp_path, capsys):
+        distfile = tmp_path / "dist.txt"
+        distfile.write_text("NA b 1\nnull c 9\nc d 9\n")
+        resultfile = tmp_path / "selected.txt"
+        resultfile.write_text("NA\nb\nnull\nc\nd\n")
+        args = grsub.parse_commandline(f"--val dist -c 5 {distfile} {resultfile}".split())
+        result = grsub.verify_selection(args, ["NA", "b", "null", "c", "d"])
+        assert result["nnames"] == 5
+        assert result["violations"] == 1
+        assert [tuple(pair[:2]) for pair in result["violationlist"]] == [("NA", "b")]
+        assert result["unknown"] == 0
+        capsys.readouterr()
+        assert grsub.main(f"verify --val dist -c 5 {distfile} {resultfile}".split()) == 1
+        assert "NA b 1" in capsys.readouterr().out
+
+    def test_missing_names(self, tmp_path):
+        pa = pytest.importorskip("pyarrow")
+        pq = pytest.importorskip("pyarrow.parquet")
+        parquetfile = tmp_path / "pairs.parquet"
+        pq.write_table(pa.table({"query": ["a", None], "target": ["b", "c"], "dist": [1.0, 2.0]}), parquetfile)
+        resultfile = tmp_path / "selected.txt"
+        resultfile.write_text("a\nc\n")
+        args = grsub.parse_commandline(f"--val dist -c 5 {parquetfile} {resultfile}".split())
+        with pytest.raises(Exception, match="missing"):
+            grsub.verify_selection(args, ["a", "c"])
+
+    def test_required_options(self, random_pairfile_50nodes):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        with pytest.raises(SystemExit):
+            grsub.main(f"verify -c {cutoff} {distfile} out.txt".split())
+
+###################################################################################################
+###################################################################################################
+
+class Test_estimate:
+
+    def greedy_min(self, distfile, cutoff, tmp_path):
+        resultfile = tmp_path / f"min_{cutoff}.txt"
+        grsub.main(f"--val dist -c {cutoff} {distfile} {resultfile}".split())
+        return len(resultfile.read_text().splitlines())
+
+    def test_parse_cutoffs(self):
+        assert grsub.parse_cutoffs("0.9,0.5, 0.7") == [0.5, 0.7, 0.9]
+        with pytest.raises(Exception):
+            grsub.parse_cutoffs("0.5,x")
+
+    @pytest.mark.parametrize("options", ["-k keep.txt", "--stream", "--folds 3", "--clusters c.txt"])
+    def test_incompatible_options(self, random_pairfile_50nodes, options):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        with pytest.raises(SystemExit):
+            grsub.parse_commandline(f"--estimate 1,2 {options} --val dist {distfile} x".split())
+
+    def test_cutoff_not_required(self, random_pairfile_50nodes):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        args = grsub.parse_commandline(f"--estimate 2,1 --val dist {distfile} x".split())
+        assert args.estimate == [1.0, 2.0]
+        with pytest.raises(SystemExit):
+            grsub.parse_commandline(f"--val dist {distfile} x".split())
+
+    def test_exact_when_all_sampled(self, tmp_path, random_pairfile_50nodes):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        resultfile = tmp_path / "estimate.tsv"
+        grsub.main(f"--estimate {cutoff},{cutoff * 3} --val dist {distfile} {resultfile}".split())
+        lines = resultfile.read_text().splitlines()
+        assert lines[0].split("\t") == grsub.estimate_columns
+        for line in lines[1:]:
+            values = dict(zip(grsub.estimate_columns, line.split("\t")))
+            expected = self.greedy_min(distfile, values["cutoff"], tmp_path)
+            assert int(values["sampled"]) == 50
+            assert float(values["estimate"]) == float(values["ci_low"]) == float(values["ci_high"]) == expected
+
+    def test_subsample(self, tmp_path, random_pairfile_50nodes):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        resultfile = tmp_path / "estimate.tsv"
+        args = grsub.parse_commandline(f"--estimate {cutoff} --estimate-size 25 --val dist {distfile} {resultfile}".split())
+        results = grsub.run_selection(args)
+        result = results[0]
+        assert 0 < result["sampled"] < 50
+        assert result["selected"] <= result["estimate"] <= 50
+        assert result["ci_low"] <= result["estimate"] <= result["ci_high"]
+
+    def test_extrapolate_subset(self):
+        # Sizes proportional to fraction: estimate is linear extrapolation
+        assert grsub.extrapolate_subset([0.1, 0.2, 0.4], [10, 20, 40]) == pytest.approx(100)
+        # Saturating sizes: estimate between largest sample and linear extrapolation
+        estimate = grsub.extrapolate_subset([0.1, 0.2, 0.4], [10, 15, 20])
+        assert 20 <= estimate < 50
+        assert grsub.extrapolate_subset([0.5, 1.0], [10, 12]) == 12
+
+###################################################################################################
+###################################################################################################
+
+class Test_pair_agg:
+
+    @pytest.fixture()
+    def duplicate_pairfile(self, tmp_path):
+        rng = random.Random(3)
+        names = [f"n{i}" for i in range(60)]
+        lines = [(rng.choice(names), rng.choice(names), round(rng.random(), 3)) for i in range(1500)]
+        distfile = tmp_path / "pairs.txt"
+        distfile.write_text("".join(f"{n1} {n2} {val}\n" for n1, n2, val in lines))
+        return distfile, lines
+
+    def expected(self, lines, policy, valuetype, cutoff):
+        """Returns (set of neighbor pairs, sum of values) computed directly from lines"""
+        values = {}
+        for n1, n2, val in lines:
+            if n1 != n2:
+                values.setdefault(frozenset((n1, n2)), []).append(val)
+        combine = {"max": max, "min": min, "mean": lambda x: sum(x) / len(x), "first": lambda x: x[0]}[policy]
+        values = {pair: combine(vals) for pair, vals in values.items()}
+        if valuetype == "sim":
+            neighbors = {pair for pair, val in values.items() if val > cutoff}
+        else:
+            neighbors = {pair for pair, val in values.items() if val < cutoff}
+        return neighbors, sum(values.values())
+
+    def test_aggregator(self):
+        aggregator = grsub.PairAggregator("mean")
+        aggregator.add([1, 0, 2], [0, 1, 3], [1.0, 3.0, 5.0])
+        aggregator.add([3, 1, 4], [2, 0, 4], [7.0, 5.0, 1.0])
+        ids1, ids2, values = aggregator.pairs()
+        # Pairs in order first seen, with orientation of first line
+        assert list(zip(ids1.tolist(), ids2.tolist(), values.tolist())) == [(1, 0, 3.0), (2, 3, 6.0), (4, 4, 1.0)]
+        aggregator = grsub.PairAggregator("first")
+        aggregator.add([0, 1], [1, 0], [2.0, 1.0])
+        assert aggregator.pairs()[2].tolist() == [2.0]
+        assert len(grsub.PairAggregator("max").pairs()[0]) == 0
+
+    @pytest.mark.parametrize("policy", ["max", "min", "mean", "first"])
+    @pytest.mark.parametrize("valuetype", ["dist", "sim"])
+    @pytest.mark.parametrize("options", ["--engine python", "--engine pandas --chunk 0.0002", "--no-stats"])
+    def test_policies(self, duplicate_pairfile, policy, valuetype, options):
+        distfile, lines = duplicate_pairfile
+        commandlist = f"--pair-agg {policy} --val {valuetype} -c 0.3 {options} {distfile} out.txt".split()
+        args = grsub.parse_commandline(commandlist)
+        parsed = grsub.PairReader(args, grsub.Progress(None)).read()
+        names = parsed["names"]
+        edges = [frozenset((names[i], names[j])) for i, j in zip(*parsed["edges"])]
+        neighbors, valuesum = self.expected(lines, policy, valuetype, 0.3)
+        assert len(edges) == len(set(edges))
+        assert set(edges) == neighbors
+        if "--no-stats" not in options:
+            assert parsed["valuesum"] == pytest.approx(valuesum)
+
+    def test_parquet(self, tmp_path, duplicate_pairfile):
+        pa = pytest.importorskip("pyarrow")
+        pq = pytest.importorskip("pyarrow.parquet")
+        distfile, lines = duplicate_pairfile
+        parquetfile = tmp_path / "pairs.parquet"
+        pq.write_table(pa.table({"query": [l[0] for l in lines], "target": [l[1] for l in lines],
+                                 "dist": [l[2] for l in lines]}), parquetfile, row_group_size=200)
+        args = grsub.parse_commandline(f"--pair-agg max --val dist -c 0.3 {parquetfile} out.txt".split())
+        parsed = grsub.PairReader(args, grsub.Progress(None)).read()
+        names = parsed["names"]
+        edges = {frozenset((names[i], names[j])) for i, j in zip(*parsed["edges"])}
+        neighbors, valuesum = self.expected(lines, "max", "dist", 0.3)
+        assert edges == neighbors
+        assert parsed["valuesum"] == pytest.approx(valuesum)
+
+    @pytest.mark.parametrize("graph", ["sets", "bitset", "csr"])
+    def test_self_pairs_skipped(self, tmp_path, graph):
+        distfile = tmp_path / "pairs.txt"
+        distfile.write_text("a a 0.0\na b 0.1\nb c 0.9\nc c 0.0\nc d 0.2\n")
+        resultfile = tmp_path / "out.txt"
+        grsub.main(f"--graph {graph} --val dist -c 0.5 {distfile} {resultfile}".split())
+        assert resultfile.read_text().splitlines() == ["a", "c"]
+
+    def test_same_as_none_without_duplicates(self, tmp_path, random_pairfile_50nodes):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        for policy in ["none", "max"]:
+            grsub.main(f"--pair-agg {policy} --val dist -c {cutoff} {distfile} {tmp_path / policy}".split())
+        assert (tmp_path / "none").read_text() == (tmp_path / "max").read_text()
+
+    @pytest.mark.parametrize("options", ["--allpairs", "--stream"])
+    def test_incompatible_options(self, random_pairfile_50nodes, options):
+        distfile, nodes, pairs, cutoff = random_pairfile_50nodes
+        with pytest.raises(SystemExit):
+            grsub.parse_commandline(f"--pair-agg max {options} --val dist -c 1 {distfile} x".split())